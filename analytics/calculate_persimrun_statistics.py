@@ -39,6 +39,7 @@ def setup():
     log.info("CALCULATE_PERSIMRUN_STATISTICS - Starting program")
     config = data.getMingConfiguration()
     ming.configure(**config)
+    data.ensure_indexes()
 
 def check_prior_completion():
     """
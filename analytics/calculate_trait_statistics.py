@@ -7,6 +7,9 @@
 Process the fulldataset for trait-level statistics.  This is independent of classify_individual_samples,
 and neither affects the original data set.
 
+Unless MATERIALIZE_SUBSAMPLES is set, the statistics of every sample size and dimensionality studied are
+calculated together from each raw sample, rather than from a separate fulldataset record for each.
+
 """
 
 import ctpy.data as data
@@ -37,6 +40,8 @@ def setup():
     log.info("CALCULATE_TRAIT_STATISTICS - Starting program")
     config = data.getMingConfiguration()
     ming.configure(**config)
+    data.configure_storage_backend(simconfig.STORAGE_BACKEND, simconfig.STORAGE_DIRECTORY)
+    data.ensure_indexes()
 
 def check_prior_completion():
     """
@@ -68,12 +73,15 @@ if __name__ == "__main__":
         log.info("Trait statistics of experiment %s already complete -- exiting", sargs.experiment_name)
         exit(1)
 
-    # Result set for the fulldataset, with no cursor timeout in case it's very large
-    sample_cursor = data.IndividualSampleFullDataset.m.find(dict(),dict(timeout=False))
-
-
-    for sample in sample_cursor:
-        stat = m.TraitStatisticsPerSample(simconfig, sample)
-        stat.process_trait_statistics()
+    if simconfig.MATERIALIZE_SUBSAMPLES is False:
+        # every subsample of a raw sample is calculated from one read of the raw sample, and written in one batch
+        for record in data.find_documents(data.IndividualSample):
+            stat = m.TraitStatisticsPerRawSample(simconfig, record, simconfig.SAMPLE_SIZES_STUDIED, simconfig.DIMENSIONS_STUDIED)
+            stat.process_trait_statistics()
+    else:
+        # Result set for the fulldataset
+        for sample in data.find_documents(data.IndividualSampleFullDataset):
+            stat = m.TraitStatisticsPerSample(simconfig, sample)
+            stat.process_trait_statistics()
 
     record_completion()
\ No newline at end of file
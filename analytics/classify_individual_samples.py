@@ -9,7 +9,13 @@ identifying all samples to all of the classifications (matching samples of dimen
 to classifications of the same dimensionality).  Insert the results into
 individual_sample_classified.
 
-Uses workerpool to create a number of parallel threads to speed processing
+The fulldataset is read once per dimensionality, with each sample identified to every
+classification of that dimensionality in the same pass.
+
+With --parallelization N (N > 1), the fulldataset is sharded by simulation_run_id (and ranges
+of replication, if there are fewer simulation runs than shards), and the shards are processed by
+a pool of N worker processes.  Each worker opens its own database connection and reads its shards
+directly, writing its results as it goes.  --parallelization 1 runs serially in a single process.
 
 """
 
@@ -19,6 +25,8 @@ import ctpy.utils as utils
 import ming
 import logging as log
 import datetime as datetime
+import multiprocessing
+import os
 
 
 def setup():
@@ -34,12 +42,16 @@ def setup():
 
     log.debug("experiment name: %s", sargs.experiment_name)
     data.set_experiment_name(sargs.experiment_name)
+    data.set_genotype_encoding(simconfig.GENOTYPE_ENCODING)
     data.set_database_hostname(sargs.database_hostname)
     data.set_database_port(sargs.database_port)
 
     log.info("CLASSIFY_INDIVIDUAL_SAMPLES_PARALLEL - Starting program")
     config = data.getMingConfiguration()
     ming.configure(**config)
+    data.configure_storage_backend(simconfig.STORAGE_BACKEND, simconfig.STORAGE_DIRECTORY)
+    data.configure_buffered_writer(simconfig.WRITE_BUFFER_DOCUMENTS, simconfig.WRITE_BUFFER_SECONDS)
+    data.ensure_indexes()
 
 def check_prior_completion():
     """
@@ -65,6 +77,46 @@ def record_completion():
     experiment_record.m.save()
 
 
+def classify_parallel(classifications, num_processes):
+    """
+    Shards the fulldataset by simulation run and replication, and identifies the shards in a pool of
+    worker processes.  We make several shards per process so that uneven shard sizes balance out.
+
+    :return: none
+    """
+    shards = data.partition_by_simulation_run(data.get_simulation_run_ids(), simconfig.REPLICATIONS_PER_PARAM_SET,
+                                              num_processes * 4)
+    log.info("Classifying %s shards with %s worker processes", len(shards), num_processes)
+
+    pool = multiprocessing.Pool(processes=num_processes, initializer=worker_setup,
+                                initargs=(sargs.experiment_name, sargs.database_hostname, sargs.database_port))
+    total_samples = 0
+    try:
+        for (shard, num_samples) in pool.imap_unordered(classify_shard_worker, [(classifications, shard) for shard in shards]):
+            total_samples += num_samples
+            log.debug("shard %s complete: %s samples", shard, num_samples)
+        pool.close()
+    except KeyboardInterrupt:
+        log.info("classification interrupted by ctrl-c")
+        pool.terminate()
+        exit(1)
+    pool.join()
+    log.info("Classified %s samples in %s shards", total_samples, len(shards))
+
+
+def worker_setup(experiment_name, hostname, port):
+    data.configure_worker_database(experiment_name, hostname, port)
+    data.configure_buffered_writer(simconfig.WRITE_BUFFER_DOCUMENTS, simconfig.WRITE_BUFFER_SECONDS)
+
+
+def classify_shard_worker(work):
+    (classifications, shard) = work
+    classifier = cg.MultipleClassificationStatsPerSample(simconfig, classifications, save_identified_indiv=True)
+    num_samples = classifier.identify_individual_samples(criteria=shard)
+    log.info("classification worker %s: completed shard %s with %s samples", os.getpid(), shard, num_samples)
+    return (shard, num_samples)
+
+
 if __name__ == "__main__":
     setup()
     if check_prior_completion() == True:
@@ -77,8 +129,12 @@ if __name__ == "__main__":
     classifications = data.ClassificationData.m.find().all()
 
 
-    for classification in classifications:
-        classifier = cg.ClassificationStatsPerSample(simconfig, classification, save_identified_indiv=True)
+    num_processes = int(sargs.parallelization)
+    if num_processes > 1:
+        classify_parallel(classifications, num_processes)
+    else:
+        # each dimensionality of the fulldataset is read once, and identified to all classifications in the same pass
+        classifier = cg.MultipleClassificationStatsPerSample(simconfig, classifications, save_identified_indiv=True)
         classifier.identify_individual_samples()
 
     record_completion()
\ No newline at end of file
@@ -7,6 +7,15 @@
 Process the fulldataset and postclassification data sets for Slatkin exact tests.  Use multiprocessing for
 parallelism, because this takes a LONG time to run (even with compound indices) on 10MM data points.
 
+The samples are sharded by simulation_run_id, one shard per simulation run, and the shards are processed by a
+pool of worker processes.  Each worker opens its own database connection, reads its shard directly, and writes
+its results in bulk before reporting the shard complete, so no documents cross process boundaries.  Completed
+shards are checkpointed in the experiment's tracking record, and an interrupted run resumes with the remaining
+shards when restarted.
+
+Setting SLATKIN_CACHE_FILENAME in the configuration file gives all of the worker processes a shared,
+persistent cache of Slatkin test results, keyed by the sorted configuration of counts.
+
 """
 
 import logging as log
@@ -18,8 +27,6 @@ import ctpy.coarsegraining as cg
 import ctpy.math as m
 import multiprocessing
 import os
-import sys
-import time
 
 
 
@@ -51,149 +58,78 @@ def setup():
     data.set_database_port(args.dbport)
     config = data.getMingConfiguration()
     ming.configure(**config)
+    data.configure_storage_backend(simconfig.STORAGE_BACKEND, simconfig.STORAGE_DIRECTORY)
+    data.configure_buffered_writer(simconfig.WRITE_BUFFER_DOCUMENTS, simconfig.WRITE_BUFFER_SECONDS)
+    data.ensure_indexes()
 
 
 
 
 def main():
-    global tqueue, pcqueue, process_list
-    process_list = []
-
-
-    if(args.collection == 'traits'):
-        log.info("Processing trait collection for Slatkin retrofit")
-        tqueue = multiprocessing.JoinableQueue()
-        trait_sample_cursor = data.IndividualSampleFullDataset.m.find(dict(),dict(timeout=False))
-        create_queueing_process(tqueue, trait_sample_cursor, queue_worker)
-        # to avoid a race condition where the workers start up and find the queue empty, we wait a bit
-        time.sleep(5)
-        create_processes(tqueue, traits_worker)
-        try:
-            tqueue.join()
-        except KeyboardInterrupt:
-            log.info("trait processing interrupted by ctrl-c")
-            for proc in process_list:
-                proc.terminate()
-            exit(1)
-
-    elif(args.collection == 'postclassification'):
-        pcqueue = multiprocessing.JoinableQueue()
-        classified_sample_cursor = data.IndividualSampleClassified.m.find(dict(),dict(timeout=False))
-        create_queueing_process(pcqueue, classified_sample_cursor, queue_worker)
-        # to avoid a race condition where the workers start up and find the queue empty, we wait a bit
-        time.sleep(5)
-        create_processes(pcqueue, postclassification_worker)
-        try:
-            pcqueue.join()
-        except KeyboardInterrupt:
-            log.info("postclassification processing interrupted by ctrl-c")
-            for proc in process_list:
-                proc.terminate()
-            exit(1)
-
-    else:
-        log.error("Collection argument not recognized")
-
-    log.info("collection processing complete")
-
-
-def create_queueing_process(queue, cursor, worker):
-    process = multiprocessing.Process(target=worker, args=(queue, cursor, simconfig, args))
-    process.daemon = True
-    process_list.append(process)
-    process.start()
-
-def create_processes(queue, worker):
-    for i in range(0, int(args.parallelism)):
-        process = multiprocessing.Process(target=worker, args=(queue, simconfig, args))
-        process.daemon = True
-        process_list.append(process)
-        process.start()
-
-
-
-
-def postclassification_worker(queue, simconfig, args):
-    completed_count = 0
-    while True:
-        try:
-            sample = queue.get()
-            cg.update_with_slatkin_test(simconfig, sample)
-            completed_count += 1
-
-            if(completed_count % 1000 == 0):
-                log.info("postclassification worker %s: completed %s samples", os.getpid(), completed_count )
-
-        finally:
-            queue.task_done()
-
-
-def traits_worker(queue, simconfig, args):
-    completed_count = 0
-    while True:
-        try:
-            sample = queue.get()
-            stat = m.TraitStatisticsPerSample(simconfig, sample)
-            stat.update_with_slatkin_test()
-            completed_count += 1
-
-            if(completed_count % 100 == 0):
-                log.info("trait worker %s: completed %s samples", os.getpid(), completed_count )
-
-        finally:
-            queue.task_done()
-
-
-def queue_worker(queue, cursor, simconfig, args):
+    num_processes = int(args.parallelism)
+    stage = "slatkin-retrofit-" + args.collection
+    log.info("Processing %s collection for Slatkin retrofit", args.collection)
+
+    # shards must not depend on the number of processes, so that checkpointed shards stay valid on restart
+    shards = [dict(simulation_run_id=run_id) for run_id in data.get_simulation_run_ids()]
+    completed = data.get_completed_partitions(args.experiment)
+    remaining = [shard for shard in shards if data.partition_key(stage, shard) not in completed]
+    log.info("Retrofitting %s of %s shards with %s worker processes", len(remaining), len(shards), num_processes)
+
+    pool = multiprocessing.Pool(processes=num_processes, initializer=worker_setup,
+                                initargs=(args.experiment, args.dbhost, args.dbport))
+    total_samples = 0
+    try:
+        for (shard, num_samples) in pool.imap_unordered(retrofit_shard_worker, [(args.collection, shard) for shard in remaining]):
+            data.record_completed_partition(args.experiment, data.partition_key(stage, shard))
+            total_samples += num_samples
+            log.debug("shard %s complete: %s samples", shard, num_samples)
+        pool.close()
+    except KeyboardInterrupt:
+        log.info("%s processing interrupted by ctrl-c", args.collection)
+        pool.terminate()
+        exit(1)
+    pool.join()
+
+    log.info("collection processing complete: %s samples in %s shards", total_samples, len(remaining))
+
+
+def worker_setup(experiment_name, hostname, port):
+    data.configure_worker_database(experiment_name, hostname, port)
+    data.configure_buffered_writer(simconfig.WRITE_BUFFER_DOCUMENTS, simconfig.WRITE_BUFFER_SECONDS)
+
+
+def retrofit_shard_worker(work):
     """
-    Worker routine which will queue database records in batches, so that we can process
-    data that will not fit in RAM.
+    Reads one shard of samples directly from the database, and updates the per-generation statistics
+    records of each sample with its Slatkin exact test results.  The updates are flushed before the shard
+    is reported complete.
 
-
-    :param queue:
-    :param cursor:
-    :param simconfig:
-    :param args:
-    :return:
+    :return: tuple of (shard, number of samples processed)
     """
-    BATCH_SIZE = 500
-    completed_count = 0
-    total_records = cursor.count()
-    log.info("queue worker: total records to process: %s", total_records)
-
-    # For large data collections, we'll work 100K at a time for a batch, which shouldn't exceed 1-2 GB of RAM
-    # for the queue.
-    if(total_records > 1000000):
-        BATCH_SIZE = 100000
-    while True:
-        # we can't check queue size on OS X given what multiprocessing calls a "broken" semaphore
-        # implementation, so for dev and test purposes, we do it cruftily
-        try:
-            if(sys.platform == 'darwin'):
-                log.info("queue worker: queuing %s records using OS X timing approximation", BATCH_SIZE)
-                for i in range(0, BATCH_SIZE):
-                    queue.put(cursor.next())
-                if(BATCH_SIZE == 500):
-                    time.sleep(5)
-                else:
-                    time.sleep(60)
-            else:
-                if(queue.qsize() < BATCH_SIZE):
-                    log.info("queue worker: queuing %s records by watching queue size", BATCH_SIZE)
-                    for i in range(0, BATCH_SIZE):
-                        queue.put(cursor.next())
-                time.sleep(5)
-        except StopIteration:
-            log.info("queue worker: final records queued")
-            break
-
-
-
-
+    (collection, shard) = work
+    num_samples = 0
+    if collection == 'postclassification':
+        for sample in data.find_documents(data.IndividualSampleClassified, shard):
+            cg.update_with_slatkin_test(simconfig, sample)
+            num_samples += 1
+    else:
+        if simconfig.MATERIALIZE_SUBSAMPLES is False:
+            # raw samples are read, and viewed at every sample size and dimensionality
+            samples = data.find_subsample_views(simconfig.SAMPLE_SIZES_STUDIED, simconfig.DIMENSIONS_STUDIED, shard)
+        else:
+            samples = data.find_documents(data.IndividualSampleFullDataset, shard)
+        for s in samples:
+            stat = m.TraitStatisticsPerSample(simconfig, s)
+            stat.update_with_slatkin_test()
+            num_samples += 1
 
+    data.flush_buffered_writer()
+    log.info("%s worker %s: completed shard %s with %s samples", collection, os.getpid(), shard, num_samples)
+    return (shard, num_samples)
 
 
 
 if __name__ == "__main__":
     setup()
-    main()
\ No newline at end of file
+    main()
@@ -48,6 +48,8 @@ def setup():
     data.set_database_port(args.dbport)
     config = data.getMingConfiguration()
     ming.configure(**config)
+    data.configure_buffered_writer(simconfig.WRITE_BUFFER_DOCUMENTS, simconfig.WRITE_BUFFER_SECONDS)
+    data.ensure_indexes()
 
 if __name__ == "__main__":
     setup()
@@ -66,12 +68,16 @@ if __name__ == "__main__":
     if(args.collections == 'traits' or args.collections == 'both'):
         # get a reference to the individual sample fulldata set for traits, no timeout
         # iterate, calling trait_statistics to update slatkin
-        trait_sample_cursor = data.IndividualSampleFullDataset.m.find(dict(),dict(timeout=False))
+        if simconfig.MATERIALIZE_SUBSAMPLES is False:
+            trait_sample_cursor = data.find_subsample_views(simconfig.SAMPLE_SIZES_STUDIED, simconfig.DIMENSIONS_STUDIED)
+        else:
+            trait_sample_cursor = data.IndividualSampleFullDataset.m.find(dict(),dict(timeout=False))
 
         for s in trait_sample_cursor:
             stat = m.TraitStatisticsPerSample(simconfig, s)
             stat.update_with_slatkin_test()
 
+    data.flush_buffered_writer()
 
 
     # print a message saying that you should reexport any data sets....
@@ -18,9 +18,13 @@ of the original genotype (e.g., 3 loci instead of 4), or number of individuals (
 sampled rather than 100).
 
 The original sample document **and** each of the subsampled documents are inserted into
-individual_sample_fulldataset.  This collection is then usable for further data reduction, such
+individual_sample_fulldataset, with bulk inserts for each batch of raw samples.  The last raw sample of each
+completed batch is recorded in the experiment record, and an interrupted run resumes after it.  This collection is then usable for further data reduction, such
 as classification, time averaging, or other statistical analysis.
 
+If the configuration sets MATERIALIZE_SUBSAMPLES to false, no copies are made, and the later stages
+read ctpy.data.SubsampleView's of the raw samples instead.
+
 """
 import logging as log
 import argparse
@@ -28,7 +32,6 @@ import ming
 import ctpy.data as data
 import ctpy.utils as utils
 import datetime as datetime
-import itertools
 
 
 ## setup
@@ -45,6 +48,7 @@ def setup():
 
     log.debug("experiment name: %s", sargs.experiment_name)
     data.set_experiment_name(sargs.experiment_name)
+    data.set_genotype_encoding(simconfig.GENOTYPE_ENCODING)
     data.set_database_hostname(sargs.database_hostname)
     data.set_database_port(sargs.database_port)
     #### main program ####
@@ -52,6 +56,9 @@ def setup():
     log.info("Performing subsampling for experiment named: %s", data.experiment_name)
     config = data.getMingConfiguration()
     ming.configure(**config)
+    data.configure_storage_backend(simconfig.STORAGE_BACKEND, simconfig.STORAGE_DIRECTORY)
+    data.configure_buffered_writer(simconfig.WRITE_BUFFER_DOCUMENTS, simconfig.WRITE_BUFFER_SECONDS)
+    data.ensure_indexes()
 
 
 def check_prior_completion():
@@ -79,85 +86,92 @@ def record_completion():
     experiment_record.m.save()
 
 
-def record_full_subsample(s,new_dimen,new_ssize,new_sample):
-    data.storeIndividualSampleFullDataset(s.replication,
-                                          new_dimen,
-                                          new_ssize,
-                                          s.simulation_time,
-                                          s.mutation_rate,
-                                          s.population_size,
-                                          s.simulation_run_id,
-                                          new_sample
-                                          )
-
-def subsample_for_dimension(dimension, sample_id, genotype_list):
+def get_checkpoint():
     """
-    Takes a list of genotypes and the desired number of loci to subsample, and returns
-    that number of loci from the list
-    :param dimension:
-    :param genotype_list:
-    :return: list of genotypes
+    :return: ObjectId of the last raw sample whose subsamples were all written, or None
     """
-    return dict(id=sample_id,genotype=genotype_list[:dimension])
+    experiment_record = data.ExperimentTracking.m.find(dict(experiment_name=sargs.experiment_name)).one()
+    return experiment_record.get("subsampling_last_id")
 
 
+def record_checkpoint(last_id):
+    """
+    Records the last raw sample whose subsamples have been written, so that an interrupted run
+    resumes after it.
+    :return: none
+    """
+    experiment_record = data.ExperimentTracking.m.find(dict(experiment_name=sargs.experiment_name)).one()
+    experiment_record["subsampling_last_id"] = last_id
+    experiment_record.m.save()
 
-####### main loop #######
 
-if __name__ == "__main__":
-    setup()
-    if check_prior_completion() == True:
-        log.info("Subsampling of experiment %s already complete -- exiting", sargs.experiment_name)
-        exit(1)
+def remove_partial_subsamples(batch):
+    """
+    Subsamples of the first batch after a checkpoint may have been partly written before an interruption,
+    so we remove any which exist before writing the batch.
+    :return: none
+    """
+    for s in batch:
+        data.get_storage_backend().remove(data.IndividualSampleFullDataset,
+                                          dict(simulation_run_id=s.simulation_run_id,
+                                               replication=s.replication,
+                                               simulation_time=s.simulation_time))
 
-    # do the subsampling
-    # one caveat is that we already have a sample from max(DIMENSIONS_STUDIED) and
-    # max(SAMPLE_SIZES_STUDIED) so we need to skip doing that one, and just insert the
-    # original data sample into the fulldataset collection.
-    existing_dimensionality = max(simconfig.DIMENSIONS_STUDIED)
-    existing_sample_size = max(simconfig.SAMPLE_SIZES_STUDIED)
 
-    state_space = [
-        simconfig.SAMPLE_SIZES_STUDIED,
-        simconfig.DIMENSIONS_STUDIED
-    ]
+def subsample_in_batches(batch_size):
+    """
+    Reads the raw samples in batches ordered by _id, starting after the last checkpoint, and writes the
+    subsamples of each batch with bulk inserts.  The storage backend decides how batches are read; with
+    MongoDB, each batch is a separate query, so no cursor is held open long enough for the server to time it out.
+    :return: number of raw samples subsampled
+    """
+    writer = data.get_buffered_writer()
+    last_id = get_checkpoint()
+    query = dict()
+    if last_id is not None:
+        log.info("Resuming subsampling after raw sample %s", last_id)
+        query["_id"] = {'$gt': last_id}
 
+    num_samples = 0
+    first_batch = True
+    for batch in data.find_documents_in_batches(data.IndividualSample, query, sort='_id', batch_size=batch_size):
+        # only a run resumed from a checkpoint can have partly written subsamples, and last_id still holds
+        # the checkpoint until the first batch is finished
+        if first_batch and last_id is not None:
+            remove_partial_subsamples(batch)
+        first_batch = False
 
-    individual_samples =  data.IndividualSample.m.find()
-    # each "individual_sample" has a field called "sample" which is an array of individuals's genotypes
-    for s in individual_samples:
-        for param_combination in itertools.product(*state_space):
-            ssize = param_combination[0]
-            dimen = param_combination[1]
+        for s in batch:
+            for fields in data.subsample_fields(s, simconfig.SAMPLE_SIZES_STUDIED, simconfig.DIMENSIONS_STUDIED):
+                writer.add(data.IndividualSampleFullDataset, fields)
+        writer.flush()
 
-            log.debug("subsampling for ssize %s and dim %s", ssize, dimen)
+        last_id = batch[-1]._id
+        record_checkpoint(last_id)
+        num_samples += len(batch)
+        log.info("Subsampled %s raw samples", num_samples)
 
-            # this is the original sample document
-            if ssize == existing_sample_size and dimen == existing_dimensionality:
-                # record original document into the full sample data set
-                log.debug("Skipping subsampling for documents with existing ssize and dim, just copying")
-                record_full_subsample(s,s.dimensionality,s.sample_size,s.sample)
-                continue
+    return num_samples
 
-            # we subsample each id in the samples array, and then construct a new overall
-            # "individual_sample_fulldataset" document from the original "individual_sample"
-            # document, inserting "subsampled_indiv" in place of the original list.
-            dim_subsampled = []
 
-            for sample in s.sample:
 
-                dim_subsampled.append(subsample_for_dimension(dimen, sample.id, sample.genotype))
+####### main loop #######
 
-            log.debug("dim_subsampled: %s", dim_subsampled)
+if __name__ == "__main__":
+    setup()
+    if check_prior_completion() == True:
+        log.info("Subsampling of experiment %s already complete -- exiting", sargs.experiment_name)
+        exit(1)
 
-            # now dim_subsampled contains the dimension-reduced samples, so we just have
-            # to reduce it by ssize, and the result is our completely subsampled sample.
-            final_subsample = dim_subsampled[:ssize]
-            log.debug("final subsample: %s", final_subsample)
+    if simconfig.MATERIALIZE_SUBSAMPLES is False:
+        # classification and trait statistics read SubsampleView's of the raw samples, so nothing is copied
+        log.info("MATERIALIZE_SUBSAMPLES is False, so subsamples are read as views of the raw samples -- nothing to copy")
+        record_completion()
+        exit(0)
 
-            record_full_subsample(s,dimen,ssize,final_subsample)
+    # each raw sample was taken at max(SAMPLE_SIZES_STUDIED) and max(DIMENSIONS_STUDIED), and is written
+    # to the fulldataset at every combination of sample size and dimensionality, including its own
+    subsample_in_batches(simconfig.SUBSAMPLE_BATCH_SIZE)
 
     # log completion of the subsampling
     record_completion()
-
-
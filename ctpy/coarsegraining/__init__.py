@@ -6,4 +6,5 @@
 # http://creativecommons.org/licenses/GPL/2.0/
 
 import dimension_mode_builder as dmb
-from classification import ClassificationStatsPerSample, ClassificationStatsPerSimrun, update_with_slatkin_test
\ No newline at end of file
+from classification import ClassificationStatsPerSample, ClassificationStatsPerSimrun, MultipleClassificationStatsPerSample, update_with_slatkin_test
+from class_identification import ClassIdentificationEngine, compile_mode_boundaries
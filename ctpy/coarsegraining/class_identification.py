@@ -0,0 +1,143 @@
+# Copyright (c) 2013.  Mark E. Madsen <mark@madsenlab.org>
+#
+# This work is licensed under the Apache Public License 2.0
+#
+# This module contains a vectorized engine for identifying sampled genotypes to the
+# classes of a paradigmatic classification.
+#
+
+"""
+.. module:: class_identification
+    :platform: Unix, Windows
+    :synopsis: NumPy engine for identifying genotypes to paradigmatic classes in bulk.
+
+.. moduleauthor:: Mark E. Madsen <mark@madsenlab.org>
+
+A classification is a list of dimensions, each of which is a list of modes with [lower, upper)
+boundaries.  Rather than walking each individual and each locus, and scanning the list of modes
+for each allele, the engine compiles the boundaries of each dimension into sorted NumPy arrays
+once, and then resolves the modes for a whole (N x D) genotype matrix with np.searchsorted.  An
+allele which falls outside every mode of its dimension raises ValueError, rather than being given
+a wrong class code.
+
+Classes are returned as integer codes, with the modes of each dimension as the digits of a mixed-radix
+number (the first dimension is the most significant digit).  Classified samples store these codes, and
+string class identifiers of the form '0-3-1-2' are only generated when results are exported, via
+class_codes_to_strings().
+
+"""
+
+import logging as log
+import numpy as np
+import ctpy.data as data
+
+
+class ClassIdentificationEngine:
+    # compiled boundary arrays are shared by all engines, since many classifications reuse the same dimensions
+    compiled_mode_cache = dict()
+
+    def __init__(self, classification):
+        self.class_id = classification["_id"]
+        self.dimensionality = classification["dimensions"]
+
+        self.lower_boundaries = []
+        self.upper_boundaries = []
+        for mode_id in classification["modes_for_dimensions"]:
+            (lower, upper) = self._get_and_cache_compiled_modes(mode_id)
+            self.lower_boundaries.append(lower)
+            self.upper_boundaries.append(upper)
+
+        self.modes_per_dimension = np.array([len(b) for b in self.lower_boundaries], dtype=np.int64)
+
+        # place values for the mixed-radix class code, with the first dimension most significant
+        self.place_values = np.ones(self.dimensionality, dtype=np.int64)
+        for dim_num in range(self.dimensionality - 2, -1, -1):
+            self.place_values[dim_num] = self.place_values[dim_num + 1] * self.modes_per_dimension[dim_num + 1]
+
+        self.num_classes = int(np.prod(self.modes_per_dimension))
+
+
+    def identify_modes(self, genotypes):
+        """
+        Identifies each allele to the mode of its dimension.  Genotypes may be a single sample (N x loci)
+        or a batch of samples (B x N x loci), with at least as many loci as the classification has dimensions;
+        only the first D loci are used.
+
+        :param genotypes: integer array of alleles, loci in the last axis
+        :return: integer array of mode indices, with the same shape as genotypes[..., :D]
+        :raises ValueError: if an allele is not within any mode of its dimension
+        """
+        genotypes = np.asarray(genotypes)
+        modes = np.empty(genotypes.shape[:-1] + (self.dimensionality,), dtype=np.int64)
+
+        for dim_num in range(0, self.dimensionality):
+            alleles = genotypes[..., dim_num]
+            # modes are [lower, upper), so the only candidate mode is the last one whose lower boundary <= the allele
+            candidates = np.searchsorted(self.lower_boundaries[dim_num], alleles, side='right') - 1
+            within = (candidates >= 0) & (alleles < self.upper_boundaries[dim_num][np.maximum(candidates, 0)])
+            if not np.all(within):
+                log.error("%s alleles of dimension %s are outside the modes of classification %s, e.g. %s",
+                          np.count_nonzero(~within), dim_num, self.class_id, alleles[~within].flat[0])
+                raise ValueError("alleles outside the modes of dimension %s" % dim_num)
+            modes[..., dim_num] = candidates
+
+        return modes
+
+
+    def identify(self, genotypes):
+        """
+        Identifies each genotype in a sample (or batch of samples) to a class of the classification.
+
+        :param genotypes: integer array of alleles, loci in the last axis
+        :return: integer array of class codes, with the shape of genotypes minus the loci axis
+        """
+        modes = self.identify_modes(genotypes)
+        return np.dot(modes, self.place_values)
+
+
+    def class_codes_to_modes(self, codes):
+        """
+        Decodes integer class codes into the mode index for each dimension.
+
+        :param codes: integer array of class codes
+        :return: integer array with an additional trailing axis of length D
+        """
+        codes = np.asarray(codes, dtype=np.int64)
+        return (codes[..., np.newaxis] // self.place_values) % self.modes_per_dimension
+
+
+    def class_codes_to_strings(self, codes):
+        """
+        Decodes a list of integer class codes to string class identifiers, of the form '0-3-1-2'.
+
+        :param codes: 1D integer array of class codes
+        :return: list of strings
+        """
+        return data.decode_class_codes(codes, self.modes_per_dimension)
+
+
+    def _get_and_cache_compiled_modes(self, mode_id):
+        if mode_id in self.compiled_mode_cache:
+            return self.compiled_mode_cache[mode_id]
+        else:
+            mode_defn = data.ClassificationModeDefinitions.m.find(dict(_id=mode_id)).one()
+            compiled = compile_mode_boundaries(mode_defn["boundary_map"])
+            self.compiled_mode_cache[mode_id] = compiled
+            return compiled
+
+
+
+def compile_mode_boundaries(boundary_map):
+    """
+    Takes the list of mode boundary dicts for a dimension, as stored in ClassificationModeDefinitions,
+    and returns sorted arrays of the lower and upper boundaries of each mode, suitable for np.searchsorted.
+
+    :param boundary_map: list of dicts with "lower" and "upper" keys
+    :return: tuple of float arrays (lower boundaries, upper boundaries), in mode order
+    """
+    lower = np.array([mode["lower"] for mode in boundary_map], dtype=np.float64)
+    upper = np.array([mode["upper"] for mode in boundary_map], dtype=np.float64)
+    if np.any(np.diff(lower) < 0) or np.any(upper[:-1] > lower[1:]):
+        log.error("Mode boundaries are not in ascending order: %s", boundary_map)
+        raise ValueError("mode boundaries must be in ascending order")
+    return (lower, upper)
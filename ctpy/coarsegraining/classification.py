@@ -12,113 +12,52 @@ from bson.objectid import ObjectId
 import logging as log
 from collections import defaultdict
 import numpy as np
-from slatkin import montecarlo   # https://github.com/mmadsen/slatkin-exact-tools
-import itertools
 import pprint as pp
+from class_identification import ClassIdentificationEngine
 
 class ClassificationStatsPerSimrun:
 
 
     def __init__(self, simconfig):
         self.simconfig = simconfig
-        self.simrun_param_cache = None
-        self.param_cached = False
+        self.classification_ids = None
 
 
     def process_simulation_run(self, simrun_id):
         """
         Process the individual samples for a single simulation run, calculating any statistics that
-        require aggregation over the simulation run, saving the results to the database.  This requires
-        that we process each "replication" separately, so that we do not mix them together.
+        require aggregation over the simulation run, saving the results to the database.  Each
+        replication and classification is aggregated separately, so that we do not mix them together.
+
+        The earliest time of appearance of each class is found in a single aggregation over the whole
+        simulation run (see data.class_first_appearances), rather than by reading the samples of each
+        replication and classification into Python.
 
         :return:
         """
         #log.debug("Starting analysis of simulation run %s", simrun_id)
+        groups = data.class_first_appearances(simrun_id, self._get_classification_ids())
+        if len(groups) == 0:
+            log.info("No samples in the database for simulation run: %s", simrun_id)
+            return
+        log.info("Samples found for simulation run: %s", simrun_id)
 
-        combinations = [
-            range(0,self.simconfig.REPLICATIONS_PER_PARAM_SET),
-            self._get_classification_ids()
-        ]
-
-        for par in itertools.product(*combinations):
-            repl = par[0]
-            classif = par[1]
-            log.debug("Processing combination %s - %s", repl, classif)
-            records = self._get_samples_for_simulation_run(simrun_id, repl, classif)
-            if records.count() < 1:
-                log.info("No samples in the database for simulation run: %s", simrun_id)
-                return
-            else:
-                log.info("Samples found for simulation run: %s", simrun_id)
-
-
-
-            class_time_cache = {}
-
-            # classification info
-
-
-            for s in records:
-                #log.debug("starting analysis of record")
-                #log.debug("record: %s", s)
-
-                # Only do this once - keep one of the records around so we can snag parameters from it later,
-                # outside the processing loop
-                if self.param_cached is False:
-                    self.simrun_param_cache = s
-                    self.param_cached = True
-
-
-
-                gen = s.simulation_time
-
-                for indiv in s.sample:
-                    class_id = indiv.classid
-
-                    # if we find an instance of the class showing up earlier than the cached time, record the earlier time
-                    if class_id not in class_time_cache:
-                        class_time_cache[class_id] = gen
-                    else:
-                        if class_time_cache[class_id] > gen:
-                            class_time_cache[class_id] = gen
+        # TODO:  Removed interval statistics 9/8/2013 in 1.0.2.  Need to rethink the strategy given lots of zeros and sampling intervals
+        for g in groups:
+            log.debug("Processing combination %s - %s", g["replication"], g["classification_id"])
+            data.storePerSimrunStatsPostclassification(g["classification_id"],g["classification_type"],g["classification_dim"],
+                                                       g["classification_coarseness"],g["replication"],g["sample_size"],
+                                                       g["population_size"],g["mutation_rate"],simrun_id,
+                                                       g["class_time_first_appearance"],None,None)
 
-            # the cache now contains the earliest time of appearance of all classes in the simulation run
-            #log.debug("cache: %s", class_time_cache)
-            class_time_appeared = [dict(classid=k,time=v) for k,v in class_time_cache.items()]
-            #log.debug("%s", class_time_appeared)
 
-            # calculate other stats...
-            #stats = self._innovation_interval_stats(class_time_cache)
-
-
-            # save the results
-
-            # TODO:  Removed interval statistics 9/8/2013 in 1.0.2.  Need to rethink the strategy given lots of zeros and sampling intervals
-
-
-            s = self.simrun_param_cache
-            data.storePerSimrunStatsPostclassification(s.classification_id,s.classification_type,s.classification_dim,
-                                                       s.classification_coarseness,s.replication,s.sample_size,
-                                                       s.population_size,s.mutation_rate,s.simulation_run_id,class_time_appeared,
-                                                       None,None)
-
-
-
-
-
-    def _get_samples_for_simulation_run(self, simrun_id, replication, classification):
-        """
-
-        :return:
-        """
-        return data.IndividualSampleClassified.m.find(dict(simulation_run_id=simrun_id,replication=replication,classification_id=classification))
 
     def _get_classification_ids(self):
-        res = data.ClassificationData.m.find().all()
-        id_list = []
-        for classification in res:
-            id_list.append(classification["_id"])
-        return id_list
+        # the classifications do not change while the simulation runs are processed, so they are read once
+        if self.classification_ids is None:
+            res = data.ClassificationData.m.find().all()
+            self.classification_ids = [classification["_id"] for classification in res]
+        return self.classification_ids
 
 
 
@@ -149,7 +88,6 @@ class ClassificationStatsPerSimrun:
 
 class ClassificationStatsPerSample:
     # speed things up by caching mode definitions so we hit the DB a minimal number of times
-    mode_definition_cache = dict()
     classification_dimension_cache = dict()
 
     def __init__(self, simconfig, classification, save_identified_indiv=True):
@@ -161,6 +99,7 @@ class ClassificationStatsPerSample:
         self.class_type = classification["classification_type"]
         self.save_indiv = save_identified_indiv
         self.classification_size = self._calc_num_classes()
+        self.engine = ClassIdentificationEngine(classification)
 
         #log.debug("initializing ClassIdentifier for classification %s", self.class_id)
         #log.debug("    Saving identified individuals, in addition to stats? %s", self.save_indiv)
@@ -173,63 +112,55 @@ class ClassificationStatsPerSample:
         Each "sample" is a record from one generation of one replication of one
         simulation run, at a given sample size and dimensionality.  Within each
         sample record is a list of sampled individual genotypes.  This list is
-        what we iterate over to identify via the classification, and then we
-        calculate various stats, and store the resulting stats.  If the flag for
-        saving raw individuals (after classification identification) is set, we
-        also store the list of individuals and the classes to which their genotypes identify.
+        converted to a genotype matrix and identified in a single pass by the
+        ClassIdentificationEngine, and then we calculate various stats, and
+        store the resulting stats.  If the flag for saving raw individuals (after
+        classification identification) is set, we also store the list of
+        individuals and the classes to which their genotypes identify.
 
         :return: None
         """
         log.info("Starting identification of individuals to classification %s", self.class_id)
-                    # these are caches, to be used in other methods
-        global mode_counts_by_dimension, class_counts
         records = self._get_individual_cursor_for_dimensionality(self.dimensionality)
 
         #log.debug("record length: %s", len(records))
 
         for s in records:
-            #log.debug("Starting analysis of record")
-            classified_indiv = []
-            mode_counts_by_dimension = {}
-            class_counts = defaultdict(int)
-
+            genotypes = data.get_genotype_matrix(s)
+            self.process_sample(s, genotypes)
 
-            for dim_num in range(0, self.dimensionality):
-                # initialize a cache
-                mode_counts_by_dimension[dim_num] = defaultdict(int)
 
+    def process_sample(self, s, genotypes):
+        """
+        Identifies a single sample record to the classification, given its genotype matrix, and stores
+        the per-generation statistics (and optionally, the classified individuals).
 
+        :param s: sample record from the fulldataset
+        :param genotypes: integer array (sample size x loci) of the individuals in the sample
+        :return: None
+        """
+        class_codes = self.engine.identify(genotypes)
+        classes, class_counts = np.unique(class_codes, return_counts=True)
 
+        class_freq = [float(count)/float(s.sample_size) for count in class_counts]
+        shannon_entropy = m.diversity_shannon_entropy(class_freq)
+        class_iqv = m.diversity_iqv(class_freq)
+        (slatkin_result, slatkin_replicates) = self._slatkin_neutrality_for_classes(class_counts.tolist())
 
-            for indiv in s.sample:
-                ident_class = self._identify_genotype_to_class(indiv.genotype)
-                ident_indiv = dict(id=indiv.id,classid=ident_class)
-                #log.debug("identified to class: %s", ident_class)
-                classified_indiv.append(ident_indiv)
-
-                class_counts[ident_class] += 1
-
-
-
-            class_freq = [float(count)/float(s.sample_size) for class_id, count in class_counts.items() ]
-            shannon_entropy = m.diversity_shannon_entropy(class_freq)
-            class_iqv = m.diversity_iqv(class_freq)
-            slatkin_result = self._slatkin_neutrality_for_classes(class_counts.values())
-
-
-
-            #log.debug("class freq: %s  shannon entropy: %s   iqv: %s", class_freq, shannon_entropy, class_iqv)
-            stats = self._calc_postclassification_stats(s)
-            #log.debug("class richness %s", len(class_counts))
-            data.storePerGenerationStatsPostclassification(s.simulation_time,ObjectId(self.class_id),self.class_type,self.dimensionality,
-                                                        self.coarseness,self.classification_size,s.replication,s.sample_size,s.population_size,s.mutation_rate,
-                                                        s.simulation_run_id,stats["mode_richness_list"],stats["class_richness"],
-                                                        stats["mode_iqv"],stats["mode_entropy"],class_iqv,shannon_entropy,stats["design_space_occupation"],None,slatkin_result)
+        #log.debug("class freq: %s  shannon entropy: %s   iqv: %s", class_freq, shannon_entropy, class_iqv)
+        stats = self._calc_postclassification_stats(s, genotypes, len(classes))
+        #log.debug("class richness %s", len(class_counts))
+        data.storePerGenerationStatsPostclassification(s.simulation_time,ObjectId(self.class_id),self.class_type,self.dimensionality,
+                                                    self.coarseness,self.classification_size,s.replication,s.sample_size,s.population_size,s.mutation_rate,
+                                                    s.simulation_run_id,stats["mode_richness_list"],stats["class_richness"],
+                                                    stats["mode_iqv"],stats["mode_entropy"],class_iqv,shannon_entropy,stats["design_space_occupation"],None,slatkin_result,
+                                                    slatkin_replicates)
 
-            if self.save_indiv:
-                    data.storeIndividualSampleClassified(s.simulation_time,ObjectId(self.class_id),self.class_type,self.dimensionality,
-                                                        self.coarseness,s.replication,s.sample_size,s.population_size,
-                                                        s.mutation_rate, s.simulation_run_id, classified_indiv)
+        if self.save_indiv:
+            # class codes are stored as integers, with the modes per dimension needed to decode them
+            data.storeIndividualSampleClassified(s.simulation_time,ObjectId(self.class_id),self.class_type,self.dimensionality,
+                                                self.coarseness,s.replication,s.sample_size,s.population_size,
+                                                s.mutation_rate, s.simulation_run_id, class_codes, self.engine.modes_per_dimension)
 
 
 
@@ -237,22 +168,21 @@ class ClassificationStatsPerSample:
     # private analytic methods
 
 
-    def _calc_postclassification_stats(self,s):
-        mode_richness_list = []
-        mode_evenness_iqv_list = []
-        mode_evenness_entropy_list = []
-
-        for dim, dim_dict in sorted(mode_counts_by_dimension.items()):
-            mode_richness_list.append(len(dim_dict))
-            mode_freq = [float(count)/float(s.sample_size) for dim, count in dim_dict.items()]
-            mode_evenness_iqv_list.append(m.diversity_iqv(mode_freq))
-            mode_evenness_entropy_list.append(m.diversity_shannon_entropy(mode_freq))
+    def _calc_postclassification_stats(self, s, genotypes, class_richness):
+        # the trait counts of every dimension are batched CSR-style, so the diversity of all dimensions
+        # is computed in one call
+        counts_by_dimension = [np.unique(genotypes[:, dim], return_counts=True)[1] for dim in range(0, self.dimensionality)]
+        offsets = np.cumsum([0] + [len(counts) for counts in counts_by_dimension])
+        (entropy, iqv, richness) = m.diversity_statistics_batch(np.concatenate(counts_by_dimension), offsets)
+        mode_richness_list = richness.tolist()
+        mode_evenness_iqv_list = iqv.tolist()
+        mode_evenness_entropy_list = entropy.tolist()
 
         #log.debug("mode_richness_list %s", mode_richness_list )
         results = {}
         results["mode_richness_list"] = mode_richness_list
-        results["class_richness"] = len(class_counts)
-        results["design_space_occupation"] = float(len(class_counts)) / float(self.classification_size)
+        results["class_richness"] = class_richness
+        results["design_space_occupation"] = float(class_richness) / float(self.classification_size)
         results["mode_iqv"] = mode_evenness_iqv_list
         results["mode_entropy"] = mode_evenness_entropy_list
 
@@ -263,8 +193,8 @@ class ClassificationStatsPerSample:
         return self.coarseness ** self.dimensionality
 
     def _slatkin_neutrality_for_classes(self, class_counts):
-        (prob, theta) = montecarlo(self.simconfig.SLATKIN_MONTECARLO_REPLICATES, class_counts, len(class_counts))
-        return prob
+        (prob, theta, replicates) = m.slatkin_exact_test(self.simconfig, class_counts)
+        return (prob, replicates)
 
     # private methods
 
@@ -276,22 +206,17 @@ class ClassificationStatsPerSample:
         size of 1000, forcing the pymongo driver to go back to the database before the server times out the cursor.
         This is helpful for datasets with a very large number of samples.
 
+        If the fulldataset is not materialized, returns views of the raw samples at this dimensionality instead.
+
         :param dimensionality:
-        :return: returns a Ming/pymongo cursor for the result set, in batches
+        :return: returns a Ming/pymongo cursor for the result set, in batches, or a generator of SubsampleView
         """
-        sample_cursor = data.IndividualSampleFullDataset.m.find(dict(dimensionality=dimensionality),dict(timeout=False))
+        if self.simconfig.MATERIALIZE_SUBSAMPLES is False:
+            return data.find_subsample_views(self.simconfig.SAMPLE_SIZES_STUDIED, [dimensionality])
+        sample_cursor = data.find_documents(data.IndividualSampleFullDataset, dict(dimensionality=dimensionality))
         return sample_cursor
 
 
-    def _get_and_cache_mode_definition(self, mode_id):
-        if mode_id in self.mode_definition_cache:
-            return self.mode_definition_cache[mode_id]
-        else:
-            mode_defn = data.ClassificationModeDefinitions.m.find(dict(_id=mode_id)).one()
-            self.mode_definition_cache[mode_id] = mode_defn["boundary_map"]
-            return mode_defn["boundary_map"]
-
-
     def _get_and_cache_dimensions_for_classification(self, class_id):
         if class_id in self.classification_dimension_cache:
             return self.classification_dimension_cache[class_id]
@@ -302,38 +227,70 @@ class ClassificationStatsPerSample:
             return dimension_list
 
 
-    def _identify_genotype_to_class(self, genotype):
+
+
+class MultipleClassificationStatsPerSample:
+    """
+    Identifies the fulldataset against many classifications at once.  Samples are streamed from the
+    database once per dimensionality, and each sample's genotype matrix is decoded once and then identified
+    against every classification of that dimensionality, rather than re-reading the fulldataset for each
+    classification.
+    """
+
+    def __init__(self, simconfig, classifications, save_identified_indiv=True):
+        self.simconfig = simconfig
+        self.classifiers_by_dimensionality = defaultdict(list)
+
+        for classification in classifications:
+            classifier = ClassificationStatsPerSample(simconfig, classification, save_identified_indiv)
+            self.classifiers_by_dimensionality[classifier.dimensionality].append(classifier)
+
+
+    def identify_individual_samples(self, criteria=None):
         """
+        Identify all of the samples in the fulldataset to every classification of the same dimensionality,
+        in a single pass over the samples of each dimensionality.
 
-        :param genotype:
-        :return:
+        :param criteria: optional dict of additional query criteria, to restrict the samples processed
+        :return: number of samples processed
         """
-        mode_dimension_id_list = self.classification["modes_for_dimensions"]
+        if self.simconfig.MATERIALIZE_SUBSAMPLES is False:
+            return self._identify_subsample_views(criteria)
 
-        identified_modes = []
+        num_samples = 0
+        for dimensionality, classifiers in sorted(self.classifiers_by_dimensionality.items()):
+            log.info("Starting identification of dimensionality %s samples to %s classifications", dimensionality, len(classifiers))
+            query = dict(dimensionality=dimensionality)
+            if criteria is not None:
+                query.update(criteria)
 
-        for dim_num in range(0, self.dimensionality):
-            dimension_id = mode_dimension_id_list[dim_num]
-            mode_boundaries = self._get_and_cache_mode_definition(dimension_id)
-            trait_for_dim = genotype[dim_num]
+            records = data.find_documents(data.IndividualSampleFullDataset, query)
+            for s in records:
+                genotypes = data.get_genotype_matrix(s)
+                for classifier in classifiers:
+                    classifier.process_sample(s, genotypes)
+                num_samples += 1
 
-            # increment the cached trait count for stats
-            mode_counts_by_dimension[dim_num][trait_for_dim] += 1
+        return num_samples
 
-            #log.debug("mode_boundaries: %s", mode_boundaries)
 
-            for mode_num in range(0, self.coarseness):
-                mode_defn = mode_boundaries[mode_num]
-                lower = mode_defn["lower"]
-                upper = mode_defn["upper"]
-                if lower <= trait_for_dim < upper:
-                    identified_modes.append(mode_num)
-                    break
+    def _identify_subsample_views(self, criteria):
+        """
+        Identifies views of the raw individual samples, when the fulldataset is not materialized.  Each raw
+        sample is read and decoded once, and viewed at every sample size and dimensionality with classifications.
+        """
+        log.info("Starting identification of subsample views of the raw samples to %s dimensionalities",
+                 len(self.classifiers_by_dimensionality))
+        num_samples = 0
+        views = data.find_subsample_views(self.simconfig.SAMPLE_SIZES_STUDIED,
+                                          sorted(self.classifiers_by_dimensionality.keys()), criteria)
+        for s in views:
+            genotypes = s.genotype_matrix()
+            for classifier in self.classifiers_by_dimensionality[s.dimensionality]:
+                classifier.process_sample(s, genotypes)
+            num_samples += 1
 
-            # at the end of looping through the dimensions, we ought to have an ordered list of
-        # which modes the alleles each identified to given the mode boundaries
-        #log.debug("identified modes: %s", identified_modes)
-        return '-'.join([`num` for num in identified_modes])
+        return num_samples
 
 
 
@@ -344,27 +301,20 @@ class ClassificationStatsPerSample:
 def update_with_slatkin_test(simconfig, s):
     """
     Takes an IndividualSampleClassified object, calculates the slatkin exact test for it,
-    and updates the existing pergenerationstats_postclassification object.
+    and updates the existing pergenerationstats_postclassification object.  The update is buffered,
+    so callers should call data.flush_buffered_writer() after their last sample.
 
     :param sample:
     :return:
     """
-    class_counts = defaultdict(int)
-    for indiv in s.sample:
-        class_counts[indiv.classid] += 1
-
-    counts = class_counts.values()
-
-    (prob, theta) = montecarlo(simconfig.SLATKIN_MONTECARLO_REPLICATES, counts, len(counts))
+    (classes, class_counts) = np.unique(data.get_class_codes(s), return_counts=True)
+    counts = class_counts.tolist()
 
-    # find the proper pergeneration object for this sample, and add the slatkin result
-    #
-    record = data.PerGenerationStatsPostclassification.m.find(dict(
-        classification_id=s.classification_id,
-        simulation_run_id=s.simulation_run_id,
-        simulation_time=s.simulation_time,
-        replication=s.replication,
-        sample_size=s.sample_size)).one()
+    (prob, theta, replicates) = m.slatkin_exact_test(simconfig, counts)
 
-    data.updateFieldPerGenerationStatsPostclassification(record._id, "class_neutrality_slatkin", prob )
+    # the slatkin result is set in the pergeneration object for this sample, matched by its key fields, and
+    # written in bulk by the buffered writer
+    data.updateFieldsPerGenerationStatsPostclassification(data.keyPerGenerationStatsPostclassification(s),
+                                                          dict(class_neutrality_slatkin=prob,
+                                                               class_neutrality_slatkin_replicates=replicates))
 
@@ -6,27 +6,39 @@
 # http://creativecommons.org/licenses/GPL/2.0/
 
 import logging as log
+from ming.declarative import Document
 from richness_sample import sampleNumAlleles
 from trait_count_sample import sampleTraitCounts
-from individual_sample import sampleIndividuals, IndividualSample
+from sample_encoding import pack_array, unpack_array, get_individual_ids, get_class_codes, decode_class_codes
+from individual_sample import sampleIndividuals, IndividualSample, get_genotype_matrix
 from simulation_data import storeSimulationData, SimulationRun
 from trait_lifetime import TraitLifetimeCacheIAModels
 from trait_count_population import censusTraitCounts
 from richness_population import censusNumAlleles
-from individual_sample_classified import storeIndividualSampleClassified, IndividualSampleClassified
+from individual_sample_classified import storeIndividualSampleClassified, IndividualSampleClassified, class_first_appearances
 from classification_data import storeClassificationData, ClassificationData
 from classification_mode_definitions import storeClassificationModeDefinition, ClassificationModeDefinitions
-from individual_sample_fulldataset import storeIndividualSampleFullDataset, IndividualSampleFullDataset
-from experiment_tracking import initializeExperimentRecord, storeCompleteExperimentRecord, ExperimentTracking, update_field_by_stage_tag, get_experiment_stage_tags
-from pergeneration_stats_postclassification import storePerGenerationStatsPostclassification, PerGenerationStatsPostclassification, updateFieldPerGenerationStatsPostclassification, columns_to_export_for_analysis
+from individual_sample_fulldataset import storeIndividualSampleFullDataset, IndividualSampleFullDataset, subsample_fields
+from subsample_views import SubsampleView, iter_subsample_views, find_subsample_views
+from experiment_tracking import initializeExperimentRecord, storeCompleteExperimentRecord, ExperimentTracking, update_field_by_stage_tag, get_experiment_stage_tags, get_completed_partitions, record_completed_partition
+from pergeneration_stats_postclassification import storePerGenerationStatsPostclassification, PerGenerationStatsPostclassification, updateFieldPerGenerationStatsPostclassification, keyPerGenerationStatsPostclassification, updateFieldsPerGenerationStatsPostclassification, columns_to_export_for_analysis
 from persimrun_stats_postclassification import storePerSimrunStatsPostclassification, updateFieldPerSimrunStatsPostclassification, PerSimrunStatsPostclassification, columns_to_export_for_analysis
-from pergeneration_stats_traits import storePerGenerationStatsTraits, updateFieldPerGenerationStatsTraits, columns_to_export_for_analysis, PerGenerationStatsTraits
+from pergeneration_stats_traits import storePerGenerationStatsTraits, storePerGenerationStatsTraitsBatch, fieldsPerGenerationStatsTraits, updateFieldPerGenerationStatsTraits, keyPerGenerationStatsTraits, updateFieldsPerGenerationStatsTraits, columns_to_export_for_analysis, PerGenerationStatsTraits
+from work_partitions import get_simulation_run_ids, partition_by_simulation_run, partition_key, configure_worker_database
+from observation import observeGeneration, store_generation_observation, sample_trait_counts
+from simulation_checkpoint import storeSimulationCheckpoint, checkpointPopulation, SimulationCheckpoint, get_checkpoint, get_incomplete_checkpoints, mark_checkpoint_complete, load_checkpoint_populations, remove_samples_after
+from burnin_cache import BurnInCache, burnin_key
+from storage_backend import StorageBackend, MongoStorageBackend, get_storage_backend, configure_storage_backend, find_documents, find_documents_in_batches, insert_into_collection
+from sqlite_backend import SQLiteStorageBackend
+from buffered_writer import BufferedDocumentWriter, get_buffered_writer, configure_buffered_writer, flush_buffered_writer
 
 experiment_name = "test"
 # the following *should* be overridden by command line processing, even by defaults.
 # bogus values are to ensure that CLI processing and configuration is working without bugs
 dbhost = "override"
 dbport = "override"
+# encoding of the individuals in newly stored sample documents, "list" or "binary" (see sample_encoding)
+genotype_encoding = "list"
 
 # When a new module is added for data, the module's filename should be added to the module list below,
 # and the module must support a _get_dataobj_id() method which returns the string used in the Ming ORM
@@ -37,7 +49,8 @@ dbport = "override"
 modules = [individual_sample, trait_count_population, trait_count_sample, richness_sample, richness_population,
            simulation_data, trait_lifetime, classification_data, classification_mode_definitions,
            individual_sample_classified, individual_sample_fulldataset, experiment_tracking,
-           pergeneration_stats_postclassification,persimrun_stats_postclassification,pergeneration_stats_traits]
+           pergeneration_stats_postclassification,persimrun_stats_postclassification,pergeneration_stats_traits,
+           simulation_checkpoint]
 
 
 def getMingConfiguration():
@@ -60,6 +73,22 @@ def getMingConfiguration():
     return config
 
 
+def ensure_indexes():
+    """
+    Builds the indexes declared in the __mongometa__ of each data module's document classes, if they do not
+    already exist.  Called at the start of each analytics stage, after Ming is configured, so that the per-record
+    lookups of samples and statistics are served by an index rather than a collection scan.
+
+    :return: none
+    """
+    for module in modules:
+        for obj in vars(module).values():
+            if isinstance(obj, type) and issubclass(obj, Document) and obj.__module__ == module.__name__:
+                if len(obj.m.indexes) > 0:
+                    log.debug("Ensuring indexes on %s: %s", obj.__mongometa__.name, obj.m.indexes)
+                    obj.m.ensure_indexes()
+
+
 def set_database_hostname(name):
     global dbhost
     dbhost = name
@@ -68,6 +97,18 @@ def set_database_port(port):
     global dbport
     dbport = port
 
+def set_genotype_encoding(encoding):
+    """
+    Takes the encoding used for the individuals in sample documents stored by this process
+
+    :param encoding: "list" or "binary"
+    :return: none
+    """
+    global genotype_encoding
+    if encoding not in ("list", "binary"):
+        raise ValueError("Unknown genotype encoding: %s" % encoding)
+    genotype_encoding = encoding
+
 def set_experiment_name(name):
     """
     Takes the name of the experiment currently being run, for use as a prefix to database collection names
@@ -0,0 +1,154 @@
+# Copyright (c) 2013.  Mark E. Madsen <mark@madsenlab.org>
+#
+# This work is licensed under the Apache Public License 2.0
+#
+"""
+.. module:: buffered_writer
+    :platform: Unix, Windows
+    :synopsis: Buffered bulk insertion of documents written by the per-generation sampling operators.
+
+.. moduleauthor:: Mark E. Madsen <mark@madsenlab.org>
+
+The sampling PyOperators (sampleIndividuals, sampleTraitCounts, censusTraitCounts, sampleNumAlleles,
+censusNumAlleles) can write many small documents each generation, and inserting each one separately means
+that a simulation spends most of its time in MongoDB round trips.  Instead, the operators hand their documents
+to a process-wide BufferedDocumentWriter, which validates each one against the Ming schema of its document class,
+keeps them in a buffer per collection, and inserts them in unordered bulk batches, through the configured
+storage backend.
+
+The buffer is flushed when it holds max_documents documents, when max_seconds have passed since the last flush,
+and when flush_buffered_writer() is called, which simulation scripts should do after evolve() returns.  Any
+documents still buffered are flushed at interpreter exit.
+
+The writer also buffers updates to existing documents, such as the Slatkin test results added to per-generation
+statistics records.  Each update sets fields in the document matched by a natural key computed by the caller, so
+no query is needed before the write, and a flush sends the updates as one unordered bulk $set per collection,
+after the buffered inserts.
+
+"""
+
+import atexit
+import logging as log
+import time
+from storage_backend import get_storage_backend
+from ctpy.utils.configuration import CTPyConfiguration
+
+
+class BufferedDocumentWriter:
+
+    def __init__(self, max_documents=CTPyConfiguration.WRITE_BUFFER_DOCUMENTS,
+                 max_seconds=CTPyConfiguration.WRITE_BUFFER_SECONDS):
+        self.max_documents = max_documents
+        self.max_seconds = max_seconds
+        self.buffers = dict()
+        self.update_buffers = dict()
+        self.num_pending = 0
+        self.last_flush = time.time()
+
+
+    def add(self, document_class, fields):
+        """
+        Validates a document against the schema of its Ming document class, and adds it to the buffer for
+        that class's collection.  The buffers are flushed if they are full, or if the time limit has passed.
+
+        :param document_class: Ming declarative Document subclass (e.g., TraitCountSample)
+        :param fields: dict of field values for one document
+        :return: None
+        """
+        doc = document_class.m.make(fields)
+        self.buffers.setdefault(document_class, []).append(doc)
+        self.num_pending += 1
+        if self.num_pending >= self.max_documents or time.time() - self.last_flush >= self.max_seconds:
+            self.flush()
+
+
+    def update(self, document_class, key, fields):
+        """
+        Adds an update to the buffer for a document class's collection.  The buffers are flushed if they are full,
+        or if the time limit has passed.
+
+        :param document_class: Ming declarative Document subclass (e.g., PerGenerationStatsTraits)
+        :param key: dict of the field values which identify one existing document
+        :param fields: dict of field values to set in that document
+        :return: None
+        """
+        self.update_buffers.setdefault(document_class, []).append((key, fields))
+        self.num_pending += 1
+        if self.num_pending >= self.max_documents or time.time() - self.last_flush >= self.max_seconds:
+            self.flush()
+
+
+    def flush(self):
+        """
+        Inserts all buffered documents, one unordered bulk insert per collection, and then applies all buffered
+        updates, one unordered bulk update per collection.
+
+        :return: number of documents inserted or updated
+        """
+        num_written = 0
+        for document_class, docs in self.buffers.items():
+            if len(docs) == 0:
+                continue
+            # clear the buffer first, so that a failed insert is not retried with the same documents
+            self.buffers[document_class] = []
+            get_storage_backend().insert(document_class, docs)
+            num_written += len(docs)
+
+        for document_class, updates in self.update_buffers.items():
+            if len(updates) == 0:
+                continue
+            self.update_buffers[document_class] = []
+            get_storage_backend().update_many(document_class, updates)
+            num_written += len(updates)
+
+        self.num_pending = 0
+        self.last_flush = time.time()
+        return num_written
+
+
+
+_shared_writer = None
+
+
+def get_buffered_writer():
+    """
+    Returns the process-wide writer used by the sampling operators, creating it with the default
+    WRITE_BUFFER_DOCUMENTS and WRITE_BUFFER_SECONDS limits if configure_buffered_writer() has not been called.
+
+    :return: BufferedDocumentWriter
+    """
+    global _shared_writer
+    if _shared_writer is None:
+        _shared_writer = BufferedDocumentWriter()
+    return _shared_writer
+
+
+def configure_buffered_writer(max_documents, max_seconds):
+    """
+    Sets the flush limits of the process-wide writer, flushing anything already buffered under the old limits.
+
+    :param max_documents: number of buffered documents which triggers a flush
+    :param max_seconds: maximum time in seconds between flushes
+    :return: None
+    """
+    writer = get_buffered_writer()
+    writer.flush()
+    writer.max_documents = max_documents
+    writer.max_seconds = max_seconds
+
+
+def flush_buffered_writer():
+    """
+    Flushes the process-wide writer.  Simulation scripts call this after evolve() completes, so that all samples
+    from a simulation run are in the database before the next run (or analysis) begins.
+
+    :return: number of documents inserted or updated
+    """
+    if _shared_writer is None:
+        return 0
+    num_written = _shared_writer.flush()
+    log.debug("Flushed %s buffered sample documents", num_written)
+    return num_written
+
+
+atexit.register(flush_buffered_writer)
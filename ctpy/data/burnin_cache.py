@@ -0,0 +1,121 @@
+# Copyright (c) 2013.  Mark E. Madsen <mark@madsenlab.org>
+#
+# This work is licensed under the Apache Public License 2.0
+#
+"""
+.. module:: burnin_cache
+    :platform: Unix, Windows
+    :synopsis: Cache of replicate populations which have been evolved to quasi-stationarity.
+
+.. moduleauthor:: Mark E. Madsen <mark@madsenlab.org>
+
+Before any samples are taken, each simulation run evolves its replicates for the number of generations
+given by expectedIAQuasiStationarityTimeHaploid, which often takes longer than the sampling window itself.
+The burn-in depends only on the population size, innovation rate, number of loci, initial trait distribution,
+and random seed, so stationary populations can be saved once and reused by later experiments, or by runs
+which need more replicates than were burned in before.
+
+Populations are saved with simuPOP's Population.save() in a cache directory, together with a small JSON index
+per key.  Requests for more replicates than are cached burn in only the missing replicates, seeded from the
+key's seed and the index of the first new replicate, so cached populations are always reproducible.
+
+"""
+
+import hashlib
+import json
+import logging as log
+import os
+import simuPOP as sim
+from ctpy.utils import combination_seed
+
+
+class BurnInCache:
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+
+    def get_populations(self, popsize, mutation, numloci, initial_distribution, seed, generations, replicates, maxalleles):
+        """
+        Returns replicate populations at the end of burn-in, loading them from the cache where possible,
+        and burning in (and caching) any replicates which are missing.
+
+        :param popsize: population size
+        :param mutation: innovation rate
+        :param numloci: number of loci
+        :param initial_distribution: list of initial allele frequencies
+        :param seed: random seed of the simulation run
+        :param generations: length of burn-in, in generations
+        :param replicates: number of replicate populations needed
+        :param maxalleles: maximum allele value for the KAlleleMutator
+        :return: tuple of (list of populations, number of replicates loaded from the cache)
+        """
+        key = burnin_key(popsize, mutation, numloci, initial_distribution, seed, generations)
+        index = self._read_index(key)
+        num_cached = min(len(index["filenames"]), replicates)
+
+        pops = [sim.loadPopulation(filename) for filename in index["filenames"][:num_cached]]
+        if num_cached > 0:
+            log.info("Reusing %s cached burn-in replicates for popsize %s mutation %s (key %s)", num_cached, popsize, mutation, key)
+
+        if num_cached < replicates:
+            sim.setRNG(seed=combination_seed(seed, (num_cached,)))
+            new_pops = burn_in(popsize, mutation, numloci, initial_distribution, generations, replicates - num_cached, maxalleles)
+            for rep, pop in enumerate(new_pops):
+                filename = os.path.join(self.directory, "%s-rep%s.pop" % (key, num_cached + rep))
+                pop.save(filename + ".tmp")
+                os.rename(filename + ".tmp", filename)
+                index["filenames"].append(filename)
+            self._write_index(key, index)
+            pops.extend(new_pops)
+
+        return (pops, num_cached)
+
+
+    def _index_filename(self, key):
+        return os.path.join(self.directory, "%s.json" % key)
+
+
+    def _read_index(self, key):
+        filename = self._index_filename(key)
+        if not os.path.exists(filename):
+            return dict(filenames=[])
+        with open(filename) as index_file:
+            return json.load(index_file)
+
+
+    def _write_index(self, key, index):
+        filename = self._index_filename(key)
+        with open(filename + ".tmp", "w") as index_file:
+            json.dump(index, index_file)
+        os.rename(filename + ".tmp", filename)
+
+
+
+def burnin_key(popsize, mutation, numloci, initial_distribution, seed, generations):
+    """
+    :return: string key identifying the stationary populations for a set of burn-in parameters
+    """
+    params = (int(popsize), float(mutation), int(numloci), tuple(float(f) for f in initial_distribution),
+              int(seed), int(generations))
+    return hashlib.sha1(repr(params)).hexdigest()[:20]
+
+
+def burn_in(popsize, mutation, numloci, initial_distribution, generations, replicates, maxalleles):
+    """
+    Evolves new replicate populations from the initial trait distribution for the given number of generations,
+    without taking any samples.
+
+    :return: list of populations, each of which continues at the generation after burn-in
+    """
+    pop = sim.Population(size=popsize, ploidy=1, loci=numloci)
+    simu = sim.Simulator(pop, rep=replicates)
+    simu.evolve(
+        initOps = sim.InitGenotype(freq=initial_distribution),
+        matingScheme = sim.RandomSelection(),
+        postOps = [sim.KAlleleMutator(k=maxalleles, rates=mutation)],
+        gen = generations,
+    )
+    return [simu.extract(0) for rep in range(0, replicates)]
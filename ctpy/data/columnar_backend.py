@@ -0,0 +1,312 @@
+# Copyright (c) 2013.  Mark E. Madsen <mark@madsenlab.org>
+#
+# This work is licensed under the Apache Public License 2.0
+#
+"""
+.. module:: columnar_backend
+    :platform: Unix, Windows
+    :synopsis: Storage backend which writes documents to partitioned Parquet files.
+
+.. moduleauthor:: Mark E. Madsen <mark@madsenlab.org>
+
+When many simulation processes write samples to a single mongod, the database becomes the bottleneck.  The
+columnar backend instead writes each batch of documents to its own Parquet file, under
+
+    <directory>/<database>/<collection>/simulation_run_id=<run>/part-<host>-<pid>-<n>.parquet
+
+so any number of processes, on any number of nodes sharing a filesystem, can write without coordination.
+Documents without a simulation_run_id are written directly under the collection directory.
+
+Scalar fields, and lists of scalars, are stored as ordinary Parquet columns.  Fields holding nested documents, such
+as the "sample" list of individuals, or a packed genotype matrix, are stored as a binary column with each value
+encoded as BSON, and the names of those columns are kept in the file's schema metadata.
+
+Queries read files with memory mapping, and push predicates down in two steps:  an equality condition on
+simulation_run_id only visits that run's directory, and row groups whose column statistics cannot satisfy the
+query are skipped without being read.  The remaining rows are matched in Python, and generated file by file, so
+only sorted queries hold their results in memory.
+
+Parquet files are immutable, so update() and remove() rewrite the files containing matching documents.  Both are
+meant for occasional use, such as removing the samples of a simulation run which is resumed from a checkpoint.
+
+Requires pyarrow, which is imported only when the backend is constructed.
+
+"""
+
+import itertools
+import logging as log
+import os
+import socket
+import json
+import urllib
+from bson import BSON
+from bson.binary import Binary
+from bson.objectid import ObjectId
+from storage_backend import StorageBackend, collection_path, match_query, as_record
+
+PARTITION_FIELD = "simulation_run_id"
+BSON_COLUMNS_KEY = "ctpy.bson_columns"
+
+
+class ColumnarStorageBackend(StorageBackend):
+
+    def __init__(self, directory):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("pyarrow is required for the columnar storage backend")
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.directory = directory
+        self.num_files = 0
+
+
+    def insert(self, document_class, documents):
+        partitions = dict()
+        for doc in documents:
+            doc = _plain(doc)
+            if doc.get("_id") is None:
+                doc["_id"] = str(ObjectId())
+            partitions.setdefault(doc.get(PARTITION_FIELD), []).append(doc)
+
+        for (run_id, docs) in partitions.items():
+            directory = self._partition_directory(document_class, run_id)
+            if not os.path.exists(directory):
+                try:
+                    os.makedirs(directory)
+                except OSError:
+                    # another process created it first
+                    pass
+            self.num_files += 1
+            filename = os.path.join(directory, "part-%s-%s-%s.parquet" % (socket.gethostname(), os.getpid(), self.num_files))
+            self._write_file(filename, docs)
+
+
+    def find(self, document_class, query=None, sort=None, limit=None):
+        query = _plain(query or dict())
+        records = self._find_records(document_class, query)
+        if sort is None:
+            if limit is None:
+                return records
+            return itertools.islice(records, limit)
+
+        # sorting needs every matching record in memory
+        results = sorted(records, key=lambda record: record.get(sort))
+        if limit is not None:
+            results = results[:limit]
+        return results
+
+
+    def find_in_batches(self, document_class, query=None, sort='_id', batch_size=1000):
+        """
+        Reads the sort field of the matching documents from every file once, instead of repeating the query
+        (and reading every file) for each batch.  Each batch then reads only the files holding its documents,
+        skipping row groups outside its range of the sort field.
+        """
+        query = _plain(query or dict())
+        keys = []
+        for filename in self._candidate_files(document_class, query):
+            keys.extend((doc.get(sort), filename) for doc in self._read_matching(filename, query, [sort] + query.keys()))
+        keys.sort()
+
+        for start in range(0, len(keys), batch_size):
+            batch_keys = keys[start:start + batch_size]
+            batch_query = dict(query)
+            batch_query[sort] = {'$gte': batch_keys[0][0], '$lte': batch_keys[-1][0]}
+            wanted = dict()
+            for (key, filename) in batch_keys:
+                wanted.setdefault(filename, set()).add(key)
+
+            docs = []
+            for (filename, values) in wanted.items():
+                docs.extend(doc for doc in self._read_matching(filename, batch_query) if doc.get(sort) in values)
+            docs.sort(key=lambda doc: doc.get(sort))
+            yield [as_record(doc) for doc in docs]
+
+
+    def update(self, document_class, query, fields):
+        fields = _plain(fields)
+
+        def set_fields(doc):
+            doc.update(fields)
+            return doc
+
+        self._rewrite(document_class, _plain(query), set_fields)
+
+
+    def remove(self, document_class, query):
+        self._rewrite(document_class, _plain(query), lambda doc: None)
+
+
+    # private methods
+
+    def _collection_directory(self, document_class):
+        (database, collection) = collection_path(document_class)
+        return os.path.join(self.directory, database, collection)
+
+
+    def _partition_directory(self, document_class, run_id):
+        directory = self._collection_directory(document_class)
+        if run_id is None:
+            return directory
+        return os.path.join(directory, "%s=%s" % (PARTITION_FIELD, urllib.quote(str(run_id), safe='')))
+
+
+    def _find_records(self, document_class, query):
+        for filename in self._candidate_files(document_class, query):
+            for doc in self._read_matching(filename, query):
+                yield as_record(doc)
+
+
+    def _candidate_files(self, document_class, query):
+        """
+        Lists the Parquet files which can hold documents matching the query, pruning partitions by simulation run.
+        """
+        root = self._collection_directory(document_class)
+        if os.path.exists(root) is False:
+            return []
+        run_id = query.get(PARTITION_FIELD)
+        if run_id is not None and not isinstance(run_id, dict):
+            directories = [self._partition_directory(document_class, run_id)]
+            if os.path.exists(directories[0]) is False:
+                return []
+        else:
+            directories = [root] + [os.path.join(root, name) for name in sorted(os.listdir(root))
+                                    if name.startswith(PARTITION_FIELD + "=")]
+        filenames = []
+        for directory in directories:
+            filenames.extend(os.path.join(directory, name) for name in sorted(os.listdir(directory))
+                             if name.endswith(".parquet"))
+        return filenames
+
+
+    def _read_matching(self, filename, query, columns=None):
+        """
+        Generates the documents in a file which match the query, skipping row groups whose statistics exclude
+        a match.  If columns are given, only those fields are read.
+        """
+        parquet_file = self.pq.ParquetFile(self.pa.memory_map(filename, 'r'))
+        metadata = parquet_file.metadata
+        if columns is not None:
+            columns = [name for name in parquet_file.schema.names if name in columns]
+        for row_group in range(0, metadata.num_row_groups):
+            if _row_group_may_match(metadata.row_group(row_group), query) is False:
+                continue
+            table = parquet_file.read_row_group(row_group, columns=columns)
+            columns_read = table.to_pydict()
+            names = list(columns_read.keys())
+            for name in _bson_columns(table.schema):
+                if name in columns_read:
+                    columns_read[name] = [_decode_nested(value) for value in columns_read[name]]
+            for values in zip(*[columns_read[name] for name in names]):
+                doc = dict(zip(names, values))
+                if match_query(doc, query):
+                    yield doc
+
+
+    def _rewrite(self, document_class, query, transform):
+        """
+        Rewrites each file containing documents which match the query, replacing each matching document with
+        transform(doc), or dropping it if transform returns None.
+        """
+        for filename in self._candidate_files(document_class, query):
+            if not any(True for doc in self._read_matching(filename, query)):
+                continue
+            docs = []
+            for doc in self._read_matching(filename, dict()):
+                if match_query(doc, query):
+                    doc = transform(doc)
+                if doc is not None:
+                    docs.append(doc)
+            if len(docs) == 0:
+                os.remove(filename)
+            else:
+                self._write_file(filename, docs)
+
+
+    def _write_file(self, filename, docs):
+        names = sorted(set(key for doc in docs for key in doc.keys()))
+        arrays = []
+        bson_columns = []
+        for name in names:
+            values = [doc.get(name) for doc in docs]
+            if any(_is_nested(value) for value in values):
+                bson_columns.append(name)
+                values = [_encode_nested(value) for value in values]
+                arrays.append(self.pa.array(values, type=self.pa.binary()))
+            else:
+                arrays.append(self.pa.array(values))
+        table = self.pa.Table.from_arrays(arrays, names=names)
+        table = table.replace_schema_metadata({BSON_COLUMNS_KEY: json.dumps(bson_columns)})
+        self.pq.write_table(table, filename + ".tmp")
+        os.rename(filename + ".tmp", filename)
+        log.debug("Wrote %s documents to %s", len(docs), filename)
+
+
+
+def _plain(value):
+    """
+    Converts a document or query into plain Python values which Arrow can store, with ObjectIds as strings.
+    """
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, dict):
+        return dict((key, _plain(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return [_plain(item) for item in value]
+    return value
+
+
+def _is_nested(value):
+    if isinstance(value, dict):
+        return True
+    return isinstance(value, list) and any(isinstance(item, (dict, list)) for item in value)
+
+
+def _encode_nested(value):
+    if value is None:
+        return None
+    return Binary(BSON.encode(dict(value=value)))
+
+
+def _decode_nested(value):
+    if value is None:
+        return None
+    return BSON(value).decode()["value"]
+
+
+def _bson_columns(schema):
+    metadata = schema.metadata or dict()
+    return json.loads(metadata.get(BSON_COLUMNS_KEY, "[]"))
+
+
+def _row_group_may_match(row_group, query):
+    """
+    Uses the min/max statistics of the scalar columns in a row group to decide whether any of its rows
+    can match the query.
+    """
+    bounds = dict()
+    for column in range(0, row_group.num_columns):
+        chunk = row_group.column(column)
+        statistics = chunk.statistics
+        if statistics is not None and statistics.has_min_max:
+            bounds[chunk.path_in_schema] = (statistics.min, statistics.max)
+
+    for (field, condition) in query.items():
+        if field not in bounds:
+            continue
+        (low, high) = bounds[field]
+        if isinstance(condition, dict):
+            for (op, operand) in condition.items():
+                if op == '$gt' and high <= operand:
+                    return False
+                if op == '$gte' and high < operand:
+                    return False
+                if op == '$lt' and low >= operand:
+                    return False
+                if op == '$lte' and low > operand:
+                    return False
+        elif condition is not None and (condition < low or condition > high):
+            return False
+    return True
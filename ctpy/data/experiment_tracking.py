@@ -103,6 +103,29 @@ def update_field_by_stage_tag(experiment_name, tag_name, new_value):
     _update_field(experiment_name, db_field, new_value)
 
 
+def get_completed_partitions(experiment_name):
+    """
+    Returns the keys of the work partitions which parallel analytics stages have completed for an experiment
+    (see work_partitions.partition_key), so that an interrupted stage can resume with the remaining partitions.
+
+    :return: set of strings
+    """
+    record = ExperimentTracking.m.find(dict(experiment_name = experiment_name)).one()
+    return set(record.get("completed_partitions") or [])
+
+
+def record_completed_partition(experiment_name, key):
+    """
+    Checkpoints a completed work partition.  Called only by the process which schedules the partitions,
+    never by the workers, so the record is not modified concurrently.
+
+    :return: None
+    """
+    record = ExperimentTracking.m.find(dict(experiment_name = experiment_name)).one()
+    record["completed_partitions"] = list(record.get("completed_partitions") or []) + [key]
+    record.m.save()
+
+
 def _update_field(record_id, field_name, value):
     record = ExperimentTracking.m.find(dict(experiment_name = record_id)).one()
     record[field_name] = value
@@ -114,6 +137,7 @@ class ExperimentTracking(Document):
     class __mongometa__:
         session = Session.by_name(_get_dataobj_id())
         name = 'experiment_tracking'
+        indexes = [('experiment_name',)]
 
     _id = Field(schema.ObjectId)
     experiment_name = Field(str)
@@ -123,6 +147,7 @@ class ExperimentTracking(Document):
     sim_data_tstamp = Field(datetime)
     subsampling_complete = Field(bool)
     subsampling_tstamp = Field(datetime)
+    subsampling_last_id = Field(schema.ObjectId)   # last raw individual sample subsampled, for resuming
     classification_complete = Field(bool)
     classification_tstamp = Field(datetime)
     postclassification_simrun_stats_complete = Field(bool)
@@ -134,4 +159,5 @@ class ExperimentTracking(Document):
     trait_statistics_complete = Field(bool)
     trait_statistics_tstamp = Field(datetime)
     experiment_end_processing_time = Field(datetime)
+    completed_partitions = Field([str])   # keys of work partitions completed by parallel stages, for resuming
 
@@ -19,7 +19,10 @@ from ming.declarative import Document
 import simuPOP as sim
 from simuPOP.sampling import drawRandomSample
 import pprint as pp
+import numpy as np
 import ctpy.data
+from buffered_writer import get_buffered_writer
+from sample_encoding import encode_individuals, unpack_array
 
 def _get_dataobj_id():
     """
@@ -53,41 +56,64 @@ def sampleIndividuals(pop, param):
     popID = pop.dvars().rep
     gen = pop.dvars().gen
     sample = drawRandomSample(pop, sizes=ssize)
-    samplelist = []
+    genotypes = []
 
     for idx in range(ssize):
-        genotype_list = list(sample.individual(idx).genotype())
-        indiv = dict(id=idx, genotype=genotype_list)
-        samplelist.append(indiv)
+        genotypes.append(list(sample.individual(idx).genotype()))
 
-    _storeIndividualSample(popID,num_loci,ssize,gen,mutation,popsize,sim_id,samplelist)
+    _storeIndividualSample(popID,num_loci,ssize,gen,mutation,popsize,sim_id,genotypes)
 
     return True
 
 
 
 
-def _storeIndividualSample(popID, dim, ssize, generation, mutation, popsize, sim_id, sample):
-    IndividualSample(dict(
+def _storeIndividualSample(popID, dim, ssize, generation, mutation, popsize, sim_id, genotypes):
+    fields = dict(
         simulation_time=generation,
         replication=popID,
         dimensionality=dim,
         sample_size=ssize,
         population_size=popsize,
         mutation_rate=mutation,
-        simulation_run_id=sim_id,
-        sample=sample
-    )).m.insert()
+        simulation_run_id=sim_id
+    )
+    fields.update(encode_individuals(genotypes))
+    get_buffered_writer().add(IndividualSample, fields)
     return True
 
 
 
 
+def get_genotype_matrix(sample_record):
+    """Converts the list of sampled individuals in an individual sample document into a NumPy array.
+
+        Args:
+
+            sample_record:  IndividualSample, IndividualSampleFullDataset, SubsampleView, or any record with a "sample" list of individuals
+
+        Returns:
+
+            (ndarray):  integer array of shape (sample size x loci), rows in the order individuals were stored.
+            Samples stored with the binary encoding are decoded without copying, and are read-only.
+
+    """
+    if hasattr(sample_record, "genotype_matrix"):
+        return sample_record.genotype_matrix()
+    packed = getattr(sample_record, "packed_genotypes", None)
+    if packed is not None:
+        return unpack_array(packed)
+    return np.array([indiv.genotype for indiv in sample_record.sample], dtype=np.int64)
+
+
+
+
 class IndividualSample(Document):
 
     class __mongometa__:
         session = Session.by_name(_get_dataobj_id())
         name = 'individual_samples'
+        indexes = [('simulation_run_id', 'simulation_time', 'replication')]
         _id = Field(schema.ObjectId)
         simulation_time = Field(int)
         replication = Field(int)
@@ -99,4 +125,6 @@ class IndividualSample(Document):
         # a sample is a list of dicts, where each dict has an individual ID and a list of ints as a value
         sample = Field([
             dict(id=int, genotype=[int])
-        ])
\ No newline at end of file
+        ])
+        # or, with the binary encoding, the genotype matrix packed by sample_encoding.pack_array
+        packed_genotypes = Field(dict(data=schema.Binary, shape=[int], dtype=str))
\ No newline at end of file
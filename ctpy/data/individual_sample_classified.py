@@ -19,7 +19,10 @@ from ming.declarative import Document
 import simuPOP as sim
 from simuPOP.sampling import drawRandomSample
 import pprint as pp
+import numpy as np
 import ctpy.data
+from storage_backend import get_storage_backend
+from sample_encoding import encode_classified_individuals, get_class_codes, decode_class_codes
 
 def _get_dataobj_id():
     """
@@ -39,8 +42,8 @@ def _get_collection_id():
 
 def storeIndividualSampleClassified(generation, classification_id, class_type, class_dim,
                                     coarseness, replication, ssize,
-                                    popsize, mutation, sim_id, sample_list):
-    IndividualSampleClassified(dict(
+                                    popsize, mutation, sim_id, class_codes, class_radix):
+    fields = dict(
         simulation_time=generation,
         classification_id=classification_id,
         classification_type=class_type,
@@ -50,12 +53,118 @@ def storeIndividualSampleClassified(generation, classification_id, class_type, c
         sample_size=ssize,
         population_size=popsize,
         mutation_rate=mutation,
-        simulation_run_id=sim_id,
-        sample=sample_list
-    )).m.insert()
+        simulation_run_id=sim_id
+    )
+    fields.update(encode_classified_individuals(class_codes, class_radix))
+    IndividualSampleClassified(fields).m.insert()
     return True
 
 
+# fields copied from the classified samples into the per-simulation run statistics for each group
+_GROUP_PARAMETERS = ["classification_type", "classification_dim", "classification_coarseness", "sample_size",
+                     "population_size", "mutation_rate", "class_radix"]
+
+
+def class_first_appearances(sim_id, classification_ids=None):
+    """
+    Finds the earliest simulation time at which each class appears in the classified samples of a simulation run,
+    separately for each replication and classification.
+
+    If the storage backend supports aggregation, samples with a class_codes array are grouped on the server, with
+    one $unwind/$group pipeline, and only samples in other encodings are read.  Otherwise (e.g., the SQLite backend),
+    the samples of the run are read and grouped with NumPy.  Integer class codes are decoded to string identifiers only in the
+    results.
+
+    :param sim_id: simulation run identifier
+    :param classification_ids: optional list of classification ids to include
+    :return: list of dicts, one per (replication, classification_id), each with the classification and simulation
+        parameters, and class_time_first_appearance, a list of dict(classid, time) sorted by classid
+    """
+    query = dict(simulation_run_id=sim_id)
+    if classification_ids is not None:
+        query["classification_id"] = {'$in': list(classification_ids)}
+
+    if get_storage_backend().supports_aggregation:
+        groups = _first_appearances_pipeline(IndividualSampleClassified.m.collection, query)
+        packed_query = dict(query)
+        packed_query["class_codes"] = {'$exists': False}
+        packed = _first_appearances_numpy(IndividualSampleClassified.m.find(packed_query, dict(timeout=False)))
+        for (key, (params, times)) in packed.items():
+            if key not in groups:
+                groups[key] = (params, times)
+                continue
+            merged = groups[key][1]
+            for (classid, time) in times.items():
+                merged[classid] = min(time, merged.get(classid, time))
+    else:
+        groups = _first_appearances_numpy(IndividualSampleClassified.m.find(query))
+
+    results = []
+    for ((replication, classification_id), (params, times)) in sorted(groups.items(), key=lambda item: (item[0][0], str(item[0][1]))):
+        result = dict(replication=replication, classification_id=classification_id)
+        result.update((field, params.get(field)) for field in _GROUP_PARAMETERS)
+        result["class_time_first_appearance"] = [dict(classid=classid, time=times[classid]) for classid in sorted(times)]
+        results.append(result)
+    return results
+
+
+def _first_appearances_pipeline(collection, query):
+    """
+    :return: dict mapping (replication, classification_id) to (dict of parameters, dict of classid to time)
+    """
+    match = dict(query)
+    match["class_codes"] = {'$exists': True}
+    parameters = dict((field, {'$first': "$" + field}) for field in _GROUP_PARAMETERS)
+    by_class = dict(_id=dict(replication="$replication", classification_id="$classification_id", classid="$class_codes"),
+                    time={'$min': "$simulation_time"})
+    by_class.update(parameters)
+    by_group = dict(_id=dict(replication="$_id.replication", classification_id="$_id.classification_id"),
+                    times={'$push': dict(classid="$_id.classid", time="$time")})
+    by_group.update((field, {'$first': "$" + field}) for field in _GROUP_PARAMETERS)
+    pipeline = [{'$match': match}, {'$unwind': "$class_codes"}, {'$group': by_class}, {'$group': by_group}]
+
+    groups = dict()
+    # cursor={} makes pymongo 2.x return a cursor rather than a single result document
+    for doc in collection.aggregate(pipeline, allowDiskUse=True, cursor={}):
+        key = (doc["_id"]["replication"], doc["_id"]["classification_id"])
+        class_ids = decode_class_codes([entry["classid"] for entry in doc["times"]], doc["class_radix"])
+        groups[key] = (doc, dict(zip(class_ids, [entry["time"] for entry in doc["times"]])))
+    return groups
+
+
+def _first_appearances_numpy(records):
+    """
+    Groups classified samples by replication and classification, and finds the minimum simulation time of each
+    class in each group, with np.unique and np.minimum.at over the concatenated class identifiers.
+
+    :return: dict mapping (replication, classification_id) to (dict of parameters, dict of classid to time)
+    """
+    params = dict()
+    class_ids = dict()
+    times = dict()
+    for s in records:
+        key = (s.replication, s.classification_id)
+        if key not in params:
+            params[key] = dict((field, s.get(field)) for field in _GROUP_PARAMETERS)
+            class_ids[key] = []
+            times[key] = []
+        codes = get_class_codes(s)
+        class_ids[key].append(codes)
+        times[key].append(np.repeat(s.simulation_time, len(codes)))
+
+    groups = dict()
+    for key in params:
+        (unique, inverse) = np.unique(np.concatenate(class_ids[key]), return_inverse=True)
+        first = np.full(len(unique), np.iinfo(np.int64).max, dtype=np.int64)
+        np.minimum.at(first, inverse, np.concatenate(times[key]))
+        if unique.dtype.kind in "iu":
+            unique = decode_class_codes(unique, params[key]["class_radix"])
+        else:
+            unique = unique.tolist()
+        groups[key] = (params[key], dict(zip(unique, first.tolist())))
+    return groups
+
+
 
 
 class IndividualSampleClassified(Document):
@@ -63,6 +172,7 @@ class IndividualSampleClassified(Document):
     class __mongometa__:
         session = Session.by_name(_get_dataobj_id())
         name = 'individual_samples_classified'
+        indexes = [('simulation_run_id', 'replication', 'classification_id')]
         _id = Field(schema.ObjectId)
         # fields pertaining to classification
         classification_id = Field(str)
@@ -78,7 +188,15 @@ class IndividualSampleClassified(Document):
         mutation_rate = Field(float)
         simulation_run_id = Field(str)
 
-        # a sample is a list of dicts, where each dict has an individual ID and a list of ints as a value
+        # the class of each individual, in order, as a mixed-radix integer code (see sample_encoding)
+        class_codes = Field([int])
+        # or, with the binary encoding, the class codes packed by sample_encoding.pack_array
+        packed_class_codes = Field(dict(data=schema.Binary, shape=[int], dtype=str))
+        # number of modes in each dimension of the classification, the radices of the class codes
+        class_radix = Field([int])
+
+        # samples classified before integer class codes have a list of dicts, each with an individual ID and
+        # string class identifier
         sample = Field([
-            dict(id=int, classid=int),
+            dict(id=int, classid=str),
         ])
\ No newline at end of file
@@ -22,7 +22,10 @@ from ming.declarative import Document
 import simuPOP as sim
 from simuPOP.sampling import drawRandomSample
 import pprint as pp
+import itertools
 import ctpy.data
+from individual_sample import get_genotype_matrix
+from sample_encoding import encode_individuals
 
 def _get_dataobj_id():
     """
@@ -54,6 +57,38 @@ def storeIndividualSampleFullDataset(popID, dim, ssize, generation, mutation, po
     return True
 
 
+def subsample_fields(s, sample_sizes, dimensions):
+    """
+    Constructs the fulldataset documents for a raw individual sample, at every combination of sample size
+    and dimensionality.  Each subsample keeps the first ssize individuals, and the first dim loci of each genotype.
+    Combinations larger than the raw sample are skipped, as in iter_subsample_views().
+
+    :param s: raw IndividualSample
+    :param sample_sizes: list of sample sizes
+    :param dimensions: list of dimensionalities
+    :return: list of dicts of IndividualSampleFullDataset fields
+    """
+    genotypes = get_genotype_matrix(s)
+    documents = []
+    for (ssize, dim) in itertools.product(sample_sizes, dimensions):
+        if ssize > s.sample_size or dim > s.dimensionality:
+            log.debug("Raw sample has ssize %s and dim %s, skipping subsample at ssize %s and dim %s",
+                      s.sample_size, s.dimensionality, ssize, dim)
+            continue
+        fields = dict(
+            simulation_time=s.simulation_time,
+            replication=s.replication,
+            dimensionality=dim,
+            sample_size=ssize,
+            population_size=s.population_size,
+            mutation_rate=s.mutation_rate,
+            simulation_run_id=s.simulation_run_id
+        )
+        fields.update(encode_individuals(genotypes[:ssize, :dim]))
+        documents.append(fields)
+    return documents
+
+
 
 
 class IndividualSampleFullDataset(Document):
@@ -61,6 +96,7 @@ class IndividualSampleFullDataset(Document):
     class __mongometa__:
         session = Session.by_name(_get_dataobj_id())
         name = 'individual_samples_fulldataset'
+        indexes = [('dimensionality', 'sample_size'), ('simulation_run_id', 'simulation_time', 'replication')]
         _id = Field(schema.ObjectId)
         simulation_time = Field(int)
         replication = Field(int)
@@ -72,4 +108,6 @@ class IndividualSampleFullDataset(Document):
         # a sample is a list of dicts, where each dict has an individual ID and a list of ints as a value
         sample = Field([
             dict(id=int, genotype=[int])
-        ])
\ No newline at end of file
+        ])
+        # or, with the binary encoding, the genotype matrix packed by sample_encoding.pack_array
+        packed_genotypes = Field(dict(data=schema.Binary, shape=[int], dtype=str))
\ No newline at end of file
@@ -0,0 +1,100 @@
+# Copyright (c) 2013.  Mark E. Madsen <mark@madsenlab.org>
+#
+# This work is licensed under the Apache Public License 2.0
+#
+"""
+.. module:: observation
+    :platform: Unix, Windows
+    :synopsis: Composite per-generation observation operator, replacing the separate census and sample operators.
+
+.. moduleauthor:: Mark E. Madsen <mark@madsenlab.org>
+
+Running censusTraitCounts, censusNumAlleles, sampleNumAlleles, sampleTraitCounts, and sampleIndividuals as
+separate PyOperators calculates allele frequencies for the same population twice, and draws three independent
+samples each generation.  observeGeneration() calculates population allele counts once, draws a single sample,
+and stores the census and sample statistics through the same storage functions (and into the same collections)
+as the individual operators.  Sample richness and trait counts are derived from the sample's genotype matrix,
+so the sample needs no separate call to sim.stat().
+
+The storage side is separate from simuPOP, in store_generation_observation(), which takes population trait counts
+and a sample genotype matrix, so that simulation engines which hold their populations as NumPy arrays can
+record observations in exactly the same form.
+
+"""
+
+import logging as log
+import numpy as np
+import simuPOP as sim
+from simuPOP.sampling import drawRandomSample
+import richness_population
+import richness_sample
+import trait_count_population
+import trait_count_sample
+import individual_sample
+
+
+def observeGeneration(pop, param):
+    """Takes a census of trait counts and richness in a replicant population, draws one sample of individuals,
+    and stores the sample's richness, trait counts, and genotypes in the database.
+
+        Args:
+
+            pop (Population):  haploid simuPOP population replicate.
+
+            params (list):  list of parameters (sample size, mutation rate, population size, simulation ID, number of loci)
+
+        Returns:
+
+            Boolean true:  all PyOperators need to return true.
+
+    """
+    (ssize, mutation, popsize, sim_id, numloci) = param
+    popID = pop.dvars().rep
+    gen = pop.dvars().gen
+    sim.stat(pop, alleleFreq=sim.ALL_AVAIL)
+    census_counts = [dict(pop.dvars().alleleNum[locus]) for locus in range(numloci)]
+
+    sample = drawRandomSample(pop, sizes=ssize)
+    genotypes = np.array(sample.genotype(), dtype=np.int64).reshape(ssize, numloci)
+
+    store_generation_observation(popID, gen, mutation, popsize, sim_id, census_counts, genotypes)
+    return True
+
+
+def store_generation_observation(replication, generation, mutation, popsize, sim_id, census_counts, sample_genotypes):
+    """
+    Stores the census and sample observations of one replicate population at one generation:  population trait
+    counts and richness, sample trait counts and richness, and the sampled individuals.
+
+    :param replication: replicate population number
+    :param generation: simulation time
+    :param mutation: innovation rate
+    :param popsize: population size
+    :param sim_id: simulation run identifier
+    :param census_counts: list with a dict of allele to count in the whole population, for each locus
+    :param sample_genotypes: integer array (sample size x loci) of the sampled individuals' genotypes
+    :return: None
+    """
+    (ssize, numloci) = sample_genotypes.shape
+
+    for locus in range(numloci):
+        richness_population._storeRichnessSample(replication, len(census_counts[locus]), locus, generation, mutation, popsize, sim_id)
+        for (allele, count) in census_counts[locus].items():
+            trait_count_population._storeTraitCountSample(replication, locus, generation, mutation, popsize, sim_id, allele, count)
+
+    for locus, (alleles, counts) in enumerate(sample_trait_counts(sample_genotypes)):
+        richness_sample._storeRichnessSample(replication, ssize, len(alleles), locus, generation, mutation, popsize, sim_id)
+        for (allele, count) in zip(alleles.tolist(), counts.tolist()):
+            trait_count_sample._storeTraitCountSample(replication, ssize, locus, generation, mutation, popsize, sim_id, allele, count)
+
+    individual_sample._storeIndividualSample(replication, numloci, ssize, generation, mutation, popsize, sim_id, sample_genotypes)
+
+
+def sample_trait_counts(genotypes):
+    """
+    Counts the traits present at each locus of a genotype matrix.
+
+    :param genotypes: integer array (individuals x loci)
+    :return: list with a tuple of (sorted alleles, counts) arrays for each locus
+    """
+    return [np.unique(genotypes[:, locus], return_counts=True) for locus in range(genotypes.shape[1])]
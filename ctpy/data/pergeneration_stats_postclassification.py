@@ -20,6 +20,7 @@ import simuPOP as sim
 from simuPOP.sampling import drawRandomSample
 import pprint as pp
 import ctpy.data
+from buffered_writer import get_buffered_writer
 
 def _get_dataobj_id():
     """
@@ -40,7 +41,8 @@ def _get_collection_id():
 def storePerGenerationStatsPostclassification(generation, classification_id, class_type, class_dim,
                                     coarseness, num_classes, replication, ssize,
                                     popsize, mutation, sim_id, moderichness, classrichness,
-                                    mode_iqv, mode_entropy, class_iqv, class_entropy, design_space_occupation, class_innovation_interval_times,neutrality_slatkin):
+                                    mode_iqv, mode_entropy, class_iqv, class_entropy, design_space_occupation, class_innovation_interval_times,neutrality_slatkin,
+                                    neutrality_slatkin_replicates=None):
     PerGenerationStatsPostclassification(dict(
         simulation_time=generation,
         classification_id=classification_id,
@@ -61,15 +63,38 @@ def storePerGenerationStatsPostclassification(generation, classification_id, cla
         class_shannon_entropy=class_entropy,
         design_space_occupation=design_space_occupation,
         class_innovation_interval_times=class_innovation_interval_times,
-        class_neutrality_slatkin=neutrality_slatkin
+        class_neutrality_slatkin=neutrality_slatkin,
+        class_neutrality_slatkin_replicates=neutrality_slatkin_replicates
     )).m.insert()
     return True
 
 
 def updateFieldPerGenerationStatsPostclassification(record_id, field_name, value):
-    record = PerGenerationStatsPostclassification.m.find(dict(_id=record_id)).one()
-    record[field_name] = value
-    record.m.save()
+    PerGenerationStatsPostclassification.m.update_partial(dict(_id=record_id), {'$set': {field_name: value}})
+
+
+def keyPerGenerationStatsPostclassification(s):
+    """
+    Returns the fields which identify the per-generation statistics record of a classified sample.
+
+    :param s: IndividualSampleClassified record
+    :return: dict
+    """
+    return dict(classification_id=s.classification_id,
+                simulation_run_id=s.simulation_run_id,
+                simulation_time=s.simulation_time,
+                replication=s.replication,
+                sample_size=s.sample_size)
+
+
+def updateFieldsPerGenerationStatsPostclassification(key, fields):
+    """
+    Buffers an update setting fields in the record identified by key (see keyPerGenerationStatsPostclassification),
+    which is written in bulk by the process-wide buffered writer.
+
+    :return: None
+    """
+    get_buffered_writer().update(PerGenerationStatsPostclassification, key, fields)
 
 
 def columns_to_export_for_analysis():
@@ -89,6 +114,7 @@ def columns_to_export_for_analysis():
         "class_shannon_entropy",
         "design_space_occupation",
         "class_neutrality_slatkin",
+        "class_neutrality_slatkin_replicates",
     ]
     return cols
 
@@ -99,6 +125,7 @@ class PerGenerationStatsPostclassification(Document):
     class __mongometa__:
         session = Session.by_name(_get_dataobj_id())
         name = 'pergeneration_stats_postclassification'
+        indexes = [('classification_id', 'simulation_run_id', 'simulation_time', 'replication', 'sample_size')]
         _id = Field(schema.ObjectId)
         # fields pertaining to classification
         classification_id = Field(str)
@@ -124,4 +151,5 @@ class PerGenerationStatsPostclassification(Document):
         class_shannon_entropy = Field(float)
         design_space_occupation = Field(float)  # a single value, denoting the fraction of occupied classes
         class_innovation_interval_times = Field([int])   # a list of intervals between appearances of a new class
-        class_neutrality_slatkin = Field(float)
\ No newline at end of file
+        class_neutrality_slatkin = Field(float)
+        class_neutrality_slatkin_replicates = Field(int)   # number of Monte Carlo replicates used, fewer if adaptive
\ No newline at end of file
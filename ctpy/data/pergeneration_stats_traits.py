@@ -20,6 +20,8 @@ import simuPOP as sim
 from simuPOP.sampling import drawRandomSample
 import pprint as pp
 import ctpy.data
+from buffered_writer import get_buffered_writer
+from storage_backend import insert_into_collection
 
 def _get_dataobj_id():
     """
@@ -39,8 +41,27 @@ def _get_collection_id():
 
 def storePerGenerationStatsTraits(generation, replication, ssize,
                                     popsize, mutation, dimensionality, sim_id, mean_richness, mean_entropy,
-                                    mean_iqv, loci_richness, loci_entropy, loci_iqv,loci_neutrality_slatkin,mean_slatkin):
-    PerGenerationStatsTraits(dict(
+                                    mean_iqv, loci_richness, loci_entropy, loci_iqv,loci_neutrality_slatkin,mean_slatkin,
+                                    loci_neutrality_slatkin_replicates=None):
+    PerGenerationStatsTraits(fieldsPerGenerationStatsTraits(generation, replication, ssize, popsize, mutation,
+                                                            dimensionality, sim_id, mean_richness, mean_entropy,
+                                                            mean_iqv, loci_richness, loci_entropy, loci_iqv,
+                                                            loci_neutrality_slatkin, mean_slatkin,
+                                                            loci_neutrality_slatkin_replicates)).m.insert()
+    return True
+
+
+def fieldsPerGenerationStatsTraits(generation, replication, ssize,
+                                   popsize, mutation, dimensionality, sim_id, mean_richness, mean_entropy,
+                                   mean_iqv, loci_richness, loci_entropy, loci_iqv,loci_neutrality_slatkin,mean_slatkin,
+                                   loci_neutrality_slatkin_replicates=None):
+    """
+    Returns the fields of a per-generation trait statistics record, for storePerGenerationStatsTraits or
+    storePerGenerationStatsTraitsBatch.
+
+    :return: dict
+    """
+    return dict(
         simulation_time=generation,
         replication=replication,
         sample_size=ssize,
@@ -56,14 +77,49 @@ def storePerGenerationStatsTraits(generation, replication, ssize,
         loci_evenness_iqv = loci_iqv,
         loci_neutrality_slatkin = loci_neutrality_slatkin,
         mean_neutrality_slatkin = mean_slatkin,
-    )).m.insert()
-    return True
+        loci_neutrality_slatkin_replicates = loci_neutrality_slatkin_replicates,
+    )
+
+
+def storePerGenerationStatsTraitsBatch(records):
+    """
+    Inserts a batch of per-generation trait statistics records, such as every (sample size, dimensionality)
+    variant of one raw sample, with one bulk insert into the same collection as storePerGenerationStatsTraits.
+
+    :param records: list of dicts, from fieldsPerGenerationStatsTraits
+    :return: None
+    """
+    if len(records) == 0:
+        return
+    insert_into_collection(PerGenerationStatsTraits, [PerGenerationStatsTraits.m.make(fields) for fields in records])
 
 
 def updateFieldPerGenerationStatsTraits(record_id, field_name, value):
-    record = PerGenerationStatsTraits.m.find(dict(_id=record_id)).one()
-    record[field_name] = value
-    record.m.save()
+    PerGenerationStatsTraits.m.update_partial(dict(_id=record_id), {'$set': {field_name: value}})
+
+
+def keyPerGenerationStatsTraits(s):
+    """
+    Returns the fields which identify the per-generation trait statistics record of a sample or subsample view.
+
+    :param s: IndividualSampleFullDataset record or SubsampleView
+    :return: dict
+    """
+    return dict(dimensionality=s.dimensionality,
+                simulation_run_id=s.simulation_run_id,
+                simulation_time=s.simulation_time,
+                replication=s.replication,
+                sample_size=s.sample_size)
+
+
+def updateFieldsPerGenerationStatsTraits(key, fields):
+    """
+    Buffers an update setting fields in the record identified by key (see keyPerGenerationStatsTraits),
+    which is written in bulk by the process-wide buffered writer.
+
+    :return: None
+    """
+    get_buffered_writer().update(PerGenerationStatsTraits, key, fields)
 
 
 def columns_to_export_for_analysis():
@@ -89,6 +145,7 @@ class PerGenerationStatsTraits(Document):
     class __mongometa__:
         session = Session.by_name(_get_dataobj_id())
         name = 'pergeneration_stats_traits'
+        indexes = [('simulation_run_id', 'simulation_time', 'replication', 'sample_size', 'dimensionality')]
         _id = Field(schema.ObjectId)
 
         # fields pertaining to simulation run
@@ -109,4 +166,5 @@ class PerGenerationStatsTraits(Document):
         loci_evenness_shannon_entropy = Field([float])
         loci_evenness_iqv = Field([float])
         loci_neutrality_slatkin = Field([float])
-        mean_neutrality_slatkin = Field(float)
\ No newline at end of file
+        mean_neutrality_slatkin = Field(float)
+        loci_neutrality_slatkin_replicates = Field([int])
\ No newline at end of file
@@ -57,9 +57,7 @@ def storePerSimrunStatsPostclassification(classification_id, class_type, class_d
     return True
 
 def updateFieldPerSimrunStatsPostclassification(record_id, field_name, value):
-    record = PerSimrunStatsPostclassification.m.find(dict(_id=record_id)).one()
-    record[field_name] = value
-    record.m.save()
+    PerSimrunStatsPostclassification.m.update_partial(dict(_id=record_id), {'$set': {field_name: value}})
 
 
 def columns_to_export_for_analysis():
@@ -85,6 +83,7 @@ class PerSimrunStatsPostclassification(Document):
     class __mongometa__:
         session = Session.by_name(_get_dataobj_id())
         name = 'persimrun_stats_postclassification'
+        indexes = [('simulation_run_id', 'classification_id', 'replication', 'sample_size')]
         _id = Field(schema.ObjectId)
 
         # pertaining to simulation run
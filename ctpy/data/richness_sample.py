@@ -35,6 +35,7 @@ from ming.declarative import Document
 import simuPOP as sim
 from simuPOP.sampling import drawRandomSample
 import ctpy.data
+from buffered_writer import get_buffered_writer
 
 def _get_dataobj_id():
     """
@@ -74,7 +75,7 @@ def sampleNumAlleles(pop, param):
 
 
 def _storeRichnessSample(popID, ssize, richness, locus, generation,mutation,popsize,sim_id):
-    RichnessSample(dict(
+    get_buffered_writer().add(RichnessSample, dict(
         simulation_time=generation,
         replication=popID,
         locus=locus,
@@ -83,7 +84,7 @@ def _storeRichnessSample(popID, ssize, richness, locus, generation,mutation,pops
         population_size=popsize,
         mutation_rate=mutation,
         simulation_run_id=sim_id
-    )).m.insert()
+    ))
     return True
 
 
@@ -94,6 +95,7 @@ class RichnessSample(Document):
     class __mongometa__:
         session = Session.by_name(_get_dataobj_id())
         name = 'richness_sample'
+        indexes = [('simulation_run_id', 'simulation_time', 'replication')]
 
     _id = Field(schema.ObjectId)
     simulation_time = Field(int)
@@ -0,0 +1,143 @@
+# Copyright (c) 2013.  Mark E. Madsen <mark@madsenlab.org>
+#
+# This work is licensed under the Apache Public License 2.0
+#
+"""
+.. module:: sample_encoding
+    :platform: Unix, Windows
+    :synopsis: Compact binary encoding of the individuals in sample documents.
+
+.. moduleauthor:: Mark E. Madsen <mark@madsenlab.org>
+
+By default, the "sample" field of an individual sample document is a list of {id, genotype} dicts, which
+stores a BSON key and value for every allele of every individual.  With the "binary" encoding, the sample is
+instead stored as a single BSON binary field holding a contiguous array, with its shape and NumPy dtype:
+
+    packed_genotypes = dict(data=Binary, shape=[ssize, loci], dtype="<u4")
+
+Genotypes are packed as little-endian uint32 when all alleles fit (as they do with the default MAXALLELES),
+and int64 otherwise.  Readers decode the array with np.frombuffer, without building a Python object per allele.
+Individuals in a packed sample are identified by their row, which is the same as the "id" of every individual
+in the list encoding.
+
+Classified samples store each individual's class as an integer code:  a mixed-radix number whose digits are the
+modes of each dimension, with the number of modes in each dimension (class_radix) as the radices, and the first
+dimension most significant.  The codes are stored as an int array, class_codes, or packed as packed_class_codes,
+and are decoded to string identifiers of the form '0-3-1-2' only when results are exported.  Classified samples
+stored before integer codes, with a string classid per individual, are still readable.
+
+The encoding used for new documents is chosen by ctpy.data.set_genotype_encoding(), and readers handle both.
+
+"""
+
+import numpy as np
+from bson.binary import Binary
+import ctpy.data
+
+LIST = "list"
+BINARY = "binary"
+
+
+def pack_array(array):
+    """
+    Packs a NumPy array into a dict with a BSON binary copy of its data, its shape, and its dtype.  Non-negative
+    integer arrays whose values fit in 32 bits are packed as uint32.
+
+    :param array: NumPy array
+    :return: dict(data, shape, dtype)
+    """
+    array = np.asarray(array)
+    if array.dtype.kind in ('i', 'u'):
+        if array.size == 0 or (array.min() >= 0 and array.max() <= np.iinfo(np.uint32).max):
+            dtype = np.dtype('<u4')
+        else:
+            dtype = np.dtype('<i8')
+        array = array.astype(dtype)
+    return dict(data=Binary(np.ascontiguousarray(array).tobytes()), shape=list(array.shape), dtype=array.dtype.str)
+
+
+def unpack_array(packed):
+    """
+    Decodes a packed array.  The result shares memory with the BSON binary data, and is read-only.
+
+    :param packed: dict(data, shape, dtype), as constructed by pack_array
+    :return: NumPy array
+    """
+    return np.frombuffer(packed["data"], dtype=np.dtype(str(packed["dtype"]))).reshape(packed["shape"])
+
+
+def encode_individuals(genotypes):
+    """
+    Constructs the sample fields of an individual sample document, in the encoding chosen for this process.
+
+    :param genotypes: integer array (sample size x loci), or list of genotype lists, in order of individual id
+    :return: dict with either a "sample" list, or "packed_genotypes"
+    """
+    if ctpy.data.genotype_encoding == BINARY:
+        return dict(packed_genotypes=pack_array(np.asarray(genotypes, dtype=np.int64)))
+    if isinstance(genotypes, np.ndarray):
+        genotypes = genotypes.tolist()
+    return dict(sample=[dict(id=idx, genotype=genotype) for idx, genotype in enumerate(genotypes)])
+
+
+def encode_classified_individuals(class_codes, class_radix):
+    """
+    Constructs the class fields of a classified sample document, in the encoding chosen for this process.
+    Individuals are identified by their position in the sample, as in a packed individual sample.
+
+    :param class_codes: integer array of class codes, in order of individual
+    :param class_radix: list of the number of modes in each dimension of the classification
+    :return: dict with class_radix, and either "class_codes" or "packed_class_codes"
+    """
+    class_codes = np.asarray(class_codes, dtype=np.int64)
+    fields = dict(class_radix=[int(radix) for radix in class_radix])
+    if ctpy.data.genotype_encoding == BINARY:
+        fields["packed_class_codes"] = pack_array(class_codes)
+    else:
+        fields["class_codes"] = class_codes.tolist()
+    return fields
+
+
+def decode_class_codes(class_codes, class_radix):
+    """
+    Decodes integer class codes to string class identifiers of the form '0-3-1-2', with the mode of each dimension.
+
+    :param class_codes: integer array of class codes
+    :param class_radix: list of the number of modes in each dimension
+    :return: list of strings
+    """
+    class_radix = np.asarray(class_radix, dtype=np.int64)
+    place_values = np.ones(len(class_radix), dtype=np.int64)
+    place_values[:-1] = np.cumprod(class_radix[::-1])[::-1][1:]
+    modes = (np.asarray(class_codes, dtype=np.int64)[:, np.newaxis] // place_values) % class_radix
+    return ['-'.join([str(num) for num in row]) for row in modes.tolist()]
+
+
+def get_individual_ids(sample_record):
+    """
+    :param sample_record: individual sample document in either encoding, or SubsampleView
+    :return: list of the ids of the individuals in the sample
+    """
+    if hasattr(sample_record, "individual_ids"):
+        return sample_record.individual_ids()
+    packed = getattr(sample_record, "packed_genotypes", None)
+    if packed is not None:
+        return range(0, packed["shape"][0])
+    return [indiv.id for indiv in sample_record.sample]
+
+
+def get_class_codes(classified_record):
+    """
+    Reads the class of every individual in a classified sample, for counting with np.unique.
+
+    :param classified_record: IndividualSampleClassified document in any encoding
+    :return: NumPy array of integer class codes, or of string class identifiers for documents stored before
+        integer codes were used
+    """
+    packed = getattr(classified_record, "packed_class_codes", None)
+    if packed is not None:
+        return unpack_array(packed)
+    codes = getattr(classified_record, "class_codes", None)
+    if codes is not None:
+        return np.asarray(codes, dtype=np.int64)
+    return np.asarray([indiv.classid for indiv in classified_record.sample])
@@ -0,0 +1,209 @@
+# Copyright (c) 2013.  Mark E. Madsen <mark@madsenlab.org>
+#
+# This work is licensed under the Apache Public License 2.0
+#
+"""
+.. module:: simulation_checkpoint
+    :platform: Unix, Windows
+    :synopsis: Periodic checkpoints of simuPOP populations, so that long simulation runs can be resumed.
+
+.. moduleauthor:: Mark E. Madsen <mark@madsenlab.org>
+
+Simulation runs with large populations and low innovation rates can take tens of thousands of generations
+just to reach quasi-stationarity.  checkpointPopulation() is a PyOperator which saves each replicate population
+to a file with simuPOP's Population.save(), every CHECKPOINT_INTERVAL generations.  Once every replicate has been
+saved at a generation, the write buffer is flushed and the SimulationCheckpoint record for the run is updated,
+so the recorded generation is always the last generation whose populations AND samples are both complete.
+
+A run which is resumed reloads its replicates from the last checkpoint, removes any samples written after that
+generation, and continues evolving from the next generation, without repeating burn-in.
+
+"""
+
+import logging as log
+import os
+from ming import Session, Field, schema
+from ming.declarative import Document
+import simuPOP as sim
+import ctpy.data
+from buffered_writer import flush_buffered_writer
+from storage_backend import get_storage_backend
+import individual_sample
+import trait_count_sample
+import trait_count_population
+import richness_sample
+import richness_population
+
+
+def _get_dataobj_id():
+    """
+        Returns the short handle used for this data object in Ming configuration
+    """
+    return 'simulation_checkpoints'
+
+def _get_collection_id():
+    """
+    :return: returns the collection name for this data object
+    """
+    return ctpy.data.generate_collection_id("_samples_raw")
+
+
+
+def storeSimulationCheckpoint(sim_id, mutation, popsize, seed, replicates):
+    """Records the start of a simulation run which is checkpointed, before any populations are saved.
+
+        Args:
+
+            sim_id (str):  UUID for this simulation run
+
+            mutation (float):  mutation rate
+
+            popsize (int):  Population size
+
+            seed (int):  random seed the simulation run was started with
+
+            replicates (int):  Number of replicate populations in the run
+
+        Returns:
+
+            Boolean true
+
+    """
+    SimulationCheckpoint(dict(
+        simulation_run_id=sim_id,
+        mutation_rate=mutation,
+        population_size=popsize,
+        seed=seed,
+        replicates=replicates,
+        generation=-1,
+        filenames=[],
+        complete=False
+    )).m.insert()
+    return True
+
+
+def checkpointPopulation(pop, param):
+    """Saves a replicant population to the checkpoint directory.  After the last replicate has been saved for
+    a generation, flushes buffered samples and records the generation as the run's last complete checkpoint.
+
+        Args:
+
+            pop (Population):  simuPOP population replicate.
+
+            params (list):  list of parameters (simulation ID, checkpoint directory, number of replicates)
+
+        Returns:
+
+            Boolean true:  all PyOperators need to return true.
+
+    """
+    (sim_id, directory, replicates) = param
+    popID = pop.dvars().rep
+    gen = pop.dvars().gen
+
+    filename = checkpoint_filename(directory, sim_id, gen, popID)
+    pop.save(filename + ".tmp")
+    os.rename(filename + ".tmp", filename)
+
+    if popID == replicates - 1:
+        flush_buffered_writer()
+        record = SimulationCheckpoint.m.find(dict(simulation_run_id=sim_id)).one()
+        previous = record.filenames
+        record.generation = gen
+        record.filenames = [checkpoint_filename(directory, sim_id, gen, rep) for rep in range(0, replicates)]
+        record.m.save()
+        for old_file in previous:
+            if os.path.exists(old_file):
+                os.remove(old_file)
+        log.debug("Checkpointed run %s at generation %s", sim_id, gen)
+    return True
+
+
+def checkpoint_filename(directory, sim_id, generation, replication):
+    """
+    :return: path of the saved population for one replicate of a simulation run at a generation
+    """
+    run = sim_id.replace("urn:uuid:", "")
+    return os.path.join(directory, "%s-gen%s-rep%s.pop" % (run, generation, replication))
+
+
+def get_incomplete_checkpoints():
+    """
+    Returns the checkpoint records of simulation runs which were started but have not completed.
+
+    :return: list of SimulationCheckpoint
+    """
+    return SimulationCheckpoint.m.find(dict(complete=False)).all()
+
+
+def get_checkpoint(sim_id):
+    """
+    :return: SimulationCheckpoint for the simulation run, or None
+    """
+    return SimulationCheckpoint.m.find(dict(simulation_run_id=sim_id)).first()
+
+
+def mark_checkpoint_complete(sim_id):
+    """
+    Marks a simulation run as completed, and removes its checkpoint files.
+
+    :return: None
+    """
+    record = SimulationCheckpoint.m.find(dict(simulation_run_id=sim_id)).one()
+    for filename in record.filenames:
+        if os.path.exists(filename):
+            os.remove(filename)
+    record.complete = True
+    record.filenames = []
+    record.m.save()
+
+
+def load_checkpoint_populations(record):
+    """
+    Loads the replicate populations saved at a run's last checkpoint.  Each population is set to continue
+    with the generation after the checkpoint.
+
+    :param record: SimulationCheckpoint
+    :return: list of simuPOP populations, in order of replication
+    """
+    pops = []
+    for filename in record.filenames:
+        pop = sim.loadPopulation(filename)
+        pop.dvars().gen = record.generation + 1
+        pops.append(pop)
+    return pops
+
+
+def remove_samples_after(sim_id, generation):
+    """
+    Removes the raw samples stored by a simulation run after a generation, which would otherwise be
+    duplicated when the run resumes from its checkpoint at that generation.
+
+    :param sim_id: simulation run identifier
+    :param generation: last generation whose samples are kept; -1 removes all samples
+    :return: None
+    """
+    query = dict(simulation_run_id=sim_id, simulation_time={'$gt': generation})
+    for document_class in [individual_sample.IndividualSample, trait_count_sample.TraitCountSample,
+                           trait_count_population.TraitCountSample, richness_sample.RichnessSample,
+                           richness_population.RichnessSample]:
+        get_storage_backend().remove(document_class, query)
+
+
+
+class SimulationCheckpoint(Document):
+
+    class __mongometa__:
+        session = Session.by_name(_get_dataobj_id())
+        name = 'simulation_checkpoints'
+        indexes = [('simulation_run_id',), ('complete',)]
+
+    _id = Field(schema.ObjectId)
+    simulation_run_id = Field(str)
+    mutation_rate = Field(float)
+    population_size = Field(int)
+    seed = Field(int)
+    replicates = Field(int)
+    generation = Field(int)          # last generation with saved populations and flushed samples, or -1
+    filenames = Field([str])
+    complete = Field(bool)
@@ -84,6 +84,7 @@ class SimulationRun(Document):
     class __mongometa__:
         session = Session.by_name(_get_dataobj_id())
         name = 'simulation_runs'
+        indexes = [('simulation_run_id',)]
 
     _id = Field(schema.ObjectId)
     script_filename = Field(str)
@@ -0,0 +1,444 @@
+# Copyright (c) 2013.  Mark E. Madsen <mark@madsenlab.org>
+#
+# This work is licensed under the Apache Public License 2.0
+#
+"""
+.. module:: sqlite_backend
+    :platform: Unix, Windows
+    :synopsis: Storage backend which keeps every ctpy.data collection in a single local SQLite file.
+
+.. moduleauthor:: Mark E. Madsen <mark@madsenlab.org>
+
+For single-node experiments and tests, a MongoDB server is more trouble than it is worth.  The SQLite backend
+stores each collection as a table in one file, with each document encoded as BSON.  The fields which the
+simulation and analytics scripts query by (simulation run, replication, simulation time, sample size,
+dimensionality, classification, and experiment name) are also stored as indexed columns, so that query clauses
+on them are evaluated by SQLite, and any remaining clauses are matched in Python.
+
+Besides the StorageBackend methods used by the buffered writer and the analytics readers, the backend binds the
+Ming session of every ctpy.data module to a pymongo-style collection adapter, so that the existing store*,
+updateField*, and .m.find() code runs unchanged against the local file.  Bulk inserts are written in a single
+transaction, and every other write commits as it is made, so that parallel worker processes see each other's work.
+
+"""
+
+import itertools
+import logging as log
+import os
+import sqlite3
+import ctpy.data
+from bson import BSON
+from bson.objectid import ObjectId
+from ming import Session
+from storage_backend import StorageBackend, collection_path, match_query, as_record
+
+KEY_FIELDS = ["experiment_name", "simulation_run_id", "classification_id", "replication", "simulation_time",
+              "sample_size", "dimensionality"]
+"""
+Fields stored as indexed table columns, in addition to the BSON document.
+"""
+
+INDEXES = [("simulation_run_id", "replication", "simulation_time"),
+           ("classification_id", "simulation_run_id", "replication"),
+           ("dimensionality", "sample_size"),
+           ("experiment_name",)]
+
+
+class SQLiteStorageBackend(StorageBackend):
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._conn = None
+        self._conn_pid = None
+        self._tables = set()
+
+
+    def insert(self, document_class, documents):
+        self.insert_documents(_table_name(*collection_path(document_class)), documents)
+
+    def find(self, document_class, query=None, sort=None, limit=None):
+        return (as_record(doc) for doc in self.find_documents(_table_name(*collection_path(document_class)), query, sort, limit))
+
+    def update(self, document_class, query, fields):
+        self.update_documents(_table_name(*collection_path(document_class)), query, {'$set': fields}, multi=True)
+
+    def update_many(self, document_class, updates):
+        table = _table_name(*collection_path(document_class))
+        rows = []
+        for (query, fields) in updates:
+            for doc in self.find_documents(table, query, limit=1):
+                doc.update(fields)
+                rows.append(_update_row(doc))
+        conn = self._get_connection(table)
+        with conn:
+            conn.executemany(_update_statement(table), rows)
+
+    def remove(self, document_class, query):
+        self.remove_documents(_table_name(*collection_path(document_class)), query)
+
+    def close(self):
+        if self._conn is not None and self._conn_pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+
+
+    def bind_sessions(self):
+        """
+        Binds the Ming session of every ctpy.data module to this backend, by setting the session's bind, as
+        ming.configure() does for the sessions which exist when it is called.  Every module's session is created
+        when the module is imported, so all of them exist by the time a backend is configured.
+        """
+        for module in ctpy.data.modules:
+            Session.by_name(module._get_dataobj_id()).bind = _SQLiteDataStore(self, module._get_collection_id())
+
+
+    # operations on tables, shared by the StorageBackend methods and the Ming adapter
+
+    def insert_documents(self, table, documents):
+        """
+        Inserts documents in a single transaction, assigning an ObjectId to any without an _id.
+
+        :return: list of the _id of each document
+        """
+        conn = self._get_connection(table)
+        ids = []
+        rows = []
+        for doc in documents:
+            doc = dict(doc)
+            if doc.get("_id") is None:
+                doc["_id"] = ObjectId()
+            ids.append(doc["_id"])
+            rows.append(_row(doc))
+        with conn:
+            conn.executemany(_insert_statement(table, "INSERT"), rows)
+        return ids
+
+
+    def save_document(self, table, doc):
+        doc = dict(doc)
+        if doc.get("_id") is None:
+            doc["_id"] = ObjectId()
+        conn = self._get_connection(table)
+        with conn:
+            if conn.execute(_update_statement(table), _update_row(doc)).rowcount == 0:
+                conn.execute(_insert_statement(table, "INSERT"), _row(doc))
+        return doc["_id"]
+
+
+    def find_documents(self, table, query=None, sort=None, limit=None, skip=None):
+        """
+        Streams matching documents, decoding each row as it is read.  Only a sort on a field which is not a key
+        field column requires reading every match before the first is returned.
+
+        :param sort: optional field name, or list of (field, direction) tuples
+        :return: iterator of matching documents, as dicts
+        """
+        conn = self._get_connection(table)
+        (where, params, remaining) = _translate_query(query or dict())
+        statement = 'SELECT document FROM "%s"' % table
+        if len(where) > 0:
+            statement += " WHERE " + " AND ".join(where)
+
+        sort_keys = _sort_keys(sort)
+        sql_sort = all(field in KEY_FIELDS or field == "_id" for (field, direction) in sort_keys)
+        if len(sort_keys) > 0 and sql_sort:
+            statement += " ORDER BY " + ", ".join('"%s" %s' % (field, "DESC" if direction < 0 else "ASC")
+                                                  for (field, direction) in sort_keys)
+        sql_slice = len(remaining) == 0 and (len(sort_keys) == 0 or sql_sort)
+        if sql_slice and (limit or skip):
+            statement += " LIMIT %d OFFSET %d" % (limit or -1, skip or 0)
+
+        docs = (BSON(str(row[0])).decode() for row in conn.execute(statement, params))
+        if len(remaining) > 0:
+            docs = (doc for doc in docs if match_query(doc, remaining))
+        if len(sort_keys) > 0 and sql_sort is False:
+            docs = list(docs)
+            for (field, direction) in reversed(sort_keys):
+                docs.sort(key=lambda doc: doc.get(field), reverse=direction < 0)
+        if sql_slice is False and (limit or skip):
+            docs = itertools.islice(docs, skip or 0, (skip or 0) + limit if limit else None)
+        return iter(docs)
+
+
+    def update_documents(self, table, query, update, upsert=False, multi=False):
+        """
+        Applies a MongoDB-style update, either a {'$set': fields} or a replacement document, in one transaction.
+        Other update operators (e.g., $inc, $push, $unset) are not supported, and raise ValueError.
+        """
+        operators = sorted(key for key in update.keys() if key.startswith('$'))
+        if len(operators) > 0 and operators != ['$set']:
+            raise ValueError("SQLite backend only supports $set updates, not %s" % ", ".join(operators))
+
+        # read every match before writing, so the updates do not change the rows being read
+        docs = list(self.find_documents(table, query, limit=None if multi else 1))
+        found = len(docs) > 0
+        if len(docs) == 0 and upsert:
+            doc = dict((key, value) for (key, value) in (query or dict()).items() if not isinstance(value, dict))
+            docs = [doc]
+
+        rows = []
+        for doc in docs:
+            if "$set" in update:
+                doc.update(update["$set"])
+            else:
+                replacement = dict(update)
+                replacement["_id"] = doc.get("_id") or replacement.get("_id") or ObjectId()
+                doc = replacement
+            if doc.get("_id") is None:
+                doc["_id"] = ObjectId()
+            rows.append(_update_row(doc) if found else _row(doc))
+
+        conn = self._get_connection(table)
+        with conn:
+            if found:
+                conn.executemany(_update_statement(table), rows)
+            else:
+                conn.executemany(_insert_statement(table, "INSERT OR REPLACE"), rows)
+        return len(rows)
+
+
+    def remove_documents(self, table, query):
+        conn = self._get_connection(table)
+        (where, params, remaining) = _translate_query(query or dict())
+        with conn:
+            if len(remaining) == 0:
+                statement = 'DELETE FROM "%s"' % table
+                if len(where) > 0:
+                    statement += " WHERE " + " AND ".join(where)
+                conn.execute(statement, params)
+            else:
+                ids = [str(doc["_id"]) for doc in self.find_documents(table, query)]
+                conn.executemany('DELETE FROM "%s" WHERE _id = ?' % table, [(id,) for id in ids])
+
+
+    def count_documents(self, table, query=None):
+        (where, params, remaining) = _translate_query(query or dict())
+        if len(remaining) > 0:
+            return sum(1 for doc in self.find_documents(table, query))
+        statement = 'SELECT COUNT(*) FROM "%s"' % table
+        if len(where) > 0:
+            statement += " WHERE " + " AND ".join(where)
+        return self._get_connection(table).execute(statement, params).fetchone()[0]
+
+
+    def create_index(self, table, fields):
+        """
+        Creates an index on key field columns.  Indexes on other fields are ignored, since those fields are
+        only stored inside the BSON documents.
+        """
+        if all(field in KEY_FIELDS or field == "_id" for field in fields) is False:
+            log.debug("Not indexing %s on %s, which are not all key fields", fields, table)
+            return
+        conn = self._get_connection(table)
+        with conn:
+            conn.execute('CREATE INDEX IF NOT EXISTS "%s" ON "%s" (%s)' % (table + "__" + "_".join(fields), table,
+                                                                          ", ".join('"%s"' % f for f in fields)))
+
+
+    def _get_connection(self, table=None):
+        # sqlite connections cannot be shared across a fork, so each process opens its own
+        if self._conn is None or self._conn_pid != os.getpid():
+            directory = os.path.dirname(self.filename)
+            if len(directory) > 0 and not os.path.exists(directory):
+                os.makedirs(directory)
+            self._conn = sqlite3.connect(self.filename, timeout=60)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn_pid = os.getpid()
+            self._tables = set()
+        if table is not None and table not in self._tables:
+            self._create_table(table)
+        return self._conn
+
+
+    def _create_table(self, table):
+        columns = ", ".join('"%s"' % field for field in KEY_FIELDS)
+        with self._conn:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS "%s" (_id TEXT PRIMARY KEY, %s, document BLOB)' % (table, columns))
+        self._tables.add(table)
+        for fields in INDEXES:
+            self.create_index(table, fields)
+
+
+
+class _SQLiteDataStore:
+    """
+    Stands in for a Ming DataStore:  Ming sessions only use its "db", which returns collections by name.
+    """
+
+    def __init__(self, backend, database):
+        self.name = database
+        self.db = _SQLiteDatabase(backend, database)
+
+
+class _SQLiteDatabase:
+
+    def __init__(self, backend, database):
+        self.backend = backend
+        self.name = database
+
+    def __getitem__(self, collection):
+        return SQLiteCollection(self.backend, _table_name(self.name, collection))
+
+
+
+class SQLiteCollection:
+    """
+    Adapter presenting a table of a SQLiteStorageBackend with the subset of the pymongo collection API used by Ming.
+    """
+
+    def __init__(self, backend, table):
+        self.backend = backend
+        self.table = table
+
+    def find(self, spec=None, fields=None, sort=None, limit=None, skip=None, **kwargs):
+        return SQLiteCursor(self.backend, self.table, spec, sort, limit, skip)
+
+    def find_one(self, spec=None, **kwargs):
+        return next(self.backend.find_documents(self.table, spec, limit=1), None)
+
+    def insert(self, doc_or_docs, **kwargs):
+        if isinstance(doc_or_docs, dict):
+            return self.backend.insert_documents(self.table, [doc_or_docs])[0]
+        return self.backend.insert_documents(self.table, doc_or_docs)
+
+    def insert_many(self, docs, ordered=True, **kwargs):
+        return self.backend.insert_documents(self.table, docs)
+
+    def save(self, doc, **kwargs):
+        return self.backend.save_document(self.table, doc)
+
+    def update(self, spec, document, upsert=False, multi=False, **kwargs):
+        return self.backend.update_documents(self.table, spec, document, upsert, multi)
+
+    def remove(self, spec=None, **kwargs):
+        self.backend.remove_documents(self.table, spec)
+
+    def count(self):
+        return self.backend.count_documents(self.table)
+
+    def ensure_index(self, index_fields, **kwargs):
+        if isinstance(index_fields, basestring):
+            index_fields = [(index_fields, 1)]
+        self.backend.create_index(self.table, [field for (field, direction) in index_fields])
+
+    def index_information(self):
+        return dict()
+
+
+
+class SQLiteCursor:
+    """
+    Lazily evaluated query, with the sort, limit, skip, and count methods of a pymongo cursor.
+    """
+
+    def __init__(self, backend, table, spec, sort=None, limit=None, skip=None):
+        self.backend = backend
+        self.table = table
+        self.spec = spec
+        self._sort = sort
+        self._limit = limit
+        self._skip = skip
+        self._docs = None
+
+    def sort(self, key_or_list, direction=1):
+        self._sort = key_or_list if isinstance(key_or_list, list) else [(key_or_list, direction)]
+        return self
+
+    def limit(self, limit):
+        self._limit = limit
+        return self
+
+    def skip(self, skip):
+        self._skip = skip
+        return self
+
+    def count(self):
+        return self.backend.count_documents(self.table, self.spec)
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self._docs is None:
+            self._docs = self.backend.find_documents(self.table, self.spec, self._sort, self._limit, self._skip)
+        return next(self._docs)
+
+    __next__ = next
+
+
+
+def _table_name(database, collection):
+    return "%s.%s" % (database, collection)
+
+
+def _column_value(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    return value
+
+
+def _row(doc):
+    return tuple([str(doc["_id"])] + [_column_value(doc.get(field)) for field in KEY_FIELDS] +
+                 [sqlite3.Binary(BSON.encode(doc))])
+
+
+def _insert_statement(table, verb):
+    placeholders = ", ".join(["?"] * (len(KEY_FIELDS) + 2))
+    return '%s INTO "%s" VALUES (%s)' % (verb, table, placeholders)
+
+
+def _update_row(doc):
+    row = _row(doc)
+    return row[1:] + row[:1]
+
+
+def _update_statement(table):
+    # existing documents are updated in place rather than replaced, since a replaced row moves to the end of
+    # the table, where a query being streamed when it is written would read it again
+    columns = ", ".join('"%s" = ?' % field for field in KEY_FIELDS + ["document"])
+    return 'UPDATE "%s" SET %s WHERE _id = ?' % (table, columns)
+
+
+_SQL_OPERATORS = {'$gt': '>', '$gte': '>=', '$lt': '<', '$lte': '<=', '$ne': '!='}
+
+
+def _translate_query(query):
+    """
+    Splits a query into SQL conditions on key field columns, and the remaining clauses.
+
+    :return: tuple of (list of SQL conditions, list of parameters, dict of remaining clauses)
+    """
+    where = []
+    params = []
+    remaining = dict()
+    for (field, condition) in query.items():
+        if field not in KEY_FIELDS and field != "_id":
+            remaining[field] = condition
+            continue
+        if isinstance(condition, dict):
+            if all(op in _SQL_OPERATORS or op == '$in' for op in condition) is False:
+                remaining[field] = condition
+                continue
+            for (op, operand) in condition.items():
+                if op == '$in':
+                    operand = list(operand)
+                    where.append('"%s" IN (%s)' % (field, ", ".join(["?"] * len(operand))))
+                    params.extend(_column_value(item) for item in operand)
+                else:
+                    where.append('"%s" %s ?' % (field, _SQL_OPERATORS[op]))
+                    params.append(_column_value(operand))
+        elif condition is None:
+            where.append('"%s" IS NULL' % field)
+        else:
+            where.append('"%s" = ?' % field)
+            params.append(_column_value(condition))
+    return (where, params, remaining)
+
+
+def _sort_keys(sort):
+    if sort is None:
+        return []
+    if isinstance(sort, basestring):
+        return [(sort, 1)]
+    return list(sort)
@@ -0,0 +1,298 @@
+# Copyright (c) 2013.  Mark E. Madsen <mark@madsenlab.org>
+#
+# This work is licensed under the Apache Public License 2.0
+#
+"""
+.. module:: storage_backend
+    :platform: Unix, Windows
+    :synopsis: Pluggable storage of ctpy.data documents, in MongoDB or in local files.
+
+.. moduleauthor:: Mark E. Madsen <mark@madsenlab.org>
+
+The ctpy.data document classes are Ming declarative Documents, and by default they are stored in MongoDB.
+A StorageBackend stores and queries documents of those classes somewhere else, keyed by the same database and
+collection names.  The process-wide backend is chosen with configure_storage_backend(), from the STORAGE_BACKEND
+and STORAGE_DIRECTORY configuration values:
+
+    "mongodb":  MongoStorageBackend, which uses each class's Ming session (the default)
+    "columnar":  ColumnarStorageBackend, which writes Parquet files per experiment and collection
+    "sqlite":  SQLiteStorageBackend, which keeps every collection in one local SQLite file, and also binds the
+               Ming sessions to it, so that an experiment can run without a MongoDB server
+
+Queries are MongoDB-style dicts.  Local backends support equality on top-level fields, and the $gt, $gte,
+$lt, $lte, $ne and $in operators, which cover the queries made by the simulation and analytics scripts.
+
+"""
+
+import logging as log
+import os
+import sys
+from ming.base import Object
+from pymongo import UpdateOne
+
+
+class StorageBackend:
+    """
+    Interface for storage backends.  Each method takes the Ming document class whose collection is used.
+    """
+
+    supports_aggregation = False
+    """
+    True if the Ming collections of the ctpy.data classes run MongoDB aggregation pipelines, which summarize
+    results on the server (e.g., data.class_first_appearances).  Otherwise, results are read and summarized locally.
+    """
+
+    def insert(self, document_class, documents):
+        """
+        Inserts a batch of documents, in no particular order.
+
+        :param document_class: Ming declarative Document subclass
+        :param documents: list of dicts
+        :return: None
+        """
+        raise NotImplementedError
+
+    def find(self, document_class, query=None, sort=None, limit=None):
+        """
+        :param query: MongoDB-style query dict
+        :param sort: optional field name to sort the results by, in ascending order
+        :param limit: optional maximum number of results
+        :return: iterable of records with attribute access to their fields
+        """
+        raise NotImplementedError
+
+    def find_in_batches(self, document_class, query=None, sort='_id', batch_size=1000):
+        """
+        Generates the documents matching the query in batches, in ascending order of a field with unique values.
+        Each batch is a separate query for the documents after the last one of the previous batch, so no cursor
+        is held open long enough for the server to time it out.
+
+        :param query: MongoDB-style query dict
+        :param sort: field to order the documents by, such as _id
+        :param batch_size: maximum number of documents in a batch
+        :return: generator of lists of records
+        """
+        last = None
+        while True:
+            batch_query = dict(query or dict())
+            if last is not None:
+                batch_query[sort] = {'$gt': last}
+            batch = list(self.find(document_class, batch_query, sort=sort, limit=batch_size))
+            if len(batch) == 0:
+                return
+            yield batch
+            last = batch[-1][sort]
+
+    def update(self, document_class, query, fields):
+        """
+        Sets the given fields in every document matching the query.
+
+        :return: None
+        """
+        raise NotImplementedError
+
+    def update_many(self, document_class, updates):
+        """
+        Sets fields in a batch of documents, each matched by a query on its natural key.  Queries which match
+        no document are skipped, not inserted.
+
+        :param updates: list of (query, fields) tuples
+        :return: None
+        """
+        for (query, fields) in updates:
+            self.update(document_class, query, fields)
+
+    def remove(self, document_class, query):
+        """
+        Removes every document matching the query.
+
+        :return: None
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def bind_sessions(self):
+        """
+        Binds the Ming sessions of the ctpy.data modules to this backend, for backends which replace MongoDB
+        entirely.  Must be called again whenever Ming is reconfigured.
+
+        :return: None
+        """
+        pass
+
+
+
+class MongoStorageBackend(StorageBackend):
+    """
+    Stores documents in MongoDB through the Ming session of each document class.  Bulk updates and aggregation
+    pipelines run on the server, unless server_operations is False, for Ming sessions bound to mongo-in-memory
+    (mim), which implements neither.
+    """
+
+    def __init__(self, server_operations=True):
+        self.server_operations = server_operations
+        self.supports_aggregation = server_operations
+
+    def insert(self, document_class, documents):
+        insert_into_collection(document_class, documents)
+
+    def find(self, document_class, query=None, sort=None, limit=None):
+        # no cursor timeout, since analytics cursors over sample collections can be very long-lived
+        cursor = document_class.m.find(query or dict(), dict(timeout=False))
+        if sort is not None:
+            cursor = cursor.sort(sort, 1)
+        if limit is not None:
+            cursor = cursor.limit(limit)
+        return cursor
+
+    def update(self, document_class, query, fields):
+        document_class.m.update_partial(query, {'$set': fields}, multi=True)
+
+    def update_many(self, document_class, updates):
+        _update_unordered(document_class.m.collection, updates, self.server_operations)
+
+    def remove(self, document_class, query):
+        document_class.m.remove(query)
+
+
+
+def insert_into_collection(document_class, documents):
+    """
+    Inserts a batch of documents with one unordered bulk insert into the Ming collection of their document class,
+    which is where the store* functions write, whatever storage backend is configured.  Used for result
+    collections, which are exported from the database and never go to the sample storage backend.
+
+    :param document_class: Ming declarative Document subclass
+    :param documents: list of dicts
+    :return: None
+    """
+    _insert_unordered(document_class.m.collection, documents)
+
+
+def _insert_unordered(collection, docs):
+    if hasattr(collection, 'insert_many'):
+        collection.insert_many(docs, ordered=False)
+    else:
+        # pymongo 2.x
+        collection.insert(docs, continue_on_error=True)
+
+
+def _update_unordered(collection, updates, bulk=True):
+    if bulk is False:
+        for (query, fields) in updates:
+            collection.update(query, {'$set': fields}, upsert=False, multi=False)
+    else:
+        collection.bulk_write([UpdateOne(query, {'$set': fields}, upsert=False) for (query, fields) in updates],
+                              ordered=False)
+
+
+def collection_path(document_class):
+    """
+    :return: tuple of (database name, collection name) under which a document class is stored
+    """
+    module = sys.modules[document_class.__module__]
+    return (module._get_collection_id(), document_class.__mongometa__.name)
+
+
+def as_record(value):
+    """
+    Wraps a document read from a local backend, including any nested documents, so that fields can be
+    accessed as attributes, like those of a Ming document.
+    """
+    if isinstance(value, dict):
+        return Object((key, as_record(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return [as_record(item) for item in value]
+    return value
+
+
+def match_query(document, query):
+    """
+    :param document: dict
+    :param query: MongoDB-style query dict, with equality or $gt, $gte, $lt, $lte, $ne and $in on top-level fields
+    :return: True if the document matches every clause of the query
+    """
+    if query is None:
+        return True
+    for (field, condition) in query.items():
+        value = document.get(field)
+        if isinstance(condition, dict):
+            for (op, operand) in condition.items():
+                if _OPERATORS[op](value, operand) is False:
+                    return False
+        elif value != condition:
+            return False
+    return True
+
+
+_OPERATORS = {
+    '$gt': lambda value, operand: value is not None and value > operand,
+    '$gte': lambda value, operand: value is not None and value >= operand,
+    '$lt': lambda value, operand: value is not None and value < operand,
+    '$lte': lambda value, operand: value is not None and value <= operand,
+    '$ne': lambda value, operand: value != operand,
+    '$in': lambda value, operand: value in operand,
+}
+
+
+
+_backend = None
+
+
+def get_storage_backend():
+    """
+    Returns the process-wide storage backend, which is MongoDB unless configure_storage_backend() has been called.
+
+    :return: StorageBackend
+    """
+    global _backend
+    if _backend is None:
+        _backend = MongoStorageBackend()
+    return _backend
+
+
+def configure_storage_backend(name, directory=None):
+    """
+    Chooses the process-wide storage backend.
+
+    :param name: "mongodb", "columnar", or "sqlite"
+    :param directory: root directory for backends which store local files
+    :return: StorageBackend
+    """
+    global _backend
+    if _backend is not None:
+        _backend.close()
+    if name == "mongodb":
+        _backend = MongoStorageBackend()
+    elif name == "columnar":
+        from columnar_backend import ColumnarStorageBackend
+        _backend = ColumnarStorageBackend(directory)
+    elif name == "sqlite":
+        from sqlite_backend import SQLiteStorageBackend
+        _backend = SQLiteStorageBackend(os.path.join(directory or ".", "ctpy.sqlite"))
+    else:
+        raise ValueError("Unknown storage backend: %s" % name)
+    _backend.bind_sessions()
+    log.debug("Storage backend: %s", name)
+    return _backend
+
+
+def find_documents(document_class, query=None, sort=None, limit=None):
+    """
+    Queries a document class's collection in the configured storage backend.
+
+    :return: iterable of records
+    """
+    return get_storage_backend().find(document_class, query, sort, limit)
+
+
+def find_documents_in_batches(document_class, query=None, sort='_id', batch_size=1000):
+    """
+    Queries a document class's collection in the configured storage backend, in batches ordered by a field
+    with unique values.
+
+    :return: generator of lists of records
+    """
+    return get_storage_backend().find_in_batches(document_class, query, sort, batch_size)
@@ -0,0 +1,115 @@
+# Copyright (c) 2013.  Mark E. Madsen <mark@madsenlab.org>
+#
+# This work is licensed under the Apache Public License 2.0
+#
+"""
+.. module:: subsample_views
+    :platform: Unix, Windows
+    :synopsis: Read-only views of raw individual samples at smaller sample sizes and dimensionalities.
+
+.. moduleauthor:: Mark E. Madsen <mark@madsenlab.org>
+
+Raw individual samples are taken at the largest sample size and dimensionality studied.  The "fulldataset"
+copies every raw sample once for each combination of SAMPLE_SIZES_STUDIED and DIMENSIONS_STUDIED, keeping
+the first ssize individuals and the first dim loci of each genotype.  A SubsampleView presents the same
+subsample without storing it:  the raw genotype matrix is decoded once per record, and each view is a
+NumPy slice of that matrix, so no genotype data is copied.
+
+Views have the same attributes as an IndividualSampleFullDataset record, so the classification and trait
+statistics code can consume either.
+
+"""
+
+import itertools
+import logging as log
+from individual_sample import IndividualSample, get_genotype_matrix
+from sample_encoding import get_individual_ids
+from storage_backend import find_documents
+
+
+class SubsampleView:
+
+    class _Individual:
+        def __init__(self, id, genotype):
+            self.id = id
+            self.genotype = genotype
+
+    def __init__(self, record, sample_size, dimensionality, genotypes=None):
+        """
+        :param record: raw IndividualSample
+        :param sample_size: number of individuals in the view, from the start of the raw sample
+        :param dimensionality: number of loci in the view, from the start of each genotype
+        :param genotypes: genotype matrix of the raw record, if already decoded
+        """
+        if genotypes is None:
+            genotypes = get_genotype_matrix(record)
+        self.record = record
+        self.sample_size = sample_size
+        self.dimensionality = dimensionality
+        self.simulation_time = record.simulation_time
+        self.replication = record.replication
+        self.population_size = record.population_size
+        self.mutation_rate = record.mutation_rate
+        self.simulation_run_id = record.simulation_run_id
+        self.genotypes = genotypes[:sample_size, :dimensionality]
+
+
+    def genotype_matrix(self):
+        """
+        :return: integer array (sample size x dimensionality), a view on the raw sample's genotype matrix
+        """
+        return self.genotypes
+
+
+    def individual_ids(self):
+        """
+        :return: list of the ids of the individuals in the view
+        """
+        return get_individual_ids(self.record)[:self.sample_size]
+
+
+    @property
+    def sample(self):
+        """
+        List of individuals in the view, each with an id and genotype list, like the "sample" field
+        of a fulldataset record.  Only built for code which iterates over individuals.
+        """
+        return [SubsampleView._Individual(id, genotype) for id, genotype in zip(self.individual_ids(), self.genotypes.tolist())]
+
+
+
+def iter_subsample_views(records, sample_sizes, dimensions):
+    """
+    Generates views of each raw sample record at every combination of sample size and dimensionality.
+    Combinations larger than the raw sample are skipped.
+
+    :param records: iterable of raw IndividualSample records
+    :param sample_sizes: list of sample sizes
+    :param dimensions: list of dimensionalities
+    :return: generator of SubsampleView
+    """
+    for record in records:
+        genotypes = get_genotype_matrix(record)
+        for (ssize, dim) in itertools.product(sample_sizes, dimensions):
+            if ssize > record.sample_size or dim > record.dimensionality:
+                log.debug("Raw sample has ssize %s and dim %s, skipping view at ssize %s and dim %s",
+                          record.sample_size, record.dimensionality, ssize, dim)
+                continue
+            yield SubsampleView(record, ssize, dim, genotypes)
+
+
+def find_subsample_views(sample_sizes, dimensions, criteria=None):
+    """
+    Queries the raw individual samples, and generates subsample views of the results, in place
+    of a query on the fulldataset.
+
+    :param sample_sizes: list of sample sizes
+    :param dimensions: list of dimensionalities
+    :param criteria: optional dict of query criteria on the raw samples
+    :return: generator of SubsampleView
+    """
+    query = dict()
+    if criteria is not None:
+        query.update(criteria)
+    records = find_documents(IndividualSample, query)
+    return iter_subsample_views(records, sample_sizes, dimensions)
@@ -12,6 +12,7 @@ from ming.declarative import Document
 import simuPOP as sim
 from simuPOP.sampling import drawRandomSample
 import ctpy.data
+from buffered_writer import get_buffered_writer
 
 
 def _get_dataobj_id():
@@ -54,7 +55,7 @@ def sampleTraitCounts(pop, param):
 
 
 def _storeTraitCountSample(popID, ssize, locus, generation, mutation, popsize, sim_id, allele, count):
-    TraitCountSample(dict(
+    get_buffered_writer().add(TraitCountSample, dict(
         simulation_time=generation,
         replication=popID,
         locus=locus,
@@ -64,7 +65,7 @@ def _storeTraitCountSample(popID, ssize, locus, generation, mutation, popsize, s
         simulation_run_id=sim_id,
         allele=allele,
         count=count
-    )).m.insert()
+    ))
     return True
 
 
@@ -74,6 +75,7 @@ class TraitCountSample(Document):
     class __mongometa__:
         session = Session.by_name(_get_dataobj_id())
         name = 'trait_count_sample'
+        indexes = [('simulation_run_id', 'simulation_time', 'replication')]
 
     _id = Field(schema.ObjectId)
     simulation_time = Field(int)
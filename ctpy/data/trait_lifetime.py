@@ -159,6 +159,7 @@ class TraitLifetimeRecord(Document):
     class __mongometa__:
         session = Session.by_name(_get_dataobj_id())
         name = 'trait_lifetime'
+        indexes = [('simulation_run_id', 'replication')]
 
     _id = Field(schema.ObjectId)
     replication = Field(int)
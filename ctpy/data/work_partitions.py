@@ -0,0 +1,93 @@
+# Copyright (c) 2013.  Mark E. Madsen <mark@madsenlab.org>
+#
+# This work is licensed under the Apache Public License 2.0
+#
+"""
+.. module:: work_partitions
+    :platform: Unix, Windows
+    :synopsis: Partitioning of sample collections into disjoint shards for parallel processing.
+
+.. moduleauthor:: Mark E. Madsen <mark@madsenlab.org>
+
+Analytics scripts which use multiprocessing give each worker process a shard of the data, described
+as a dict of query criteria.  Shards are built from simulation_run_id values, and when there are
+fewer simulation runs than we want shards, from ranges of replication within each simulation run.
+Each worker reads its own shard directly from the database, over its own connection, so no documents
+cross process boundaries.
+
+"""
+
+import json
+import logging as log
+import ming
+import ctpy.data
+
+
+def get_simulation_run_ids():
+    """
+    Returns the sorted list of simulation run identifiers recorded for the current experiment.
+
+    :return: list of strings
+    """
+    res = ctpy.data.SimulationRun.m.find(dict(),dict(simulation_run_id=1)).all()
+    return sorted(set([run.simulation_run_id for run in res]))
+
+
+def partition_by_simulation_run(sim_run_ids, replications, num_shards):
+    """
+    Constructs at least num_shards disjoint query criteria covering the given simulation runs.  If there are
+    enough simulation runs, each shard is one simulation run, otherwise each simulation run is split
+    into contiguous ranges of replication.
+
+    :param sim_run_ids: list of simulation run identifiers
+    :param replications: number of replications per simulation run
+    :param num_shards: minimum number of shards desired
+    :return: list of dicts, each usable as (or merged into) a query on a sample collection
+    """
+    shards = []
+    if len(sim_run_ids) == 0:
+        return shards
+
+    if len(sim_run_ids) >= num_shards or replications <= 1:
+        for run_id in sim_run_ids:
+            shards.append(dict(simulation_run_id=run_id))
+        return shards
+
+    # split each run into this many ranges of replications, as evenly as possible
+    ranges_per_run = min(replications, -(-num_shards // len(sim_run_ids)))
+    boundaries = [(replications * i) // ranges_per_run for i in range(0, ranges_per_run + 1)]
+    for run_id in sim_run_ids:
+        for i in range(0, ranges_per_run):
+            shards.append(dict(simulation_run_id=run_id,
+                               replication={'$gte': boundaries[i], '$lt': boundaries[i + 1]}))
+    return shards
+
+
+def partition_key(stage, shard):
+    """
+    Returns a string which identifies a shard of an analytics stage, for checkpointing completed shards.
+    The key depends only on the stage and the shard's query criteria, so a checkpointed stage must build
+    its shards from the data alone (e.g., one shard per simulation run) for them to be recognized on resume.
+
+    :param stage: name of the analytics stage
+    :param shard: dict of query criteria, from partition_by_simulation_run
+    :return: string
+    """
+    return "%s:%s" % (stage, json.dumps(shard, sort_keys=True))
+
+
+def configure_worker_database(experiment_name, hostname, port):
+    """
+    Configures the ctpy.data module and Ming inside a worker process.  This must be called in each
+    child process after it starts, so that each worker has its own MongoDB connection rather than
+    sharing the parent's socket across a fork.
+
+    :return: None
+    """
+    ctpy.data.set_experiment_name(experiment_name)
+    ctpy.data.set_database_hostname(hostname)
+    ctpy.data.set_database_port(port)
+    config = ctpy.data.getMingConfiguration()
+    ming.configure(**config)
+    # reconfiguring Ming rebinds the sessions to MongoDB
+    ctpy.data.get_storage_backend().bind_sessions()
@@ -14,6 +14,8 @@
 
 """
 
-from wright_fisher_process import expectedIAQuasiStationarityTimeHaploid
-from diversity import diversity_shannon_entropy, diversity_iqv, diversity_neiman_tf
-from trait_statistics import TraitStatisticsPerSample
\ No newline at end of file
+from wright_fisher_process import expectedIAQuasiStationarityTimeHaploid, expectedIARunCost
+from diversity import diversity_shannon_entropy, diversity_iqv, diversity_neiman_tf, diversity_shannon_entropy_batch, diversity_iqv_batch, richness_batch, frequencies_batch, diversity_statistics_batch
+from slatkin_cache import SlatkinExactTestCache, slatkin_exact_test, slatkin_exact_test_batch, get_slatkin_cache
+import ewens_slatkin
+from trait_statistics import TraitStatisticsPerSample, TraitStatisticsPerRawSample, trait_counts_by_locus, prefix_trait_counts_by_locus
@@ -5,46 +5,103 @@
 # This module contains classes and functions for applying paradigmatic classifications
 # to the trait spaces of CTPy/simuPOP simulations.
 #
+# The diversity measures are computed by batch kernels, over a ragged batch of vectors stored CSR-style:
+# the values of every vector concatenated in one array, and an array of offsets, where vector i is
+# values[offsets[i]:offsets[i+1]].  The functions on a single frequency list are wrappers around the kernels.
+#
 
 import logging as logger
-from math import log
 import numpy as np
 
 
 
 def diversity_shannon_entropy(freq_list):
-    k = len(freq_list)
-    sw = 0.0
-    for i in range(0, k):
-        sw += freq_list[i] * log(freq_list[i])
-    if sw == 0:
-        return 0.0
-    else:
-        return sw * -1.0
+    return float(diversity_shannon_entropy_batch(freq_list, [0, len(freq_list)])[0])
 
 
 
 
 def diversity_iqv(freq_list):
-    k = len(freq_list)
+    return float(diversity_iqv_batch(freq_list, [0, len(freq_list)])[0])
+
+def diversity_neiman_tf(freq_list, num_classes_possible):
+    pass
+
 
-    if k <= 1:
-        return 0.0
 
-    isum = 1.0 - _sum_squares(freq_list)
-    factor = float(k) / (float(k) - 1.0)
-    iqv = factor * isum
+def diversity_shannon_entropy_batch(freqs, offsets):
+    """
+    Shannon entropy of each frequency vector in a batch.  Zero frequencies contribute nothing.
 
-    #logger.debug("k: %s  isum: %s  factor: %s  iqv:  %s", k, isum, factor, iqv)
+    :param freqs: 1D array of the frequencies of every vector, concatenated
+    :param offsets: 1D integer array of length (number of vectors + 1)
+    :return: float array with the entropy of each vector
+    """
+    freqs = np.asarray(freqs, dtype=np.float64)
+    terms = np.zeros(len(freqs))
+    nonzero = freqs > 0
+    terms[nonzero] = freqs[nonzero] * np.log(freqs[nonzero])
+    # adding 0.0 turns the -0.0 of an empty or single-valued vector into 0.0
+    return -_segment_sums(terms, offsets) + 0.0
+
+
+def diversity_iqv_batch(freqs, offsets):
+    """
+    Index of qualitative variation of each frequency vector in a batch:  k/(k-1) * (1 - sum of squared
+    frequencies), for a vector of k frequencies, or 0.0 if k <= 1.
+
+    :param freqs: 1D array of the frequencies of every vector, concatenated
+    :param offsets: 1D integer array of length (number of vectors + 1)
+    :return: float array with the IQV of each vector
+    """
+    freqs = np.asarray(freqs, dtype=np.float64)
+    k = np.diff(np.asarray(offsets, dtype=np.int64)).astype(np.float64)
+    iqv = np.zeros(len(k))
+    varied = k > 1
+    isum = 1.0 - _segment_sums(freqs ** 2.0, offsets)
+    iqv[varied] = (k[varied] / (k[varied] - 1.0)) * isum[varied]
     return iqv
 
-def diversity_neiman_tf(freq_list, num_classes_possible):
-    pass
+
+def richness_batch(counts, offsets):
+    """
+    :param counts: 1D array of the counts of every vector, concatenated
+    :param offsets: 1D integer array of length (number of vectors + 1)
+    :return: integer array with the number of nonzero counts in each vector
+    """
+    return _segment_sums(np.asarray(counts) > 0, offsets).astype(np.int64)
+
+
+def frequencies_batch(counts, offsets):
+    """
+    Converts each count vector in a batch to frequencies, dividing by the vector's total.
+
+    :return: float array of frequencies, with the same offsets as the counts
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    lengths = np.diff(np.asarray(offsets, dtype=np.int64))
+    totals = _segment_sums(counts, offsets)
+    return counts / np.repeat(totals, lengths)
+
+
+def diversity_statistics_batch(counts, offsets):
+    """
+    Computes the richness, Shannon entropy and IQV of every count vector in a batch, such as the trait counts
+    of each locus of a sample, with one NumPy call per measure.
+
+    :param counts: 1D array of the counts of every vector, concatenated
+    :param offsets: 1D integer array of length (number of vectors + 1)
+    :return: tuple of arrays (entropy, iqv, richness), with one value per vector
+    """
+    freqs = frequencies_batch(counts, offsets)
+    return (diversity_shannon_entropy_batch(freqs, offsets), diversity_iqv_batch(freqs, offsets),
+            richness_batch(counts, offsets))
 
 
 
-def _sum_squares(freq_list):
-    ss = 0.0
-    for p in freq_list:
-        ss += p ** 2.0
-    return ss
\ No newline at end of file
+def _segment_sums(values, offsets):
+    # bincount sums the values of each segment in order, and leaves empty segments at zero
+    offsets = np.asarray(offsets, dtype=np.int64)
+    lengths = np.diff(offsets)
+    segment_ids = np.repeat(np.arange(len(lengths)), lengths)
+    return np.bincount(segment_ids, weights=np.asarray(values, dtype=np.float64), minlength=len(lengths))
@@ -0,0 +1,275 @@
+# Copyright (c) 2013.  Mark E. Madsen <mark@madsenlab.org>
+#
+# This work is licensed under the Apache Public License 2.0
+#
+"""
+.. module:: ewens_slatkin
+    :platform: Unix, Windows
+    :synopsis: Vectorized Monte Carlo implementation of the Ewens-Slatkin exact test for neutrality.
+
+.. moduleauthor:: Mark E. Madsen <mark@madsenlab.org>
+
+This is a NumPy implementation of the test performed by the slatkin-exact-tools C extension
+(https://github.com/mmadsen/slatkin-exact-tools), following Slatkin (1994, 1996).  Given a sample of
+n individuals with k distinct traits, random configurations of counts are drawn from the Ewens sampling
+distribution conditional on k (which does not depend on theta), and the test probability is the fraction of
+random configurations whose Ewens probability is no greater than the probability of the observed configuration.
+
+Conditional on k, an Ewens configuration is the multiset of cycle lengths of a uniformly random permutation of n
+elements with exactly k cycles.  We draw these sequentially:  with m elements and l cycles remaining, the cycle
+containing the next element has length j with probability
+
+    (m-1)! / (m-j)! * |s(m-j, l-1)| / |s(m, l)|
+
+where |s(m,l)| are the unsigned Stirling numbers of the first kind.  Each step is done for all replicates at once,
+so that a single call generates the random configurations for every sample sharing the same (n, k).  Samples are
+grouped by (n, k) in montecarlo_batch(), and each group shares one set of random configurations.
+
+montecarlo_adaptive_batch() draws replicates in blocks instead, and stops testing a sample as soon as a
+Wilson score confidence interval for its probability lies entirely above or below a significance level.
+Samples whose probability is clearly near 0 or 1 then need only a few hundred replicates.
+
+"""
+
+import logging as log
+import math
+import numpy as np
+from math import lgamma
+
+
+def montecarlo(replicates, counts, k, random_state=None):
+    """
+    Ewens-Slatkin exact test for a single sample, with the same signature and return value as the
+    slatkin.montecarlo C extension.
+
+    :param replicates: number of random configurations to draw
+    :param counts: list of the counts of each trait (or class) in the sample
+    :param k: number of traits in the sample, i.e., len(counts)
+    :param random_state: optional numpy RandomState
+    :return: tuple of (probability, theta estimate)
+    """
+    return montecarlo_batch(replicates, [counts], random_state)[0]
+
+
+def montecarlo_batch(replicates, count_lists, random_state=None):
+    """
+    Ewens-Slatkin exact tests for many samples at once.  Samples with the same sample size and number of
+    traits are tested against one shared set of random configurations.
+
+    :param replicates: number of random configurations to draw for each (n, k) group
+    :param count_lists: list of lists of trait counts, one per sample
+    :param random_state: optional numpy RandomState
+    :return: list of (probability, theta estimate) tuples, in the order of count_lists
+    """
+    groups = dict()
+    for idx, counts in enumerate(count_lists):
+        counts = np.asarray(counts, dtype=np.int64)
+        key = (int(counts.sum()), len(counts))
+        groups.setdefault(key, []).append((idx, counts))
+
+    results = [None] * len(count_lists)
+    for (n, k), members in groups.items():
+        configurations = ewens_configurations(n, k, replicates, random_state)
+        random_stat = ewens_log_probability(configurations)
+        observed_stat = ewens_log_probability(np.vstack([counts for (idx, counts) in members]))
+        theta = theta_estimate(n, k)
+
+        # a small tolerance, so that random configurations identical to the observed one count as "no more probable"
+        tolerance = 1e-9 * np.maximum(1.0, np.abs(observed_stat))
+        num_le = (random_stat[np.newaxis, :] <= (observed_stat + tolerance)[:, np.newaxis]).sum(axis=1)
+
+        for (member, count_le) in zip(members, num_le):
+            results[member[0]] = (float(count_le) / float(replicates), theta)
+
+    return results
+
+
+def montecarlo_adaptive_batch(max_replicates, count_lists, significance, confidence=0.99, block_size=200, random_state=None):
+    """
+    Ewens-Slatkin exact tests for many samples, with sequential stopping.  Random configurations are drawn
+    in blocks of block_size for each (n, k) group, and a sample stops accumulating replicates once the Wilson
+    score interval for its probability, at the given confidence, excludes the significance level, or once
+    max_replicates have been drawn.
+
+    :param max_replicates: upper limit on the number of random configurations for any sample
+    :param count_lists: list of lists of trait counts, one per sample
+    :param significance: significance level the test probability is compared to (e.g., 0.05)
+    :param confidence: confidence level of the interval used for stopping
+    :param block_size: number of random configurations drawn at a time
+    :param random_state: optional numpy RandomState
+    :return: list of (probability, theta estimate, replicates used) tuples, in the order of count_lists
+    """
+    z = _normal_quantile(0.5 + confidence / 2.0)
+
+    groups = dict()
+    for idx, counts in enumerate(count_lists):
+        counts = np.asarray(counts, dtype=np.int64)
+        key = (int(counts.sum()), len(counts))
+        groups.setdefault(key, []).append((idx, counts))
+
+    results = [None] * len(count_lists)
+    for (n, k), members in groups.items():
+        observed_stat = ewens_log_probability(np.vstack([counts for (idx, counts) in members]))
+        tolerance = 1e-9 * np.maximum(1.0, np.abs(observed_stat))
+        theta = theta_estimate(n, k)
+
+        num_le = np.zeros(len(members), dtype=np.int64)
+        num_drawn = np.zeros(len(members), dtype=np.int64)
+        active = np.ones(len(members), dtype=bool)
+
+        while np.any(active):
+            block = min(block_size, max_replicates - num_drawn[active].max())
+            random_stat = ewens_log_probability(ewens_configurations(n, k, block, random_state))
+            active_idx = np.nonzero(active)[0]
+            num_le[active_idx] += (random_stat[np.newaxis, :] <= (observed_stat[active_idx] + tolerance[active_idx])[:, np.newaxis]).sum(axis=1)
+            num_drawn[active_idx] += block
+
+            (lower, upper) = _wilson_interval(num_le[active_idx], num_drawn[active_idx], z)
+            decided = (upper < significance) | (lower > significance) | (num_drawn[active_idx] >= max_replicates)
+            active[active_idx[decided]] = False
+
+        for (member, count_le, drawn) in zip(members, num_le, num_drawn):
+            results[member[0]] = (float(count_le) / float(drawn), theta, int(drawn))
+
+    return results
+
+
+def _wilson_interval(successes, trials, z):
+    trials = trials.astype(np.float64)
+    p_hat = successes / trials
+    denominator = 1.0 + z * z / trials
+    center = (p_hat + z * z / (2.0 * trials)) / denominator
+    half_width = z * np.sqrt(p_hat * (1.0 - p_hat) / trials + z * z / (4.0 * trials * trials)) / denominator
+    return (center - half_width, center + half_width)
+
+
+def _normal_quantile(p):
+    # inverse of the standard normal CDF by bisection, good enough for choosing confidence bounds
+    lower = -10.0
+    upper = 10.0
+    for iteration in range(0, 100):
+        mid = (lower + upper) / 2.0
+        if 0.5 * math.erfc(-mid / math.sqrt(2.0)) < p:
+            lower = mid
+        else:
+            upper = mid
+    return (lower + upper) / 2.0
+
+
+def ewens_configurations(n, k, replicates, random_state=None):
+    """
+    Draws random configurations of counts from the Ewens sampling distribution, conditional on k traits
+    in a sample of size n.
+
+    :param n: sample size
+    :param k: number of distinct traits
+    :param replicates: number of configurations to draw
+    :param random_state: optional numpy RandomState, defaults to the global numpy.random generator
+    :return: integer array of shape (replicates x k), each row summing to n
+    """
+    if random_state is None:
+        # the module-level functions of numpy.random share numpy's global generator
+        random_state = np.random
+    if k < 1 or k > n:
+        raise ValueError("number of traits k=%s must be between 1 and sample size n=%s" % (k, n))
+
+    log_stirling = log_stirling_first_kind(n, k)
+    log_fact = np.array([lgamma(i + 1.0) for i in range(0, n + 1)])
+
+    configurations = np.empty((replicates, k), dtype=np.int64)
+    remaining = np.empty(replicates, dtype=np.int64)
+    remaining.fill(n)
+
+    m = np.arange(0, n + 1)[:, np.newaxis]
+    j = np.arange(1, n + 1)[np.newaxis, :]
+    rest = m - j
+    valid_rest = np.clip(rest, 0, n)
+
+    for step in range(0, k):
+        l = k - step
+        if l == 1:
+            configurations[:, step] = remaining
+            break
+
+        # log probability of each cycle length j, for each possible number of remaining elements m
+        with np.errstate(invalid='ignore'):
+            log_p = log_fact[np.clip(m - 1, 0, n)] - log_fact[valid_rest] + log_stirling[valid_rest, l - 1] - log_stirling[m, l]
+        log_p[(rest < l - 1) | (m < l)] = -np.inf
+        cdf = np.cumsum(np.exp(log_p), axis=1)
+
+        u = random_state.random_sample(replicates)
+        # the cycle length is one more than the number of cdf entries below the uniform variate
+        lengths = (cdf[remaining] < u[:, np.newaxis] * cdf[remaining, -1][:, np.newaxis]).sum(axis=1) + 1
+        configurations[:, step] = lengths
+        remaining -= lengths
+
+    return configurations
+
+
+def ewens_log_probability(configurations):
+    """
+    Log of the Ewens probability of each configuration of counts, conditional on n and k, up to a constant
+    which depends only on (n, k):  -sum(log r_i) - sum(log b_j!), where r_i are the counts and b_j is the number
+    of traits with count j.
+
+    :param configurations: integer array (samples x k) of counts
+    :return: float array of length samples
+    """
+    configurations = np.sort(np.asarray(configurations, dtype=np.int64), axis=1)
+    stat = -np.log(configurations).sum(axis=1)
+
+    # log(b_j!) is the sum of log(position) over each run of equal counts in the sorted rows
+    run_position = np.ones(configurations.shape[0])
+    for col in range(1, configurations.shape[1]):
+        same = configurations[:, col] == configurations[:, col - 1]
+        run_position = np.where(same, run_position + 1.0, 1.0)
+        stat -= np.log(run_position)
+
+    return stat
+
+
+def log_stirling_first_kind(n, k):
+    """
+    Table of the natural log of the unsigned Stirling numbers of the first kind, |s(m, l)| for
+    0 <= m <= n and 0 <= l <= k.  Entries which are zero are -inf.
+
+    :return: float array of shape (n+1 x k+1)
+    """
+    table = np.empty((n + 1, k + 1))
+    table.fill(-np.inf)
+    table[0, 0] = 0.0
+    for m in range(0, n):
+        # |s(m+1, l)| = m * |s(m, l)| + |s(m, l-1)|
+        with np.errstate(divide='ignore'):
+            table[m + 1, 1:] = np.logaddexp(table[m, 1:] + np.log(m), table[m, :-1])
+    return table
+
+
+def theta_estimate(n, k):
+    """
+    Ewens' estimate of theta, solving E[k] = sum_{i=0}^{n-1} theta / (theta + i) for the observed k.
+
+    :return: float theta estimate, 0.0 if k is 1 and infinity if every individual has a distinct trait
+    """
+    if k <= 1:
+        return 0.0
+    if k >= n:
+        return float('inf')
+
+    i = np.arange(0, n)
+
+    def expected_k(theta):
+        return (theta / (theta + i)).sum()
+
+    # expected k increases monotonically in theta, so we bisect in log space
+    lower = 1e-8
+    upper = 1e8
+    for iteration in range(0, 200):
+        mid = np.sqrt(lower * upper)
+        if expected_k(mid) < k:
+            lower = mid
+        else:
+            upper = mid
+        if upper / lower < 1.0 + 1e-12:
+            break
+    return float(np.sqrt(lower * upper))
@@ -0,0 +1,233 @@
+# Copyright (c) 2013.  Mark E. Madsen <mark@madsenlab.org>
+#
+# This work is licensed under the Apache Public License 2.0
+#
+"""
+.. module:: slatkin_cache
+    :platform: Unix, Windows
+    :synopsis: Memoization of Ewens-Slatkin exact test results, keyed by the configuration of counts.
+
+.. moduleauthor:: Mark E. Madsen <mark@madsenlab.org>
+
+The Ewens-Slatkin exact test depends only on the multiset of trait (or class) counts in a sample, and
+the number of Monte Carlo replicates used.  Small samples repeat the same sorted configuration of counts
+very often, so results are cached under the key (replicates, sorted counts).
+
+The cache has two tiers:  an in-process LRU dict, and an optional sqlite file which can be shared by
+many worker processes (e.g., the workers in retrofit-slatkin-parallel.py).  The sqlite connection
+is opened lazily in each process, so a cache object can be created before forking workers.
+
+Cache misses are calculated either by the slatkin-exact-tools C extension, or by the vectorized NumPy
+implementation in ctpy.math.ewens_slatkin, which can test a whole batch of samples in one call.
+
+If a significance level is given, the NumPy implementation uses sequential stopping, treating the number
+of replicates as an upper limit.  Adaptive results depend on the significance level, confidence level and
+block size, which are therefore part of the cache key (as zeros, for fixed tests), and every result records
+the number of replicates actually used.
+
+"""
+
+import logging as log
+import os
+import sqlite3
+from collections import OrderedDict
+import ewens_slatkin
+
+try:
+    from slatkin import montecarlo   # https://github.com/mmadsen/slatkin-exact-tools
+except ImportError:
+    # the NumPy implementation in ewens_slatkin can be used without the C extension
+    montecarlo = None
+
+IMPLEMENTATION_EXTENSION = "extension"
+IMPLEMENTATION_NUMPY = "numpy"
+
+
+class SlatkinExactTestCache:
+
+    def __init__(self, maxsize=100000, filename=None, implementation=IMPLEMENTATION_EXTENSION,
+                 significance=None, confidence=0.99, block_size=200):
+        self.maxsize = maxsize
+        self.filename = filename
+        self.implementation = implementation
+        self.significance = significance
+        self.confidence = confidence
+        self.block_size = block_size
+        if implementation == IMPLEMENTATION_EXTENSION and montecarlo is None:
+            raise ImportError("slatkin-exact-tools is not installed, use the numpy Slatkin implementation instead")
+        if significance is not None and implementation != IMPLEMENTATION_NUMPY:
+            raise ValueError("adaptive Slatkin tests require the numpy Slatkin implementation")
+        self.lru = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+        self._conn_pid = None
+
+
+    def montecarlo(self, replicates, counts):
+        """
+        Returns the Ewens-Slatkin exact test for a list of counts, from the cache if the same configuration
+        has been tested before with the same number of replicates.
+
+        :param replicates: number of Monte Carlo replicates
+        :param counts: list of trait or class counts in a sample, in any order
+        :return: tuple of (probability, theta estimate, replicates used)
+        """
+        return self.montecarlo_batch(replicates, [counts])[0]
+
+
+    def montecarlo_batch(self, replicates, count_lists):
+        """
+        Returns the Ewens-Slatkin exact tests for a list of samples.  Configurations not already in the cache
+        are calculated together, in a single batch if the NumPy implementation is used.
+
+        :param replicates: number of Monte Carlo replicates, or the maximum number for adaptive tests
+        :param count_lists: list of lists of trait or class counts
+        :return: list of (probability, theta estimate, replicates used) tuples, in the order of count_lists
+        """
+        keys = [self._key(replicates, counts) for counts in count_lists]
+        results = [None] * len(keys)
+        missing = dict()
+
+        for idx, key in enumerate(keys):
+            result = self.lru.pop(key, None)
+            if result is None:
+                result = self._get_persistent(key)
+            if result is None:
+                missing.setdefault(key, []).append(idx)
+                continue
+            self.hits += 1
+            results[idx] = result
+            self._remember(key, result)
+
+        if len(missing) > 0:
+            missing_keys = missing.keys()
+            self.misses += len(missing_keys)
+            calculated = self._calculate_batch(replicates, [key[-1] for key in missing_keys])
+            for key, result in zip(missing_keys, calculated):
+                self._put_persistent(key, result)
+                self._remember(key, result)
+                for idx in missing[key]:
+                    results[idx] = result
+
+        return results
+
+
+    def _key(self, replicates, counts):
+        # fixed tests don't depend on the stopping parameters, so they share one key whatever the configuration
+        if self.significance is None:
+            stopping = (0.0, 0.0, 0)
+        else:
+            stopping = (float(self.significance), float(self.confidence), int(self.block_size))
+        return (int(replicates),) + stopping + (tuple(sorted(int(c) for c in counts)),)
+
+
+    def _remember(self, key, result):
+        self.lru[key] = result
+        if len(self.lru) > self.maxsize:
+            self.lru.popitem(last=False)
+
+
+    def _calculate_batch(self, replicates, sorted_count_lists):
+        if self.significance is not None:
+            return ewens_slatkin.montecarlo_adaptive_batch(replicates, sorted_count_lists, self.significance,
+                                                           self.confidence, self.block_size)
+        if self.implementation == IMPLEMENTATION_NUMPY:
+            results = ewens_slatkin.montecarlo_batch(replicates, sorted_count_lists)
+        else:
+            results = [self._calculate(replicates, sorted_counts) for sorted_counts in sorted_count_lists]
+        return [(prob, theta, replicates) for (prob, theta) in results]
+
+
+    def _calculate(self, replicates, sorted_counts):
+        (prob, theta) = montecarlo(replicates, list(sorted_counts), len(sorted_counts))
+        return (prob, theta)
+
+
+    def _get_connection(self):
+        if self.filename is None:
+            return None
+        # sqlite connections cannot be shared across a fork, so each process opens its own
+        if self._conn is None or self._conn_pid != os.getpid():
+            self._conn = sqlite3.connect(self.filename, timeout=60)
+            self._conn_pid = os.getpid()
+            self._conn.execute("CREATE TABLE IF NOT EXISTS slatkin_exact_tests (replicates INTEGER, significance REAL, confidence REAL, block_size INTEGER, counts TEXT, prob REAL, theta REAL, replicates_used INTEGER, PRIMARY KEY (replicates, significance, confidence, block_size, counts))")
+            self._conn.commit()
+        return self._conn
+
+
+    def _get_persistent(self, key):
+        conn = self._get_connection()
+        if conn is None:
+            return None
+        row = conn.execute("SELECT prob, theta, replicates_used FROM slatkin_exact_tests WHERE replicates = ? AND significance = ? AND confidence = ? AND block_size = ? AND counts = ?",
+                           key[:-1] + (_encode_counts(key[-1]),)).fetchone()
+        if row is None:
+            return None
+        return (row[0], row[1], row[2])
+
+
+    def _put_persistent(self, key, result):
+        conn = self._get_connection()
+        if conn is None:
+            return
+        try:
+            conn.execute("INSERT OR IGNORE INTO slatkin_exact_tests VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                         key[:-1] + (_encode_counts(key[-1]),) + tuple(result))
+            conn.commit()
+        except sqlite3.OperationalError as e:
+            # another worker holding the lock for too long shouldn't kill the analysis, we just lose a cache entry
+            log.warn("Unable to save slatkin result to cache file %s: %s", self.filename, e)
+
+
+
+def _encode_counts(sorted_counts):
+    return ','.join([str(c) for c in sorted_counts])
+
+
+_shared_cache = None
+
+
+def get_slatkin_cache(simconfig):
+    """
+    Returns the process-wide cache configured by SLATKIN_CACHE_SIZE, SLATKIN_CACHE_FILENAME, SLATKIN_IMPLEMENTATION,
+    and if SLATKIN_ADAPTIVE is set, SLATKIN_SIGNIFICANCE_LEVEL, SLATKIN_ADAPTIVE_CONFIDENCE, and SLATKIN_ADAPTIVE_BLOCK_SIZE.
+
+    :param simconfig: CTPyConfiguration
+    :return: SlatkinExactTestCache
+    """
+    global _shared_cache
+    significance = simconfig.SLATKIN_SIGNIFICANCE_LEVEL if simconfig.SLATKIN_ADAPTIVE else None
+    if _shared_cache is None or _shared_cache.filename != simconfig.SLATKIN_CACHE_FILENAME \
+            or _shared_cache.implementation != simconfig.SLATKIN_IMPLEMENTATION \
+            or _shared_cache.significance != significance \
+            or _shared_cache.confidence != simconfig.SLATKIN_ADAPTIVE_CONFIDENCE \
+            or _shared_cache.block_size != simconfig.SLATKIN_ADAPTIVE_BLOCK_SIZE:
+        _shared_cache = SlatkinExactTestCache(simconfig.SLATKIN_CACHE_SIZE, simconfig.SLATKIN_CACHE_FILENAME,
+                                              simconfig.SLATKIN_IMPLEMENTATION, significance,
+                                              simconfig.SLATKIN_ADAPTIVE_CONFIDENCE, simconfig.SLATKIN_ADAPTIVE_BLOCK_SIZE)
+    return _shared_cache
+
+
+def slatkin_exact_test(simconfig, counts):
+    """
+    Ewens-Slatkin exact test for neutrality, using SLATKIN_MONTECARLO_REPLICATES replicates (at most, in adaptive
+    mode) and the shared result cache.
+
+    :param simconfig: CTPyConfiguration
+    :param counts: list of trait or class counts
+    :return: tuple of (probability, theta estimate, replicates used)
+    """
+    return get_slatkin_cache(simconfig).montecarlo(simconfig.SLATKIN_MONTECARLO_REPLICATES, counts)
+
+
+def slatkin_exact_test_batch(simconfig, count_lists):
+    """
+    Ewens-Slatkin exact tests for a list of samples, using SLATKIN_MONTECARLO_REPLICATES replicates (at most, in
+    adaptive mode) and the shared result cache.
+
+    :param simconfig: CTPyConfiguration
+    :param count_lists: list of lists of trait or class counts
+    :return: list of (probability, theta estimate, replicates used) tuples
+    """
+    return get_slatkin_cache(simconfig).montecarlo_batch(simconfig.SLATKIN_MONTECARLO_REPLICATES, count_lists)
@@ -9,10 +9,9 @@
 import ctpy.data as data
 from bson.objectid import ObjectId
 import logging as log
-from collections import defaultdict
 import numpy as np
-from diversity import diversity_iqv, diversity_shannon_entropy
-from slatkin import montecarlo   # https://github.com/mmadsen/slatkin-exact-tools
+from diversity import diversity_statistics_batch
+from slatkin_cache import slatkin_exact_test_batch
 import itertools
 
 
@@ -40,31 +39,16 @@ class TraitStatisticsPerSample:
         """
         s = self.sample
         #log.debug("Starting analysis of sample")
-        entropy_by_locus = []
-        iqv_by_locus = []
-        richness_by_locus = []
-        trait_counts = {}
-        slatkin_by_locus = []
 
-        # initialization
-        for locus in range(0, s.dimensionality):
-            trait_counts[locus] = defaultdict(int)
+        # the trait counts of every locus are batched CSR-style, so the diversity of all loci is computed in one call
+        (counts, offsets) = trait_counts_by_locus(data.get_genotype_matrix(s))
+        (entropy, iqv, richness) = diversity_statistics_batch(counts, offsets)
+        entropy_by_locus = entropy.tolist()
+        iqv_by_locus = iqv.tolist()
+        richness_by_locus = richness.tolist()
 
-        # go through individuals in a single pass, counting all loci
-        # we do this manually, because using numpy.bincount yields an array with zeros
-        # for any slot which has no entries, which is a giant space given MAXALLELE
-        for indiv in s.sample:
-            for locus_num in range(0, s.dimensionality):
-                trait_counts[locus_num][indiv.genotype[locus_num]] += 1
-
-        #log.debug("%s", trait_counts)
-
-        for locus in range(0, s.dimensionality):
-            richness_by_locus.append(len(trait_counts[locus]))
-            trait_freq = [float(count)/float(s.sample_size) for trait_id, count in trait_counts[locus].items() ]
-            entropy_by_locus.append(diversity_shannon_entropy(trait_freq))
-            iqv_by_locus.append(diversity_iqv(trait_freq))
-            slatkin_by_locus.append(self._slatkin_neutrality_for_locus(trait_counts[locus].values()))
+        counts_by_locus = np.split(counts, offsets[1:-1])
+        (slatkin_by_locus, replicates_by_locus) = self._slatkin_neutrality_for_loci(counts_by_locus)
 
 
         mean_entropy = np.mean(np.array(entropy_by_locus))
@@ -75,53 +59,175 @@ class TraitStatisticsPerSample:
         # store the result
         data.storePerGenerationStatsTraits(s.simulation_time,s.replication,s.sample_size,s.population_size,
                                            s.mutation_rate,s.dimensionality, s.simulation_run_id,mean_richness,mean_entropy,mean_iqv,
-                                           richness_by_locus,entropy_by_locus,iqv_by_locus,slatkin_by_locus,mean_slatkin)
+                                           richness_by_locus,entropy_by_locus,iqv_by_locus,slatkin_by_locus,mean_slatkin,
+                                           replicates_by_locus)
 
 
 
     def update_with_slatkin_test(self):
         """
         Given a per generation trait statistics record, we get the original sample, total its trait counts,
-        get the slatkin exact neutrality result, and UPDATE the per generation trait statistics record.
+        get the slatkin exact neutrality result, and UPDATE the per generation trait statistics record.  The update
+        is buffered, so callers should call data.flush_buffered_writer() after their last sample.
 
         :return:
         """
         s = self.sample
-        trait_counts = {}
-        slatkin_results = []
         #log.debug("Starting retrofit of sample")
 
-        # initialization
-        for locus in range(0, s.dimensionality):
-            trait_counts[locus] = defaultdict(int)
+        (counts, offsets) = trait_counts_by_locus(data.get_genotype_matrix(s))
+        (slatkin_results, replicates_by_locus) = self._slatkin_neutrality_for_loci(np.split(counts, offsets[1:-1]))
+
+        mean_slatkin = np.mean(np.array(slatkin_results))
 
-        # go through individuals in a single pass, counting all loci
-        # we do this manually, because using numpy.bincount yields an array with zeros
-        # for any slot which has no entries, which is a giant space given MAXALLELE
-        for indiv in s.sample:
-            for locus_num in range(0, s.dimensionality):
-                trait_counts[locus_num][indiv.genotype[locus_num]] += 1
+        data.updateFieldsPerGenerationStatsTraits(data.keyPerGenerationStatsTraits(s),
+                                                  dict(loci_neutrality_slatkin=slatkin_results,
+                                                       mean_neutrality_slatkin=mean_slatkin,
+                                                       loci_neutrality_slatkin_replicates=replicates_by_locus))
 
 
 
-        for locus in range(0, s.dimensionality):
-            counts = trait_counts[locus].values()
-            slatkin_results.append(self._slatkin_neutrality_for_locus(counts))
+    def _slatkin_neutrality_for_loci(self, trait_counts_by_locus):
+        # all loci are tested in one batch, which the numpy implementation does in a single call
+        results = slatkin_exact_test_batch(self.simconfig, trait_counts_by_locus)
+        return ([prob for (prob, theta, replicates) in results], [replicates for (prob, theta, replicates) in results])
+
 
-        mean_slatkin = np.mean(np.array(slatkin_results))
 
-        record = data.PerGenerationStatsTraits.m.find(dict(
-            dimensionality=s.dimensionality,
-            simulation_run_id=s.simulation_run_id,
-            simulation_time=s.simulation_time,
-            replication=s.replication,
-            sample_size=s.sample_size)).one()
+class TraitStatisticsPerRawSample:
+    """
+    Calculates the trait statistics of every (sample size, dimensionality) subsample of a raw individual sample
+    at once.  Subsamples are prefixes of the raw genotype matrix:  the first ssize individuals and the first dim
+    loci.  The statistics of a locus do not depend on the dimensionality, so the trait counts of each locus are
+    accumulated once over the raw sample, at each sample size studied, and each subsample's statistics are the
+    first dim loci of its sample size.  Diversity and Slatkin tests are calculated in one batch for the whole
+    raw sample, and the resulting records are written in one batch.
+    """
 
-        data.updateFieldPerGenerationStatsTraits(record._id, "loci_neutrality_slatkin", slatkin_results)
-        data.updateFieldPerGenerationStatsTraits(record._id, "mean_neutrality_slatkin", mean_slatkin)
+    def __init__(self, simconfig, record, sample_sizes, dimensions):
+        """
+        :param simconfig: CTPyConfiguration
+        :param record: raw IndividualSample
+        :param sample_sizes: list of sample sizes studied
+        :param dimensions: list of dimensionalities studied
+        """
+        self.simconfig = simconfig
+        self.record = record
+        self.sample_sizes = sample_sizes
+        self.dimensions = dimensions
 
 
+    def process_trait_statistics(self):
+        """
+        Calculates the statistics of TraitStatisticsPerSample.process_trait_statistics for every subsample of the
+        raw sample, and stores the PerGenerationStatsTraits records with one bulk insert.  Subsamples larger than
+        the raw sample are skipped.
 
-    def _slatkin_neutrality_for_locus(self, trait_counts):
-        (prob, theta) = montecarlo(self.simconfig.SLATKIN_MONTECARLO_REPLICATES, trait_counts, len(trait_counts))
-        return prob
\ No newline at end of file
+        :return: number of records written
+        """
+        r = self.record
+        variants = []
+        for (ssize, dim) in itertools.product(self.sample_sizes, self.dimensions):
+            if ssize > r.sample_size or dim > r.dimensionality:
+                log.debug("Raw sample has ssize %s and dim %s, skipping statistics at ssize %s and dim %s",
+                          r.sample_size, r.dimensionality, ssize, dim)
+                continue
+            variants.append((ssize, dim))
+        if len(variants) == 0:
+            return 0
+
+        sizes = sorted(set([ssize for (ssize, dim) in variants]))
+        num_loci = max([dim for (ssize, dim) in variants])
+
+        # one count vector per (sample size, locus), for every sample size and locus in a single batch
+        (counts, offsets) = prefix_trait_counts_by_locus(data.get_genotype_matrix(r)[:, :num_loci], sizes)
+        (entropy, iqv, richness) = diversity_statistics_batch(counts, offsets)
+        slatkin_results = slatkin_exact_test_batch(self.simconfig, np.split(counts, offsets[1:-1]))
+
+        records = []
+        for (ssize, dim) in variants:
+            start = sizes.index(ssize) * num_loci
+            loci = slice(start, start + dim)
+            slatkin_by_locus = [prob for (prob, theta, replicates) in slatkin_results[loci]]
+            replicates_by_locus = [replicates for (prob, theta, replicates) in slatkin_results[loci]]
+            records.append(data.fieldsPerGenerationStatsTraits(r.simulation_time, r.replication, ssize, r.population_size,
+                                                               r.mutation_rate, dim, r.simulation_run_id,
+                                                               np.mean(richness[loci]), np.mean(entropy[loci]), np.mean(iqv[loci]),
+                                                               richness[loci].tolist(), entropy[loci].tolist(), iqv[loci].tolist(),
+                                                               slatkin_by_locus, np.mean(np.array(slatkin_by_locus)),
+                                                               replicates_by_locus))
+
+        data.storePerGenerationStatsTraitsBatch(records)
+        return len(records)
+
+
+
+def trait_counts_by_locus(genotypes):
+    """
+    Counts the number of individuals carrying each trait, at every locus of a sample, without iterating over
+    individuals in Python.  Each column of the genotype matrix is sorted, and the counts are the lengths of the
+    runs of equal alleles, so only traits which are present in the sample are counted (unlike np.bincount,
+    which would allocate a slot for every allele up to MAXALLELE).
+
+    The counts are returned CSR-style, as one array with the counts of each locus in allele order, and an
+    offsets array of length loci + 1, in the form expected by diversity_statistics_batch().
+
+    :param genotypes: integer array (sample size x loci)
+    :return: tuple of (counts, offsets) integer arrays
+    """
+    genotypes = np.asarray(genotypes)
+    (num_individuals, num_loci) = genotypes.shape
+    # one row per locus, sorted, so that flat indices run locus by locus
+    by_locus = np.sort(genotypes.T, axis=1)
+
+    run_starts = np.ones(by_locus.shape, dtype=bool)
+    run_starts[:, 1:] = by_locus[:, 1:] != by_locus[:, :-1]
+
+    start_idx = np.flatnonzero(run_starts)
+    counts = np.diff(np.append(start_idx, num_individuals * num_loci))
+    offsets = np.zeros(num_loci + 1, dtype=np.int64)
+    np.cumsum(run_starts.sum(axis=1), out=offsets[1:])
+    return (counts, offsets)
+
+
+
+def prefix_trait_counts_by_locus(genotypes, sample_sizes):
+    """
+    Counts the traits at every locus of the first ssize individuals of a sample, for each of several sample sizes,
+    in one pass over the sample.  Alleles are numbered densely within each locus, each individual is assigned to
+    the smallest sample size which includes it, and the counts of each sample size are the cumulative sum of the
+    counts of those segments.
+
+    The counts are returned CSR-style, with one vector per (sample size, locus), in that order, each holding the
+    counts of the traits present in allele order, as in trait_counts_by_locus().
+
+    :param genotypes: integer array (sample size x loci)
+    :param sample_sizes: ascending list of sample sizes, none larger than the sample
+    :return: tuple of (counts, offsets) integer arrays, offsets of length len(sample_sizes) * loci + 1
+    """
+    genotypes = np.asarray(genotypes)
+    num_loci = genotypes.shape[1]
+    sample_sizes = np.asarray(sample_sizes, dtype=np.int64)
+    num_rows = int(sample_sizes[-1])
+
+    # allele ids are numbered consecutively across loci, so that one bincount covers all loci
+    allele_ids = np.empty((num_rows, num_loci), dtype=np.int64)
+    locus_starts = np.zeros(num_loci, dtype=np.int64)
+    num_alleles = 0
+    for locus in range(0, num_loci):
+        (alleles, inverse) = np.unique(genotypes[:num_rows, locus], return_inverse=True)
+        allele_ids[:, locus] = inverse + num_alleles
+        locus_starts[locus] = num_alleles
+        num_alleles += len(alleles)
+
+    segments = np.searchsorted(sample_sizes, np.arange(num_rows), side='right')
+    cells = (segments[:, np.newaxis] * num_alleles + allele_ids).ravel()
+    segment_counts = np.bincount(cells, minlength=len(sample_sizes) * num_alleles)
+    prefix_counts = np.cumsum(segment_counts.reshape(len(sample_sizes), num_alleles), axis=0)
+
+    present = prefix_counts > 0
+    counts = prefix_counts[present]
+    traits_per_vector = np.add.reduceat(present.astype(np.int64), locus_starts, axis=1)
+    offsets = np.zeros(traits_per_vector.size + 1, dtype=np.int64)
+    np.cumsum(traits_per_vector.ravel(), out=offsets[1:])
+    return (counts, offsets)
@@ -45,3 +45,23 @@ def expectedIAQuasiStationarityTimeHaploid(popsize,mutationrate):
     return int(math.ceil(time / 1000.0)) * 1000
 
 
+def expectedIARunCost(popsize, mutationrate, sim_length):
+    """Returns a relative estimate of the computational cost of a WF-IA simulation run, which samples for sim_length
+        generations after reaching quasi-stationarity.  The cost of each generation is proportional to population size.
+
+        Args:
+
+            popsize (int): The size of the haploid population
+
+            mutationrate (float):  the rate of innovation per individual per generation
+
+            sim_length (int):  the number of generations simulated after quasi-stationarity
+
+        Returns:
+
+            (int): The number of individual-generations simulated.
+
+    """
+    return popsize * (expectedIAQuasiStationarityTimeHaploid(popsize, mutationrate) + sim_length)
+
+
@@ -0,0 +1,6 @@
+# Copyright (c) 2013.  Mark E. Madsen <mark@madsenlab.org>
+#
+# This work is licensed under the Apache Public License 2.0
+#
+
+from wright_fisher_ia import WrightFisherIAEngine, ReplicateView, observeReplicate
@@ -0,0 +1,156 @@
+# Copyright (c) 2013.  Mark E. Madsen <mark@madsenlab.org>
+#
+# This work is licensed under the Apache Public License 2.0
+#
+"""
+.. module:: wright_fisher_ia
+    :platform: Unix, Windows
+    :synopsis: NumPy engine for the neutral Wright-Fisher infinite-alleles model, with all replicates in one array.
+
+.. moduleauthor:: Mark E. Madsen <mark@madsenlab.org>
+
+For the plain neutral WF-IA model, most of the time in a simuPOP run with Python operators goes to the
+operator round trips, not to copying and mutating genotypes.  This engine holds every replicate population
+in a single (replicates x N x loci) integer array.  Each generation, every individual copies a parent chosen
+uniformly at random from its own replicate (simuPOP's RandomSelection), and each locus of each individual
+then mutates with probability equal to the innovation rate.  Both steps are vectorized across all replicates.
+
+Mutations draw new alleles from a counter which only increases, so every innovation is a trait never seen before,
+and there is no need for KAlleleMutator's k=MAXALLELES approximation to the infinite-alleles model.
+
+Observers are (function, param, begin, step) tuples, called once per replicate after mutation in each
+matching generation, like PyOperators in simuPOP postOps.  Each is passed a ReplicateView, whose dvars()
+has rep and gen like a simuPOP population.  observeReplicate() takes the same parameters as the
+ctpy.data.observeGeneration operator, and stores observations in the same collections, through
+ctpy.data.store_generation_observation().
+
+"""
+
+import logging as log
+import numpy as np
+import ctpy.data as data
+
+
+class WrightFisherIAEngine:
+
+    def __init__(self, popsize, mutation, numloci, replicates, initial_distribution, seed=None):
+        self.popsize = popsize
+        self.mutation = mutation
+        self.numloci = numloci
+        self.replicates = replicates
+        self.random_state = np.random.RandomState(seed)
+        self.generation = 0
+
+        # initial alleles are 0 .. K-1, as with sim.InitGenotype(freq=initial_distribution)
+        distribution = np.asarray(initial_distribution, dtype=np.float64)
+        self.genotypes = self.random_state.choice(len(distribution), size=(replicates, popsize, numloci),
+                                                  p=distribution / distribution.sum()).astype(np.int64)
+        self.next_allele = len(distribution)
+        self._replicate_index = np.arange(replicates)[:, np.newaxis]
+
+
+    def step(self):
+        """
+        Advances all replicates by one generation of random copying, followed by mutation.
+
+        :return: None
+        """
+        parents = self.random_state.randint(0, self.popsize, size=(self.replicates, self.popsize))
+        self.genotypes = self.genotypes[self._replicate_index, parents]
+
+        mutated = self.random_state.random_sample(self.genotypes.shape) < self.mutation
+        num_mutations = int(mutated.sum())
+        if num_mutations > 0:
+            self.genotypes[mutated] = np.arange(self.next_allele, self.next_allele + num_mutations)
+            self.next_allele += num_mutations
+
+
+    def evolve(self, generations, observers=()):
+        """
+        Evolves all replicates for a number of generations, calling observers after each generation in
+        which they are due.
+
+        :param generations: number of generations to evolve
+        :param observers: list of (function, param, begin, step) tuples
+        :return: generation number at the end of evolution
+        """
+        for iteration in range(0, generations):
+            self.step()
+            for (func, param, begin, step) in observers:
+                if self.generation >= begin and (self.generation - begin) % step == 0:
+                    for rep in range(0, self.replicates):
+                        func(ReplicateView(self, rep), param)
+            self.generation += 1
+        return self.generation
+
+
+    def census_counts(self, rep):
+        """
+        :return: list with a dict of allele to count in replicate rep, for each locus
+        """
+        counts = []
+        for locus in range(0, self.numloci):
+            (alleles, allele_counts) = np.unique(self.genotypes[rep, :, locus], return_counts=True)
+            counts.append(dict(zip(alleles.tolist(), allele_counts.tolist())))
+        return counts
+
+
+    def sample(self, rep, ssize):
+        """
+        Draws a random sample of individuals from replicate rep, without replacement.
+
+        :return: integer array (ssize x loci) of the sampled genotypes
+        """
+        individuals = self.random_state.choice(self.popsize, size=ssize, replace=False)
+        return self.genotypes[rep, individuals]
+
+
+
+class ReplicateView:
+    """
+    A single replicate of a WrightFisherIAEngine, presented to observers in place of a simuPOP population.
+    """
+
+    class _Vars:
+        pass
+
+    def __init__(self, engine, rep):
+        self.engine = engine
+        self.rep = rep
+        self._vars = ReplicateView._Vars()
+        self._vars.rep = rep
+        self._vars.gen = engine.generation
+
+    def dvars(self):
+        return self._vars
+
+    def genotype_matrix(self):
+        return self.engine.genotypes[self.rep]
+
+    def census_counts(self):
+        return self.engine.census_counts(self.rep)
+
+    def sample(self, ssize):
+        return self.engine.sample(self.rep, ssize)
+
+
+
+def observeReplicate(pop, param):
+    """Takes a census of trait counts and richness in a replicate of a WrightFisherIAEngine, draws one sample of
+    individuals, and stores the same observations as ctpy.data.observeGeneration.
+
+        Args:
+
+            pop (ReplicateView):  engine replicate.
+
+            params (list):  list of parameters (sample size, mutation rate, population size, simulation ID, number of loci)
+
+        Returns:
+
+            Boolean true, like a PyOperator.
+
+    """
+    (ssize, mutation, popsize, sim_id, numloci) = param
+    data.store_generation_observation(pop.dvars().rep, pop.dvars().gen, mutation, popsize, sim_id,
+                                      pop.census_counts(), pop.sample(ssize))
+    return True
@@ -9,5 +9,6 @@ from simlogging import logGenerationCount
 from allele_distribution import constructUniformAllelicDistribution
 from script_args import ScriptArgs
 from configuration import CTPyConfiguration
+from sweep_schedule import order_longest_first, combination_seed
 
 __author__ = 'mark'
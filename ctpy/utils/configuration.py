@@ -22,6 +22,115 @@ class CTPyConfiguration:
     traits or classes.  This is generally expected to be constant across an analysis.
     """
 
+    SLATKIN_CACHE_SIZE = 100000
+    """
+    Number of Ewens-Slatkin test results kept in memory, keyed by the sorted configuration of counts.
+    Small samples repeat the same configurations often, so most tests are answered from the cache.
+    """
+
+    SLATKIN_IMPLEMENTATION = "extension"
+    """
+    Implementation of the Ewens-Slatkin Monte Carlo test:  "extension" uses the slatkin-exact-tools C extension
+    one sample at a time, "numpy" uses the vectorized implementation in ctpy.math.ewens_slatkin, which draws the
+    random configurations for all samples with the same sample size and richness in a single batch.
+    """
+
+    SLATKIN_CACHE_FILENAME = None
+    """
+    Optional path to a sqlite file used as a persistent, shared tier of the Ewens-Slatkin result cache.
+    Parallel workers (and later runs of the retrofit scripts) can then reuse each other's results.
+    """
+
+    SLATKIN_ADAPTIVE = False
+    """
+    If True, Ewens-Slatkin tests stop drawing Monte Carlo replicates once a confidence interval for the test
+    probability lies entirely above or below SLATKIN_SIGNIFICANCE_LEVEL, with SLATKIN_MONTECARLO_REPLICATES
+    as the upper limit.  Requires the "numpy" SLATKIN_IMPLEMENTATION.
+    """
+
+    SLATKIN_SIGNIFICANCE_LEVEL = 0.05
+    """
+    Significance level which adaptive Ewens-Slatkin tests need to resolve the test probability against.
+    """
+
+    SLATKIN_ADAPTIVE_CONFIDENCE = 0.99
+    """
+    Confidence level of the Wilson score interval used to decide when an adaptive Ewens-Slatkin test can stop.
+    """
+
+    SLATKIN_ADAPTIVE_BLOCK_SIZE = 200
+    """
+    Number of Monte Carlo replicates drawn between stopping checks in adaptive Ewens-Slatkin tests.
+    """
+
+    WRITE_BUFFER_DOCUMENTS = 5000
+    """
+    Number of documents the sampling operators buffer in memory before inserting them into the database
+    in a single unordered bulk insert per collection.
+    """
+
+    WRITE_BUFFER_SECONDS = 30.0
+    """
+    Maximum time in seconds that sample documents are held in the write buffer before being inserted.
+    """
+
+    CHECKPOINT_INTERVAL = 5000
+    """
+    Interval, in generations, between checkpoints of the replicate populations in a simulation run, which allow
+    an interrupted run to be resumed.  Zero disables checkpointing.
+    """
+
+    CHECKPOINT_DIRECTORY = "checkpoints"
+    """
+    Directory in which checkpointed populations are saved.
+    """
+
+    BURNIN_CACHE_DIRECTORY = None
+    """
+    Optional directory in which replicate populations are saved after burn-in to quasi-stationarity, keyed by
+    population size, innovation rate, number of loci, initial trait distribution, and seed.  Later simulation runs
+    with the same parameters (including those in other experiments) start sampling from the cached populations.
+    """
+
+    SIMULATION_ENGINE = "simupop"
+    """
+    Engine used by neutral-kn-sweep.py:  "simupop" evolves populations with simuPOP, while "numpy" uses
+    ctpy.simulation.WrightFisherIAEngine, which evolves all replicates of a parameter combination as one array.
+    """
+
+    MATERIALIZE_SUBSAMPLES = True
+    """
+    If True, subsample_individual_samples.py copies each raw individual sample into the fulldataset at every
+    combination of SAMPLE_SIZES_STUDIED and DIMENSIONS_STUDIED.  If False, nothing is copied, and classification
+    and trait statistics read the raw samples through ctpy.data.SubsampleView instead.
+    """
+
+    SUBSAMPLE_BATCH_SIZE = 1000
+    """
+    Number of raw individual samples read per query by subsample_individual_samples.py.  After the subsamples of
+    each batch are written, the last raw sample is recorded in the experiment record, so the stage can resume.
+    """
+
+    GENOTYPE_ENCODING = "list"
+    """
+    Encoding of the individuals in newly stored sample documents:  "list" stores a list of {id, genotype} dicts,
+    while "binary" packs the whole (sample size x loci) genotype matrix into one BSON binary field, which is several
+    times smaller, and is decoded directly into a NumPy array.  Readers handle documents in either encoding.
+    """
+
+    STORAGE_BACKEND = "mongodb"
+    """
+    Storage of sample documents and the analytic reads of them:  "mongodb" uses the Ming sessions configured from
+    the database host and port, while "columnar" writes Parquet files under STORAGE_DIRECTORY, partitioned by
+    experiment, collection, and simulation run (requires pyarrow), and "sqlite" keeps all of the experiment's
+    collections in a single SQLite file under STORAGE_DIRECTORY, with no database server.
+    """
+
+    STORAGE_DIRECTORY = "data"
+    """
+    Root directory of the files written by local storage backends.
+    """
+
     ### Research-level constants
 
     MAXALLELES = 1000000000
@@ -99,6 +208,12 @@ class CTPyConfiguration:
     larger. When examining temporal aggregation, we'll likely set this value to 1.
     """
 
+    SIMULATION_RANDOM_SEED = 1
+    """
+    Base random seed for simulation sweeps.  Each parameter combination is run with a seed derived from this value
+    and its parameters, so a sweep can be reproduced regardless of how its runs are scheduled across processes.
+    """
+
     REPLICATIONS_PER_PARAM_SET = 10
     """
     For each combination of simulation parameters, CTPy and simuPOP will run this many replicate
@@ -170,10 +285,11 @@ class CTPyConfiguration:
         'DIMENSION_PARTITIONS' : 'Classification coarseness levels (modes per dimension)',
         'NUM_REPLICATES_FOR_RANDOM_DIMENSION_MODES' : 'Replicate random classifications per coarseness level',
         'SLATKIN_MONTECARLO_REPLICATES' : 'Number of Monte Carlo replicates for Ewens-Slatkin neutrality test',
+        'SIMULATION_RANDOM_SEED' : 'Base random seed for simulation parameter sweeps',
     }
 
 
-    vars_to_filter = ['config', 'TIME_AVERAGING_DURATIONS_STUDIED', 'MODETYPE_EVEN','MODETYPE_RANDOM','MAXALLELES','DEME_NUMBERS_STUDIED','NUMBER_RANDOM_MIGRATION_MATRICES_STUDIED','DENSITY_SMALL_WORLD_LINKS_STUDIED','CLUSTERING_COEFFICIENTS_STUDIED']
+    vars_to_filter = ['config', 'TIME_AVERAGING_DURATIONS_STUDIED', 'MODETYPE_EVEN','MODETYPE_RANDOM','MAXALLELES','DEME_NUMBERS_STUDIED','NUMBER_RANDOM_MIGRATION_MATRICES_STUDIED','DENSITY_SMALL_WORLD_LINKS_STUDIED','CLUSTERING_COEFFICIENTS_STUDIED','SLATKIN_CACHE_SIZE','SLATKIN_CACHE_FILENAME','SLATKIN_IMPLEMENTATION','SLATKIN_ADAPTIVE','SLATKIN_SIGNIFICANCE_LEVEL','SLATKIN_ADAPTIVE_CONFIDENCE','SLATKIN_ADAPTIVE_BLOCK_SIZE','WRITE_BUFFER_DOCUMENTS','WRITE_BUFFER_SECONDS','CHECKPOINT_INTERVAL','CHECKPOINT_DIRECTORY','BURNIN_CACHE_DIRECTORY','SIMULATION_ENGINE','MATERIALIZE_SUBSAMPLES','SUBSAMPLE_BATCH_SIZE','GENOTYPE_ENCODING','STORAGE_BACKEND','STORAGE_DIRECTORY']
     """
     List of variables which are never (or at least currently) pretty-printed into summary tables using the latex or markdown/pandoc methods
 
@@ -16,6 +16,7 @@ class ScriptArgs:
     classification_list = []
     parallelization = 5
     configuration = None  # test for existence via:  if sargs.configuration is None:
+    resume = False
 
     def __init__(self):
         parser = argparse.ArgumentParser()
@@ -23,8 +24,9 @@ class ScriptArgs:
         parser.add_argument("--debug", help="turn on debugging output")
         parser.add_argument("--dbhost", help="database hostname, defaults to localhost")
         parser.add_argument("--dbport", help="database port, defaults to 27017")
-        parser.add_argument("--parallelization", help="Number of worker threads to employ in a parallel task")
+        parser.add_argument("--parallelization", help="Number of worker processes to employ in a parallel task")
         parser.add_argument("--configuration", help="Path to configuration file")
+        parser.add_argument("--resume", help="resume incomplete simulation runs from their last checkpoint", action="store_true")
 
 
 
@@ -53,3 +55,6 @@ class ScriptArgs:
         if args.configuration:
             self.configuration = args.configuration
 
+        if args.resume:
+            self.resume = True
+
@@ -0,0 +1,43 @@
+# Copyright (c) 2013.  Mark E. Madsen <mark@madsenlab.org>
+#
+# This work is licensed under the Apache Public License 2.0
+#
+"""
+.. module:: sweep_schedule
+    :platform: Unix, Windows
+    :synopsis: Scheduling and seeding of simulation parameter combinations run by a pool of worker processes.
+
+.. moduleauthor:: Mark E. Madsen <mark@madsenlab.org>
+
+When a parameter sweep is run by a process pool, the wall clock time of the sweep is governed by the
+longest runs, so we start those first and let shorter runs fill in the remaining workers.  Each parameter
+combination also gets its own random seed, derived from a base seed and the parameter values, so that a
+combination produces the same simulation no matter which worker runs it, or in what order.
+
+"""
+
+import zlib
+
+
+def order_longest_first(param_combinations, cost_function):
+    """
+    Orders parameter combinations by decreasing estimated cost.
+
+    :param param_combinations: list of tuples of parameter values
+    :param cost_function: function taking the parameter values as arguments, and returning an estimated cost
+    :return: list of parameter combinations, most expensive first
+    """
+    return sorted(param_combinations, key=lambda params: cost_function(*params), reverse=True)
+
+
+def combination_seed(base_seed, param_combination):
+    """
+    Derives a deterministic random seed for a parameter combination.  Seeds are a CRC of the base seed
+    and the parameter values, so they do not depend on Python's hash randomization or the order of the sweep.
+
+    :param base_seed: integer seed for the whole sweep
+    :param param_combination: tuple of parameter values
+    :return: integer seed between 1 and 2^31 - 1
+    """
+    key = repr((int(base_seed),) + tuple(param_combination))
+    return (zlib.crc32(key) & 0x7fffffff) or 1
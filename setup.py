@@ -6,6 +6,7 @@ setup(name="CTPy",
                 'ctpy.math',
                 'ctpy.coarsegraining',
                 'ctpy.data',
+                'ctpy.simulation',
                 'ctpy.innovation_models',
                 'ctpy.strategies',
                 'ctpy.utils'],
@@ -104,6 +104,7 @@ log.debug("experiment name: %s", pars.experiment_name)
 log.debug("NOTE:  This interactive simulation always sends data to MongoDB instance on localhost")
 
 data.set_experiment_name(pars.experiment_name)
+data.set_genotype_encoding(simconfig.GENOTYPE_ENCODING)
 data.set_database_hostname("localhost")
 data.set_database_port("27017")
 config = data.getMingConfiguration()
@@ -148,6 +149,7 @@ simu.evolve(
 		],	
 	gen = totalSimulationLength,
 )
+data.flush_buffered_writer()
 
 log.info("Ending simulation run at generation %s", simu.population(0).dvars().gen)
 
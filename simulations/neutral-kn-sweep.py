@@ -11,10 +11,13 @@ import uuid
 import ctpy.data as data
 import ctpy.utils as utils
 import ctpy.math as cpm
+import ctpy.simulation as simulation
 import ming
 import itertools
 import logging as log
 import argparse
+import multiprocessing
+import os
 
 
 """
@@ -23,92 +26,237 @@ population, and counts the number of alleles present in the population and in sa
 
 This process is performed for each combination of key model parameters, and the results are saved to MongoDB.
 
-"""
+With --parallelization N (N > 1), parameter combinations are run concurrently by a pool of N worker processes,
+each running one simuPOP simulation at a time over its own database connection.  Combinations are started
+in order of decreasing expected cost (population size times the generations to stationarity plus sampling),
+so the longest runs do not start last.  Each combination is seeded from SIMULATION_RANDOM_SEED and its
+parameters, so results do not depend on scheduling.  --parallelization 1 runs the sweep serially.
 
-## setup
+Replicate populations are saved every CHECKPOINT_INTERVAL generations.  With --resume, runs which were started
+but not completed continue from their last checkpoint (or restart, if they had not reached one), after removing
+any samples they stored past that point, and combinations which were never started are run as usual.
 
-sargs = utils.ScriptArgs()
+If BURNIN_CACHE_DIRECTORY is set, replicate populations are burned in to quasi-stationarity once and saved there,
+and later runs with the same population size, innovation rate, loci, initial distribution, and seed (in this or
+later experiments) start sampling from the cached populations immediately.
 
-if sargs.debug:
-    log.basicConfig(level=log.DEBUG, format='%(asctime)s %(levelname)s: %(message)s')
-else:
-    log.basicConfig(level=log.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+If SIMULATION_ENGINE is "numpy", each parameter combination is run by ctpy.simulation.WrightFisherIAEngine, which
+evolves all replicates as a single NumPy array instead of using simuPOP, and stores the same observations.
+Runs with the numpy engine are not checkpointed, and do not use the burn-in cache.
 
-simconfig = utils.CTPyConfiguration(sargs.configuration)
+"""
 
-log.debug("experiment name: %s", sargs.experiment_name)
-data.set_experiment_name(sargs.experiment_name)
-data.set_database_hostname(sargs.database_hostname)
-data.set_database_port(sargs.database_port)
 
-config = data.getMingConfiguration()
-ming.configure(**config)
+def setup():
+    global sargs, simconfig, burnin_cache
+    sargs = utils.ScriptArgs()
 
+    if sargs.debug:
+        log.basicConfig(level=log.DEBUG, format='%(asctime)s %(levelname)s: %(message)s')
+    else:
+        log.basicConfig(level=log.INFO, format='%(asctime)s %(levelname)s: %(message)s')
 
+    simconfig = utils.CTPyConfiguration(sargs.configuration)
 
-# parameters intersected to form sample space
-# mutationrates = [0.0001,0.0002,0.0005,0.00075,0.001,0.002,0.005,0.0075,0.01]
-# samplesizes = [10,20,30,50,75,100,250,500]
-# populationsizes = [500,1000,2000,5000,10000,25000,50000]
+    log.debug("experiment name: %s", sargs.experiment_name)
+    data.set_experiment_name(sargs.experiment_name)
+    data.set_genotype_encoding(simconfig.GENOTYPE_ENCODING)
+    data.set_database_hostname(sargs.database_hostname)
+    data.set_database_port(sargs.database_port)
 
-mutationrates = simconfig.INNOVATION_RATES_STUDIED
-populationsizes = simconfig.POPULATION_SIZES_STUDIED
+    config = data.getMingConfiguration()
+    ming.configure(**config)
+    data.configure_storage_backend(simconfig.STORAGE_BACKEND, simconfig.STORAGE_DIRECTORY)
+    data.configure_buffered_writer(simconfig.WRITE_BUFFER_DOCUMENTS, simconfig.WRITE_BUFFER_SECONDS)
 
+    if simconfig.CHECKPOINT_INTERVAL > 0 and not os.path.exists(simconfig.CHECKPOINT_DIRECTORY):
+        os.makedirs(simconfig.CHECKPOINT_DIRECTORY)
 
-state_space = [
-    mutationrates,
-    populationsizes
-]
+    burnin_cache = None
+    if simconfig.BURNIN_CACHE_DIRECTORY is not None:
+        burnin_cache = data.BurnInCache(simconfig.BURNIN_CACHE_DIRECTORY)
 
 
-# other parameters
-sample_size = max(simconfig.SAMPLE_SIZES_STUDIED)
-replications_per_paramset = simconfig.REPLICATIONS_PER_PARAM_SET
-sampling_interval = simconfig.SAMPLING_INTERVAL
-sim_length = simconfig.SIMULATION_LENGTH_AFTER_STATIONARITY
-numloci = max(simconfig.DIMENSIONS_STUDIED)
-gen_logging_interval = sim_length / 5
-numalleles = simconfig.INITIAL_TRAIT_NUMBER
+def build_schedule():
+    """
+    Constructs the list of parameter combinations to run, each with its random seed, with the most
+    expensive combinations first.
 
+    :return: list of (mutation rate, population size, seed, simulation run id to resume) tuples
+    """
+    # parameters intersected to form sample space
+    # mutationrates = [0.0001,0.0002,0.0005,0.00075,0.001,0.002,0.005,0.0075,0.01]
+    # samplesizes = [10,20,30,50,75,100,250,500]
+    # populationsizes = [500,1000,2000,5000,10000,25000,50000]
+    state_space = [
+        simconfig.INNOVATION_RATES_STUDIED,
+        simconfig.POPULATION_SIZES_STUDIED
+    ]
+    sim_length = simconfig.SIMULATION_LENGTH_AFTER_STATIONARITY
 
+    combinations = utils.order_longest_first(list(itertools.product(*state_space)),
+                                             lambda mut, popsize: cpm.expectedIARunCost(popsize, mut, sim_length))
+    return [(mut, popsize, utils.combination_seed(simconfig.SIMULATION_RANDOM_SEED, (mut, popsize)), None)
+            for (mut, popsize) in combinations]
 
 
-initial_distribution = utils.constructUniformAllelicDistribution(numalleles)
-log.info("Initial allelic distribution: %s", initial_distribution)
+def build_resume_schedule():
+    """
+    Constructs the schedule for resuming an interrupted sweep:  incomplete runs first, continuing from their
+    checkpoints, followed by parameter combinations which were never started.
 
+    :return: list of (mutation rate, population size, seed, simulation run id to resume) tuples
+    """
+    started = set([(r.mutation_rate, r.population_size) for r in data.SimulationCheckpoint.m.find().all()])
+    schedule = [(r.mutation_rate, r.population_size, r.seed, r.simulation_run_id) for r in data.get_incomplete_checkpoints()]
+    log.info("Resuming %s incomplete simulation runs", len(schedule))
+    schedule.extend([work for work in build_schedule() if (work[0], work[1]) not in started])
+    return schedule
 
 
-for param_combination in itertools.product(*state_space):
-    sim_id = uuid.uuid4().urn
-    log.info("Beginning run: %s params: %s", sim_id, param_combination)
-    mut = param_combination[0]
-    popsize = param_combination[1]
+def run_combination(work):
+    """
+    Runs the replicate simulations for a single combination of parameters, storing samples as it goes.
 
-    data.storeSimulationData(
-        popsize,mut,sim_id,sample_size,replications_per_paramset,numloci,__file__,numalleles,simconfig.MAXALLELES)
+    :param work: tuple of (mutation rate, population size, seed, simulation run id to resume or None)
+    :return: tuple of (simulation run id, mutation rate, population size, number of cached burn-in replicates used)
+    """
+    (mut, popsize, seed, resume_sim_id) = work
 
-    time_start_stats = cpm.expectedIAQuasiStationarityTimeHaploid(popsize,mut)
-    log.info("...Starting data collection at generation: %s", time_start_stats)
+    # other parameters
+    sample_size = max(simconfig.SAMPLE_SIZES_STUDIED)
+    replications_per_paramset = simconfig.REPLICATIONS_PER_PARAM_SET
+    sampling_interval = simconfig.SAMPLING_INTERVAL
+    sim_length = simconfig.SIMULATION_LENGTH_AFTER_STATIONARITY
+    numloci = max(simconfig.DIMENSIONS_STUDIED)
+    gen_logging_interval = sim_length / 5
+    checkpoint_interval = simconfig.CHECKPOINT_INTERVAL
+    numalleles = simconfig.INITIAL_TRAIT_NUMBER
+
+    initial_distribution = utils.constructUniformAllelicDistribution(numalleles)
+    log.debug("Initial allelic distribution: %s", initial_distribution)
 
+    time_start_stats = cpm.expectedIAQuasiStationarityTimeHaploid(popsize,mut)
     totalSimulationLength = time_start_stats + sim_length
+
+    num_reused = 0
+    checkpoint = None
+    if resume_sim_id is not None:
+        sim_id = resume_sim_id
+        checkpoint = data.get_checkpoint(sim_id)
+        data.remove_samples_after(sim_id, checkpoint.generation)
+    else:
+        sim_id = uuid.uuid4().urn
+        data.storeSimulationData(
+            popsize,mut,sim_id,sample_size,replications_per_paramset,numloci,__file__,numalleles,simconfig.MAXALLELES)
+        data.storeSimulationCheckpoint(sim_id, mut, popsize, seed, replications_per_paramset)
+
+    if simconfig.SIMULATION_ENGINE == "numpy":
+        # the numpy engine does not checkpoint, so a resumed run starts over, its samples having been removed above
+        log.info("Beginning run: %s params: %s seed: %s with the numpy engine", sim_id, (mut, popsize), seed)
+        engine = simulation.WrightFisherIAEngine(popsize, mut, numloci, replications_per_paramset, initial_distribution, seed)
+        engine.evolve(totalSimulationLength,
+                      [(simulation.observeReplicate, (sample_size, mut, popsize, sim_id, numloci), time_start_stats, sampling_interval)])
+        data.flush_buffered_writer()
+        data.mark_checkpoint_complete(sim_id)
+        log.info("End run %s at generation %s", sim_id, engine.generation)
+        return (sim_id, mut, popsize, num_reused)
+
+    if checkpoint is not None and checkpoint.generation >= 0:
+        # the simuPOP RNG state is not saved with populations, so resumed runs are seeded from the checkpoint generation
+        sim.setRNG(seed=utils.combination_seed(seed, (checkpoint.generation,)))
+        log.info("Resuming run: %s params: %s from generation: %s", sim_id, (mut, popsize), checkpoint.generation)
+        simu = sim.Simulator(data.load_checkpoint_populations(checkpoint), stealPops=True)
+        initOps = []
+        generations = totalSimulationLength - (checkpoint.generation + 1)
+    else:
+        sim.setRNG(seed=seed)
+        log.info("Beginning run: %s params: %s seed: %s", sim_id, (mut, popsize), seed)
+        if simconfig.BURNIN_CACHE_DIRECTORY is not None:
+            (pops, num_reused) = burnin_cache.get_populations(popsize, mut, numloci, initial_distribution, seed,
+                                                              time_start_stats, replications_per_paramset, simconfig.MAXALLELES)
+            sim.setRNG(seed=utils.combination_seed(seed, (time_start_stats,)))
+            simu = sim.Simulator(pops, stealPops=True)
+            initOps = []
+            generations = sim_length
+        else:
+            pop = sim.Population(size=popsize, ploidy=1, loci=numloci)
+            simu = sim.Simulator(pop, rep=replications_per_paramset)
+            initOps = sim.InitGenotype(freq=initial_distribution)
+            generations = totalSimulationLength
+
+    log.info("...Starting data collection at generation: %s", time_start_stats)
     log.info("...Simulation will sample %s generations after stationarity", sim_length)
 
-    pop = sim.Population(size=popsize, ploidy=1, loci=numloci)
-    simu = sim.Simulator(pop, rep=replications_per_paramset)
+    postOps = [sim.KAlleleMutator(k=simconfig.MAXALLELES, rates=mut),
+               sim.PyOperator(func=data.observeGeneration, param=(sample_size, mut, popsize,sim_id,numloci), step=sampling_interval,begin=time_start_stats)]
+    if checkpoint_interval > 0:
+        postOps.append(sim.PyOperator(func=data.checkpointPopulation, param=(sim_id, simconfig.CHECKPOINT_DIRECTORY, replications_per_paramset),
+                                      step=checkpoint_interval, begin=checkpoint_interval))
 
     simu.evolve(
-        initOps = sim.InitGenotype(freq=initial_distribution),
+        initOps = initOps,
         preOps = [
             sim.PyOperator(func=utils.logGenerationCount, param=(), step=gen_logging_interval, reps=0),
         ],
         matingScheme = sim.RandomSelection(),
-        postOps = [sim.KAlleleMutator(k=simconfig.MAXALLELES, rates=mut),
-                    sim.PyOperator(func=data.sampleNumAlleles, param=(sample_size, mut, popsize,sim_id,numloci), step=sampling_interval,begin=time_start_stats),
-                    sim.PyOperator(func=data.sampleTraitCounts, param=(sample_size, mut, popsize,sim_id,numloci), step=sampling_interval,begin=time_start_stats),
-                    sim.PyOperator(func=data.censusTraitCounts, param=(mut, popsize,sim_id,numloci), step=sampling_interval,begin=time_start_stats),
-                    sim.PyOperator(func=data.censusNumAlleles, param=(mut, popsize,sim_id,numloci), step=sampling_interval,begin=time_start_stats),
-                    sim.PyOperator(func=data.sampleIndividuals, param=(sample_size, mut, popsize, sim_id,numloci), step=sampling_interval, begin=time_start_stats),
-               ],
-        gen = totalSimulationLength,
+        postOps = postOps,
+        gen = generations,
     )
-    log.info("End run %s at generation %s", sim_id, simu.population(0).dvars().gen)
\ No newline at end of file
+    data.flush_buffered_writer()
+    data.mark_checkpoint_complete(sim_id)
+    log.info("End run %s at generation %s", sim_id, simu.population(0).dvars().gen)
+    return (sim_id, mut, popsize, num_reused)
+
+
+def run_parallel(schedule, num_processes):
+    """
+    Runs the parameter combinations in a pool of worker processes.  Each worker process runs a single
+    combination and is then replaced, so the memory used by simuPOP populations is released between runs.
+
+    :return: none
+    """
+    log.info("Running %s parameter combinations with %s worker processes", len(schedule), num_processes)
+    results = []
+    pool = multiprocessing.Pool(processes=num_processes, initializer=worker_setup, maxtasksperchild=1,
+                                initargs=(sargs.experiment_name, sargs.database_hostname, sargs.database_port))
+    try:
+        # chunksize 1 keeps the longest-first order of the schedule
+        for result in pool.imap_unordered(run_combination, schedule, 1):
+            log.info("Completed run %s params: %s", result[0], (result[1], result[2]))
+            results.append(result)
+        pool.close()
+    except KeyboardInterrupt:
+        log.info("sweep interrupted by ctrl-c")
+        pool.terminate()
+        exit(1)
+    pool.join()
+    return results
+
+
+def report_burnin_reuse(results):
+    reused = [(mut, popsize, num_reused) for (sim_id, mut, popsize, num_reused) in results if num_reused > 0]
+    for (mut, popsize, num_reused) in reused:
+        log.info("Reused %s cached burn-in replicates for params: %s", num_reused, (mut, popsize))
+    log.info("Reused cached burn-in populations in %s of %s simulation runs", len(reused), len(results))
+
+
+def worker_setup(experiment_name, hostname, port):
+    data.configure_worker_database(experiment_name, hostname, port)
+    data.configure_buffered_writer(simconfig.WRITE_BUFFER_DOCUMENTS, simconfig.WRITE_BUFFER_SECONDS)
+
+
+if __name__ == "__main__":
+    setup()
+    if sargs.resume:
+        schedule = build_resume_schedule()
+    else:
+        schedule = build_schedule()
+
+    num_processes = int(sargs.parallelization)
+    if num_processes > 1:
+        results = run_parallel(schedule, num_processes)
+    else:
+        results = [run_combination(work) for work in schedule]
+
+    report_burnin_reuse(results)
@@ -0,0 +1,28 @@
+# Copyright (c) 2013.  Mark E. Madsen <mark@madsenlab.org>
+#
+# This work is licensed under the terms of the Creative Commons-GNU General Public License 2.0, as "non-commercial/sharealike".  You may use, modify, and distribute this software for non-commercial purposes, and you must distribute any modifications under the same license.
+#
+# For detailed license terms, see:
+# http://creativecommons.org/licenses/GPL/2.0/
+
+"""
+Stand-ins for raw individual sample records, shared by the tests of code which reads raw samples.
+"""
+
+
+class FakeIndividual:
+    def __init__(self, id, genotype):
+        self.id = id
+        self.genotype = genotype
+
+
+class FakeRawSample:
+    def __init__(self, genotypes):
+        self.simulation_time = 1200
+        self.replication = 2
+        self.population_size = 100
+        self.mutation_rate = 0.01
+        self.simulation_run_id = "urn:uuid:test"
+        self.sample_size = len(genotypes)
+        self.dimensionality = len(genotypes[0])
+        self.sample = [FakeIndividual(idx, genotype) for idx, genotype in enumerate(genotypes)]
@@ -0,0 +1,104 @@
+# Copyright (c) 2013.  Mark E. Madsen <mark@madsenlab.org>
+#
+# This work is licensed under the terms of the Creative Commons-GNU General Public License 2.0, as "non-commercial/sharealike".  You may use, modify, and distribute this software for non-commercial purposes, and you must distribute any modifications under the same license.
+#
+# For detailed license terms, see:
+# http://creativecommons.org/licenses/GPL/2.0/
+
+
+import unittest
+import ctpy.data as data
+
+
+class RecordingCollection:
+    """
+    Stands in for a pymongo 2.x collection, recording each bulk insert, bulk write, and single update
+    """
+    def __init__(self):
+        self.inserts = []
+        self.bulk_writes = []
+        self.updates = []
+
+    def insert(self, docs, continue_on_error=False):
+        self.inserts.append((list(docs), continue_on_error))
+
+    def bulk_write(self, requests, ordered=True):
+        self.bulk_writes.append((list(requests), ordered))
+
+    def update(self, spec, document, upsert=False, multi=False):
+        self.updates.append((spec, document, upsert, multi))
+
+
+class FakeManager:
+    def __init__(self):
+        self.collection = RecordingCollection()
+
+    def make(self, fields):
+        return dict(fields)
+
+
+class FakeDocument:
+    m = FakeManager()
+
+
+class OtherFakeDocument:
+    m = FakeManager()
+
+
+class BufferedWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        FakeDocument.m = FakeManager()
+        OtherFakeDocument.m = FakeManager()
+
+    def test_flush_by_size(self):
+        writer = data.BufferedDocumentWriter(max_documents=3, max_seconds=3600)
+        for i in range(0, 7):
+            writer.add(FakeDocument, dict(count=i))
+        inserts = FakeDocument.m.collection.inserts
+        self.assertEqual(2, len(inserts))
+        self.assertEqual([0, 1, 2], [doc["count"] for doc in inserts[0][0]])
+        self.assertTrue(inserts[0][1])
+        self.assertEqual(1, writer.num_pending)
+
+    def test_flush_by_time(self):
+        writer = data.BufferedDocumentWriter(max_documents=1000, max_seconds=0)
+        writer.add(FakeDocument, dict(count=1))
+        self.assertEqual(1, len(FakeDocument.m.collection.inserts))
+
+    def test_buffers_per_collection(self):
+        writer = data.BufferedDocumentWriter(max_documents=1000, max_seconds=3600)
+        writer.add(FakeDocument, dict(count=1))
+        writer.add(OtherFakeDocument, dict(count=2))
+        writer.add(FakeDocument, dict(count=3))
+        self.assertEqual(0, len(FakeDocument.m.collection.inserts))
+        self.assertEqual(3, writer.flush())
+        self.assertEqual([1, 3], [doc["count"] for doc in FakeDocument.m.collection.inserts[0][0]])
+        self.assertEqual([2], [doc["count"] for doc in OtherFakeDocument.m.collection.inserts[0][0]])
+        self.assertEqual(0, writer.flush())
+
+    def test_buffered_updates(self):
+        writer = data.BufferedDocumentWriter(max_documents=1000, max_seconds=3600)
+        writer.update(FakeDocument, dict(simulation_run_id="a", replication=0), dict(mean_neutrality_slatkin=0.5))
+        writer.add(FakeDocument, dict(count=1))
+        writer.update(FakeDocument, dict(simulation_run_id="a", replication=1), dict(mean_neutrality_slatkin=0.25))
+        self.assertEqual(0, len(FakeDocument.m.collection.bulk_writes))
+        self.assertEqual(3, writer.flush())
+        self.assertEqual(1, len(FakeDocument.m.collection.inserts))
+        (requests, ordered) = FakeDocument.m.collection.bulk_writes[0]
+        self.assertFalse(ordered)
+        self.assertEqual([dict(simulation_run_id="a", replication=1)], [r._filter for r in requests][1:])
+        self.assertEqual({'$set': dict(mean_neutrality_slatkin=0.5)}, requests[0]._doc)
+        self.assertFalse(requests[0]._upsert)
+
+    def test_updates_without_server_operations(self):
+        backend = data.MongoStorageBackend(server_operations=False)
+        self.assertFalse(backend.supports_aggregation)
+        backend.update_many(FakeDocument, [(dict(simulation_run_id="a"), dict(mean_neutrality_slatkin=0.5))])
+        self.assertEqual(0, len(FakeDocument.m.collection.bulk_writes))
+        self.assertEqual([(dict(simulation_run_id="a"), {'$set': dict(mean_neutrality_slatkin=0.5)}, False, False)],
+                         FakeDocument.m.collection.updates)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+# Copyright (c) 2013.  Mark E. Madsen <mark@madsenlab.org>
+#
+# This work is licensed under the terms of the Creative Commons-GNU General Public License 2.0, as "non-commercial/sharealike".  You may use, modify, and distribute this software for non-commercial purposes, and you must distribute any modifications under the same license.
+#
+# For detailed license terms, see:
+# http://creativecommons.org/licenses/GPL/2.0/
+
+
+import unittest
+import shutil
+import tempfile
+import ctpy.data.burnin_cache as bc
+
+
+class FakePopulation:
+    def __init__(self, label):
+        self.label = label
+
+    def save(self, filename):
+        with open(filename, "w") as f:
+            f.write(self.label)
+
+
+def fake_load_population(filename):
+    with open(filename) as f:
+        return FakePopulation(f.read())
+
+
+class BurnInCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(dir="/tmp")
+        self.burn_ins = []
+        self.saved_burn_in = bc.burn_in
+        self.saved_sim = dict((name, getattr(bc.sim, name, None)) for name in ["loadPopulation", "setRNG"])
+
+        def fake_burn_in(popsize, mutation, numloci, initial_distribution, generations, replicates, maxalleles):
+            self.burn_ins.append(replicates)
+            return [FakePopulation("%s-%s" % (len(self.burn_ins), rep)) for rep in range(0, replicates)]
+
+        bc.burn_in = fake_burn_in
+        bc.sim.loadPopulation = fake_load_population
+        bc.sim.setRNG = lambda seed: None
+
+    def tearDown(self):
+        bc.burn_in = self.saved_burn_in
+        for name, value in self.saved_sim.items():
+            setattr(bc.sim, name, value)
+        shutil.rmtree(self.directory)
+
+    def _get(self, cache, replicates, seed=1):
+        return cache.get_populations(500, 0.01, 4, [0.5, 0.5], seed, 5000, replicates, 1000)
+
+    def test_reuse_and_extension(self):
+        (pops, reused) = self._get(bc.BurnInCache(self.directory), 2)
+        self.assertEqual(0, reused)
+        self.assertEqual([2], self.burn_ins)
+
+        # a later experiment reuses the cached replicates, and burns in only the extra one
+        (pops, reused) = self._get(bc.BurnInCache(self.directory), 3)
+        self.assertEqual(2, reused)
+        self.assertEqual([2, 1], self.burn_ins)
+        self.assertEqual(["1-0", "1-1", "2-0"], [pop.label for pop in pops])
+
+    def test_seed_is_part_of_key(self):
+        cache = bc.BurnInCache(self.directory)
+        self._get(cache, 2, seed=1)
+        (pops, reused) = self._get(cache, 2, seed=2)
+        self.assertEqual(0, reused)
+        self.assertNotEqual(bc.burnin_key(500, 0.01, 4, [0.5, 0.5], 1, 5000),
+                            bc.burnin_key(500, 0.01, 4, [0.5, 0.5], 2, 5000))
+
+
+if __name__ == "__main__":
+    unittest.main()
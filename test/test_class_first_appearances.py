@@ -0,0 +1,63 @@
+# Copyright (c) 2013.  Mark E. Madsen <mark@madsenlab.org>
+#
+# This work is licensed under the terms of the Creative Commons-GNU General Public License 2.0, as "non-commercial/sharealike".  You may use, modify, and distribute this software for non-commercial purposes, and you must distribute any modifications under the same license.
+#
+# For detailed license terms, see:
+# http://creativecommons.org/licenses/GPL/2.0/
+
+
+import unittest
+import shutil
+import tempfile
+from bson.objectid import ObjectId
+import ctpy.data as data
+
+
+class ClassFirstAppearancesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        data.configure_storage_backend("sqlite", self.directory)
+        self.classifications = [ObjectId(), ObjectId()]
+
+    def tearDown(self):
+        data.set_genotype_encoding("list")
+        data.configure_storage_backend("mongodb")
+        shutil.rmtree(self.directory)
+
+    def store(self, generation, classification, replication, class_ids, sim_id="run1"):
+        # class identifiers are given as strings, and stored as codes with 4 modes in each of 2 dimensions
+        class_codes = [int(first) * 4 + int(second) for (first, second) in [c.split("-") for c in class_ids]]
+        data.storeIndividualSampleClassified(generation, classification, "EVEN", 2, 0.5, replication, len(class_ids),
+                                             100, 0.01, sim_id, class_codes, [4, 4])
+
+    def check_first_appearances(self):
+        (first, second) = self.classifications
+        self.store(300, first, 0, ["1-1", "2-1"])
+        self.store(100, first, 0, ["1-1", "1-1"])
+        self.store(200, first, 0, ["2-2"])
+        self.store(100, first, 1, ["2-1"])
+        self.store(100, second, 0, ["1-1"])
+        self.store(50, first, 0, ["1-2"], sim_id="run2")
+
+        groups = data.class_first_appearances("run1", self.classifications)
+        self.assertEqual([(0, first), (0, second), (1, first)] if str(first) < str(second) else
+                         [(0, second), (0, first), (1, first)],
+                         [(g["replication"], g["classification_id"]) for g in groups])
+        group = [g for g in groups if g["replication"] == 0 and g["classification_id"] == first][0]
+        self.assertEqual([dict(classid="1-1", time=100), dict(classid="2-1", time=300), dict(classid="2-2", time=200)],
+                         group["class_time_first_appearance"])
+        self.assertEqual((2, 0.5, 100), (group["classification_dim"], group["classification_coarseness"], group["population_size"]))
+
+        self.assertEqual(1, len(data.class_first_appearances("run1", [second])))
+
+    def test_list_encoding(self):
+        self.check_first_appearances()
+
+    def test_binary_encoding(self):
+        data.set_genotype_encoding("binary")
+        self.check_first_appearances()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+# Copyright (c) 2013.  Mark E. Madsen <mark@madsenlab.org>
+#
+# This work is licensed under the terms of the Creative Commons-GNU General Public License 2.0, as "non-commercial/sharealike".  You may use, modify, and distribute this software for non-commercial purposes, and you must distribute any modifications under the same license.
+#
+# For detailed license terms, see:
+# http://creativecommons.org/licenses/GPL/2.0/
+
+
+import unittest
+import random
+import numpy as np
+import ctpy.coarsegraining as cg
+import ctpy.utils as utils
+
+
+class ClassIdentificationEngineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.config = utils.CTPyConfiguration(None)
+        random.seed(42)
+        self.dimensions = {
+            'even4': cg.dmb.build_even_dimension(self.config, 4),
+            'random3': cg.dmb.build_random_dimension(self.config, 3),
+            'random8': cg.dmb.build_random_dimension(self.config, 8),
+        }
+        # prime the compiled mode cache so the engine does not need the database
+        for mode_id, boundaries in self.dimensions.items():
+            cg.ClassIdentificationEngine.compiled_mode_cache[mode_id] = cg.compile_mode_boundaries(boundaries)
+
+        self.classification = dict(_id="test", dimensions=3, modes_for_dimensions=['even4', 'random3', 'random8'])
+        self.engine = cg.ClassIdentificationEngine(self.classification)
+
+        rng = np.random.RandomState(1234)
+        self.genotypes = rng.randint(0, self.config.MAXALLELES, size=(200, 4))
+
+    def _identify_by_scanning(self, genotype):
+        # reference implementation:  linear scan over the mode boundaries for each locus
+        identified_modes = []
+        for dim_num, mode_id in enumerate(self.classification["modes_for_dimensions"]):
+            for mode_num, mode_defn in enumerate(self.dimensions[mode_id]):
+                if mode_defn["lower"] <= genotype[dim_num] < mode_defn["upper"]:
+                    identified_modes.append(mode_num)
+                    break
+        return '-'.join([str(num) for num in identified_modes])
+
+    def test_matches_linear_scan(self):
+        codes = self.engine.identify(self.genotypes)
+        observed = self.engine.class_codes_to_strings(codes)
+        expected = [self._identify_by_scanning(g) for g in self.genotypes]
+        self.assertEqual(expected, observed)
+
+    def test_batch_of_samples(self):
+        batch = self.genotypes.reshape(4, 50, 4)
+        codes = self.engine.identify(batch)
+        self.assertEqual((4, 50), codes.shape)
+        self.assertTrue(np.array_equal(codes.reshape(200), self.engine.identify(self.genotypes)))
+
+    def test_code_range(self):
+        self.assertEqual(4 * 3 * 8, self.engine.num_classes)
+        codes = self.engine.identify(self.genotypes)
+        self.assertTrue(codes.min() >= 0)
+        self.assertTrue(codes.max() < self.engine.num_classes)
+
+    def test_mode_boundaries(self):
+        even = self.dimensions['even4']
+        genotypes = np.array([[0, 0, 0],
+                              [int(even[1]["lower"]), 0, 0],
+                              [int(even[1]["lower"]) - 1, 0, 0]])
+        modes = self.engine.identify_modes(genotypes)
+        self.assertEqual([0, 1, 0], modes[:, 0].tolist())
+
+    def test_alleles_outside_modes(self):
+        even = self.dimensions['even4']
+        for allele in [int(even[0]["lower"]) - 1, int(even[-1]["upper"])]:
+            genotypes = np.array([[allele, 0, 0]])
+            self.assertRaises(ValueError, self.engine.identify, genotypes)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+# Copyright (c) 2013.  Mark E. Madsen <mark@madsenlab.org>
+#
+# This work is licensed under the terms of the Creative Commons-GNU General Public License 2.0, as "non-commercial/sharealike".  You may use, modify, and distribute this software for non-commercial purposes, and you must distribute any modifications under the same license.
+#
+# For detailed license terms, see:
+# http://creativecommons.org/licenses/GPL/2.0/
+
+
+import unittest
+import math
+from collections import Counter
+import numpy as np
+from ctpy.math import ewens_slatkin as es
+
+
+def _partitions(n, k, maxval=None):
+    if maxval is None:
+        maxval = n
+    if k == 0:
+        if n == 0:
+            yield ()
+        return
+    for v in range(min(n, maxval), 0, -1):
+        for rest in _partitions(n - v, k - 1, v):
+            yield (v,) + rest
+
+
+def _exact_ewens_distribution(n, k):
+    # probability of each configuration given n and k, by enumeration of the partitions of n into k parts
+    weights = {}
+    for p in _partitions(n, k):
+        b = Counter(p)
+        weights[tuple(sorted(p))] = 1.0 / (np.prod(p) * np.prod([math.factorial(c) for c in b.values()]))
+    total = sum(weights.values())
+    return dict((key, w / total) for key, w in weights.items())
+
+
+class EwensSlatkinTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = np.random.RandomState(2013)
+
+    def test_stirling_numbers(self):
+        table = np.exp(es.log_stirling_first_kind(5, 5))
+        self.assertEqual([0, 24, 50, 35, 10, 1], [int(round(x)) for x in table[5]])
+
+    def test_configurations_sum_to_n(self):
+        configs = es.ewens_configurations(50, 7, 1000, self.rng)
+        self.assertEqual((1000, 7), configs.shape)
+        self.assertTrue(np.all(configs.sum(axis=1) == 50))
+        self.assertTrue(np.all(configs >= 1))
+
+    def test_configuration_distribution(self):
+        expected = _exact_ewens_distribution(8, 3)
+        configs = es.ewens_configurations(8, 3, 100000, self.rng)
+        observed = Counter(tuple(sorted(row)) for row in configs.tolist())
+        for key, prob in expected.items():
+            self.assertAlmostEqual(prob, observed[key] / 100000.0, delta=0.01)
+
+    def test_exact_probability(self):
+        dist = _exact_ewens_distribution(8, 3)
+        for obs in ([6, 1, 1], [3, 3, 2], [4, 2, 2]):
+            p_obs = dist[tuple(sorted(obs))]
+            expected = sum(p for p in dist.values() if p <= p_obs + 1e-12)
+            (prob, theta) = es.montecarlo(100000, obs, 3, self.rng)
+            self.assertAlmostEqual(expected, prob, delta=0.01)
+
+    def test_batch_preserves_order(self):
+        results = es.montecarlo_batch(1000, [[20], [6, 1, 1], [1, 1, 1]], self.rng)
+        self.assertEqual(3, len(results))
+        self.assertEqual(1.0, results[0][0])
+        self.assertEqual(1.0, results[2][0])
+        self.assertTrue(0.0 < results[1][0] <= 1.0)
+
+    def test_adaptive_stops_early_for_clear_results(self):
+        samples = [[91] + [1] * 9, [10] * 10, [2, 2, 1]]
+        results = es.montecarlo_adaptive_batch(10000, samples, 0.05, random_state=self.rng)
+        fixed = es.montecarlo_batch(10000, samples, self.rng)
+        for (adaptive_result, fixed_result) in zip(results, fixed):
+            self.assertTrue(adaptive_result[2] < 1000)
+            self.assertEqual(adaptive_result[0] < 0.05, fixed_result[0] < 0.05)
+            self.assertEqual(fixed_result[1], adaptive_result[1])
+
+    def test_adaptive_respects_maximum(self):
+        # a sample whose probability is close to the significance level cannot be resolved early
+        counts = [30, 20, 15, 10, 8, 6, 4, 3, 2, 2]
+        (prob, theta) = es.montecarlo(20000, counts, len(counts), self.rng)
+        results = es.montecarlo_adaptive_batch(3000, [counts], prob, block_size=250, random_state=self.rng)
+        self.assertEqual(3000, results[0][2])
+
+    def test_theta_estimate(self):
+        theta = es.theta_estimate(100, 10)
+        expected_k = sum(theta / (theta + i) for i in range(0, 100))
+        self.assertAlmostEqual(10.0, expected_k, places=6)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -25,5 +25,45 @@ class MathTest(unittest.TestCase):
         print "observed stationary time: %s" % obs
         self.assertEqual(expected,obs)
 
+
+class DiversityBatchTest(unittest.TestCase):
+
+    def test_scalar_measures(self):
+        freq = [0.5, 0.25, 0.25]
+        self.assertAlmostEqual(-sum(p * math.log(p) for p in freq), cpm.diversity_shannon_entropy(freq))
+        self.assertAlmostEqual(1.5 * (1.0 - 0.375), cpm.diversity_iqv(freq))
+        self.assertEqual(0.0, cpm.diversity_shannon_entropy([1.0]))
+        self.assertEqual(0.0, cpm.diversity_iqv([1.0]))
+
+    def test_batch_matches_scalar(self):
+        count_vectors = [[2, 1, 1], [4], [], [3, 3, 1, 7]]
+        counts = [c for vector in count_vectors for c in vector]
+        offsets = [0, 3, 4, 4, 8]
+        (entropy, iqv, richness) = cpm.diversity_statistics_batch(counts, offsets)
+        self.assertEqual([3, 1, 0, 4], richness.tolist())
+        for (i, vector) in enumerate(count_vectors):
+            freq = [float(c) / sum(vector) for c in vector]
+            self.assertAlmostEqual(cpm.diversity_shannon_entropy(freq), entropy[i])
+            self.assertAlmostEqual(cpm.diversity_iqv(freq), iqv[i])
+
+    def test_trait_counts_by_locus(self):
+        genotypes = [[7, 100000, 3], [2, 100000, 3], [7, 5, 3], [7, 100000, 3], [2, 6, 3]]
+        (counts, offsets) = cpm.trait_counts_by_locus(genotypes)
+        self.assertEqual([0, 2, 5, 6], offsets.tolist())
+        # counts for each locus are in allele order
+        self.assertEqual([2, 3, 1, 1, 3, 5], counts.tolist())
+
+    def test_prefix_trait_counts_by_locus(self):
+        genotypes = [[7, 100000, 3], [2, 100000, 3], [7, 5, 3], [7, 100000, 3], [2, 6, 3]]
+        sizes = [1, 3, 5]
+        (counts, offsets) = cpm.prefix_trait_counts_by_locus(genotypes, sizes)
+        self.assertEqual(len(sizes) * 3 + 1, len(offsets))
+        for (idx, ssize) in enumerate(sizes):
+            (expected_counts, expected_offsets) = cpm.trait_counts_by_locus(genotypes[:ssize])
+            start = idx * 3
+            self.assertEqual(expected_counts.tolist(), counts[offsets[start]:offsets[start + 3]].tolist())
+            self.assertEqual((expected_offsets + offsets[start]).tolist(), offsets[start:start + 4].tolist())
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,61 @@
+# Copyright (c) 2013.  Mark E. Madsen <mark@madsenlab.org>
+#
+# This work is licensed under the terms of the Creative Commons-GNU General Public License 2.0, as "non-commercial/sharealike".  You may use, modify, and distribute this software for non-commercial purposes, and you must distribute any modifications under the same license.
+#
+# For detailed license terms, see:
+# http://creativecommons.org/licenses/GPL/2.0/
+
+
+import unittest
+import numpy as np
+import ctpy.data as data
+import ctpy.data.buffered_writer as bw
+import ctpy.data.richness_sample as richness_sample
+import ctpy.data.trait_count_sample as trait_count_sample
+import ctpy.data.trait_count_population as trait_count_population
+import ctpy.data.individual_sample as individual_sample
+
+
+class ObservationTest(unittest.TestCase):
+
+    def setUp(self):
+        # documents are buffered, but never flushed to a database in these tests
+        self.saved_writer = bw._shared_writer
+        bw._shared_writer = data.BufferedDocumentWriter(max_documents=100000, max_seconds=3600)
+        self.genotypes = np.array([[1, 5, 7],
+                                   [1, 6, 7],
+                                   [2, 5, 7],
+                                   [1, 5, 7]])
+
+    def tearDown(self):
+        bw._shared_writer = self.saved_writer
+
+    def test_sample_trait_counts(self):
+        counts = data.sample_trait_counts(self.genotypes)
+        self.assertEqual([1, 2], counts[0][0].tolist())
+        self.assertEqual([3, 1], counts[0][1].tolist())
+        self.assertEqual([7], counts[2][0].tolist())
+        self.assertEqual([4], counts[2][1].tolist())
+
+    def test_store_generation_observation(self):
+        census = [{1: 60, 2: 40}, {5: 70, 6: 20, 8: 10}, {7: 100}]
+        data.store_generation_observation(0, 500, 0.01, 100, "sim", census, self.genotypes)
+        buffers = bw._shared_writer.buffers
+
+        richness = sorted((doc["locus"], doc["richness"]) for doc in buffers[richness_sample.RichnessSample]
+                          if doc.get("sample_size") is not None)
+        self.assertEqual([(0, 2), (1, 2), (2, 1)], richness)
+
+        sample_counts = sorted((doc["locus"], doc["allele"], doc["count"]) for doc in buffers[trait_count_sample.TraitCountSample])
+        self.assertEqual([(0, 1, 3), (0, 2, 1), (1, 5, 3), (1, 6, 1), (2, 7, 4)], sample_counts)
+
+        census_counts = buffers[trait_count_population.TraitCountSample]
+        self.assertEqual(6, len(census_counts))
+
+        individuals = buffers[individual_sample.IndividualSample]
+        self.assertEqual(1, len(individuals))
+        self.assertEqual([1, 6, 7], individuals[0]["sample"][1]["genotype"])
+
+
+if __name__ == "__main__":
+    unittest.main()
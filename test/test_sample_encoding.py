@@ -0,0 +1,74 @@
+# Copyright (c) 2013.  Mark E. Madsen <mark@madsenlab.org>
+#
+# This work is licensed under the terms of the Creative Commons-GNU General Public License 2.0, as "non-commercial/sharealike".  You may use, modify, and distribute this software for non-commercial purposes, and you must distribute any modifications under the same license.
+#
+# For detailed license terms, see:
+# http://creativecommons.org/licenses/GPL/2.0/
+
+
+import unittest
+import numpy as np
+import ctpy.data as data
+import ctpy.data.sample_encoding as se
+
+
+class PackedRecord:
+    def __init__(self, fields):
+        for key, value in fields.items():
+            setattr(self, key, value)
+
+
+class GenotypeEncodingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.saved_encoding = data.genotype_encoding
+        self.genotypes = np.array([[1, 999999999, 7],
+                                   [2, 5, 0]], dtype=np.int64)
+
+    def tearDown(self):
+        data.set_genotype_encoding(self.saved_encoding)
+
+    def test_pack_roundtrip_uint32(self):
+        packed = data.pack_array(self.genotypes)
+        self.assertEqual("<u4", packed["dtype"])
+        self.assertEqual([2, 3], packed["shape"])
+        self.assertEqual(24, len(packed["data"]))
+        self.assertEqual(self.genotypes.tolist(), data.unpack_array(packed).tolist())
+
+    def test_pack_roundtrip_int64(self):
+        genotypes = np.array([[-1, 2 ** 40]], dtype=np.int64)
+        packed = data.pack_array(genotypes)
+        self.assertEqual("<i8", packed["dtype"])
+        self.assertEqual(genotypes.tolist(), data.unpack_array(packed).tolist())
+
+    def test_binary_sample_record(self):
+        data.set_genotype_encoding("binary")
+        record = PackedRecord(se.encode_individuals(self.genotypes))
+        self.assertFalse(hasattr(record, "sample"))
+        self.assertEqual(self.genotypes.tolist(), data.get_genotype_matrix(record).tolist())
+        self.assertEqual([0, 1], data.get_individual_ids(record))
+
+    def test_list_sample_record(self):
+        data.set_genotype_encoding("list")
+        fields = se.encode_individuals(self.genotypes)
+        self.assertEqual([dict(id=1, genotype=[2, 5, 0])], fields["sample"][1:])
+
+    def test_binary_class_assignments(self):
+        data.set_genotype_encoding("binary")
+        record = PackedRecord(se.encode_classified_individuals([1, 4, 1], [3, 3]))
+        self.assertEqual("<u4", record.packed_class_codes["dtype"])
+        self.assertEqual([1, 4, 1], data.get_class_codes(record).tolist())
+        self.assertEqual(["0-1", "1-1", "0-1"], data.decode_class_codes(data.get_class_codes(record), record.class_radix))
+
+    def test_list_class_assignments(self):
+        data.set_genotype_encoding("list")
+        record = PackedRecord(se.encode_classified_individuals(np.array([23, 0]), [2, 3, 4]))
+        self.assertEqual(dict(class_codes=[23, 0], class_radix=[2, 3, 4]), vars(record))
+        self.assertEqual(["1-2-3", "0-0-0"], data.decode_class_codes(data.get_class_codes(record), record.class_radix))
+
+    def test_unknown_encoding(self):
+        self.assertRaises(ValueError, data.set_genotype_encoding, "bson")
+
+
+if __name__ == "__main__":
+    unittest.main()
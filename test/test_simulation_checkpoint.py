@@ -0,0 +1,95 @@
+# Copyright (c) 2013.  Mark E. Madsen <mark@madsenlab.org>
+#
+# This work is licensed under the terms of the Creative Commons-GNU General Public License 2.0, as "non-commercial/sharealike".  You may use, modify, and distribute this software for non-commercial purposes, and you must distribute any modifications under the same license.
+#
+# For detailed license terms, see:
+# http://creativecommons.org/licenses/GPL/2.0/
+
+
+import unittest
+import os
+import shutil
+import tempfile
+import ctpy.data as data
+import ctpy.data.simulation_checkpoint as checkpoint
+
+
+class FakeVars:
+    def __init__(self, rep, gen):
+        self.rep = rep
+        self.gen = gen
+
+
+class FakePopulation:
+    def __init__(self, rep, gen):
+        self.vars = FakeVars(rep, gen)
+
+    def dvars(self):
+        return self.vars
+
+    def save(self, filename):
+        with open(filename, "w") as f:
+            f.write("%s" % self.vars.rep)
+
+
+def fake_load_population(filename):
+    with open(filename) as f:
+        return FakePopulation(int(f.read()), None)
+
+
+class SimulationCheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(dir="/tmp")
+        data.configure_storage_backend("sqlite", self.directory)
+        self.saved_load_population = getattr(checkpoint.sim, "loadPopulation", None)
+        checkpoint.sim.loadPopulation = fake_load_population
+
+    def tearDown(self):
+        checkpoint.sim.loadPopulation = self.saved_load_population
+        data.configure_storage_backend("mongodb")
+        shutil.rmtree(self.directory)
+
+    def test_checkpoint_filenames(self):
+        sim_id = "urn:uuid:07f75571-6f6b-4113-84c5-46cb8114cb72"
+        filename = checkpoint.checkpoint_filename("/tmp/checkpoints", sim_id, 5000, 3)
+        self.assertEqual("/tmp/checkpoints/07f75571-6f6b-4113-84c5-46cb8114cb72-gen5000-rep3.pop", filename)
+        self.assertNotEqual(filename, checkpoint.checkpoint_filename("/tmp/checkpoints", sim_id, 10000, 3))
+        self.assertNotEqual(filename, checkpoint.checkpoint_filename("/tmp/checkpoints", sim_id, 5000, 4))
+
+    def test_resume_from_last_checkpoint(self):
+        checkpoint.storeSimulationCheckpoint("urn:uuid:run1", 0.01, 100, 42, 2)
+        checkpoint.storeSimulationCheckpoint("urn:uuid:run2", 0.01, 100, 43, 2)
+        for gen in [100, 200]:
+            for rep in range(0, 2):
+                checkpoint.checkpointPopulation(FakePopulation(rep, gen), ("urn:uuid:run1", self.directory, 2))
+        checkpoint.mark_checkpoint_complete("urn:uuid:run2")
+
+        incomplete = checkpoint.get_incomplete_checkpoints()
+        self.assertEqual(["urn:uuid:run1"], [record.simulation_run_id for record in incomplete])
+        record = incomplete[0]
+        self.assertEqual(200, record.generation)
+        # files from earlier checkpoints are removed once a later checkpoint is complete
+        self.assertEqual(sorted(record.filenames), sorted([os.path.join(self.directory, f) for f in os.listdir(self.directory)
+                                                           if f.endswith(".pop")]))
+
+        pops = checkpoint.load_checkpoint_populations(record)
+        self.assertEqual([(0, 201), (1, 201)], [(pop.dvars().rep, pop.dvars().gen) for pop in pops])
+
+    def test_remove_samples_after(self):
+        for sim_id in ["run1", "run2"]:
+            for gen in [100, 200, 300]:
+                data.individual_sample._storeIndividualSample(0, 2, 2, gen, 0.01, 100, sim_id, [[1, 2], [3, 4]])
+        data.flush_buffered_writer()
+
+        checkpoint.remove_samples_after("run1", 200)
+        remaining = sorted((r.simulation_run_id, r.simulation_time) for r in data.find_documents(data.IndividualSample))
+        self.assertEqual([("run1", 100), ("run1", 200), ("run2", 100), ("run2", 200), ("run2", 300)], remaining)
+
+        checkpoint.remove_samples_after("run2", -1)
+        remaining = sorted((r.simulation_run_id, r.simulation_time) for r in data.find_documents(data.IndividualSample))
+        self.assertEqual([("run1", 100), ("run1", 200)], remaining)
+
+
+if __name__ == "__main__":
+    unittest.main()
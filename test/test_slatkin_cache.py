@@ -0,0 +1,98 @@
+# Copyright (c) 2013.  Mark E. Madsen <mark@madsenlab.org>
+#
+# This work is licensed under the terms of the Creative Commons-GNU General Public License 2.0, as "non-commercial/sharealike".  You may use, modify, and distribute this software for non-commercial purposes, and you must distribute any modifications under the same license.
+#
+# For detailed license terms, see:
+# http://creativecommons.org/licenses/GPL/2.0/
+
+
+import unittest
+import os
+import tempfile
+import ctpy.math as cpm
+
+
+class CountingCache(cpm.SlatkinExactTestCache):
+    """
+    Replaces the Monte Carlo calculation with a deterministic function of the counts, and counts the calls
+    """
+    calls = 0
+
+    def _calculate(self, replicates, sorted_counts):
+        self.calls += 1
+        return (float(sorted_counts[0]) / float(sum(sorted_counts)), float(len(sorted_counts)))
+
+
+class SlatkinCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tf = tempfile.NamedTemporaryFile(dir="/tmp", suffix=".sqlite", delete=False)
+        self.tf.close()
+        os.remove(self.tf.name)
+
+    def tearDown(self):
+        if os.path.exists(self.tf.name):
+            os.remove(self.tf.name)
+
+    def test_order_of_counts_is_ignored(self):
+        cache = CountingCache(maxsize=10)
+        first = cache.montecarlo(1000, [5, 1, 3])
+        second = cache.montecarlo(1000, [3, 5, 1])
+        self.assertEqual(first, second)
+        self.assertEqual(1, cache.calls)
+        self.assertEqual(1, cache.hits)
+
+    def test_replicates_are_part_of_key(self):
+        cache = CountingCache(maxsize=10)
+        cache.montecarlo(1000, [5, 1, 3])
+        cache.montecarlo(2000, [5, 1, 3])
+        self.assertEqual(2, cache.calls)
+
+    def test_lru_eviction(self):
+        cache = CountingCache(maxsize=2)
+        cache.montecarlo(1000, [1, 1])
+        cache.montecarlo(1000, [2, 1])
+        cache.montecarlo(1000, [1, 1])
+        cache.montecarlo(1000, [3, 1])
+        self.assertEqual(2, len(cache.lru))
+        self.assertTrue((1000, 0.0, 0.0, 0, (1, 1)) in cache.lru)
+        self.assertFalse((1000, 0.0, 0.0, 0, (1, 2)) in cache.lru)
+
+    def test_persistent_tier_is_shared(self):
+        writer = CountingCache(maxsize=10, filename=self.tf.name)
+        expected = writer.montecarlo(1000, [4, 2, 2])
+
+        reader = CountingCache(maxsize=10, filename=self.tf.name)
+        observed = reader.montecarlo(1000, [2, 4, 2])
+        self.assertEqual(expected, observed)
+        self.assertEqual(0, reader.calls)
+
+    def test_replicates_used_are_recorded(self):
+        cache = CountingCache(maxsize=10)
+        (prob, theta, replicates) = cache.montecarlo(1000, [5, 1, 3])
+        self.assertEqual(1000, replicates)
+
+    def test_adaptive_requires_numpy(self):
+        self.assertRaises(ValueError, cpm.SlatkinExactTestCache, 10, None, "extension", 0.05)
+
+    def test_significance_is_part_of_key(self):
+        fixed = cpm.SlatkinExactTestCache(maxsize=10, implementation="numpy")
+        adaptive = cpm.SlatkinExactTestCache(maxsize=10, implementation="numpy", significance=0.05)
+        fixed.montecarlo(1000, [5, 1, 3])
+        adaptive.montecarlo(1000, [5, 1, 3])
+        self.assertTrue((1000, 0.0, 0.0, 0, (1, 3, 5)) in fixed.lru)
+        self.assertTrue((1000, 0.05, 0.99, 200, (1, 3, 5)) in adaptive.lru)
+
+    def test_stopping_parameters_are_part_of_persistent_key(self):
+        first = cpm.SlatkinExactTestCache(maxsize=10, filename=self.tf.name, implementation="numpy", significance=0.05)
+        first.montecarlo(1000, [5, 1, 3])
+        for (confidence, block_size) in [(0.95, 200), (0.99, 100)]:
+            other = cpm.SlatkinExactTestCache(maxsize=10, filename=self.tf.name, implementation="numpy",
+                                              significance=0.05, confidence=confidence, block_size=block_size)
+            other.montecarlo(1000, [5, 1, 3])
+            self.assertEqual(0, other.hits)
+            self.assertEqual(1, other.misses)
+
+
+if __name__ == "__main__":
+    unittest.main()
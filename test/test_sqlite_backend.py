@@ -0,0 +1,91 @@
+# Copyright (c) 2013.  Mark E. Madsen <mark@madsenlab.org>
+#
+# This work is licensed under the terms of the Creative Commons-GNU General Public License 2.0, as "non-commercial/sharealike".  You may use, modify, and distribute this software for non-commercial purposes, and you must distribute any modifications under the same license.
+#
+# For detailed license terms, see:
+# http://creativecommons.org/licenses/GPL/2.0/
+
+
+import unittest
+import os
+import shutil
+import tempfile
+import ctpy.data as data
+
+
+def store_stats(generation, replication):
+    data.storePerGenerationStatsTraits(generation, replication, 20, 100, 0.01, 2, "run1", 2.0, 0.5, 0.4,
+                                       [2, 2], [0.5, 0.5], [0.4, 0.4], None, None)
+
+
+class SQLiteBackendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.backend = data.configure_storage_backend("sqlite", self.directory)
+
+    def tearDown(self):
+        data.configure_storage_backend("mongodb")
+        shutil.rmtree(self.directory)
+
+    def test_store_and_find_through_ming(self):
+        for generation in [300, 100, 200]:
+            store_stats(generation, 0)
+        store_stats(100, 1)
+        self.assertTrue(os.path.exists(os.path.join(self.directory, "ctpy.sqlite")))
+
+        cursor = data.PerGenerationStatsTraits.m.find(dict(replication=0)).sort("simulation_time", 1)
+        self.assertEqual([100, 200, 300], [record.simulation_time for record in cursor])
+        self.assertEqual(4, data.PerGenerationStatsTraits.m.find().count())
+        self.assertEqual([2, 2], data.PerGenerationStatsTraits.m.find(dict(replication=1)).one().loci_trait_richness)
+
+    def test_update_field(self):
+        store_stats(100, 0)
+        record = data.PerGenerationStatsTraits.m.find(dict(simulation_time=100)).one()
+        data.updateFieldPerGenerationStatsTraits(record._id, "mean_neutrality_slatkin", 0.25)
+        self.assertEqual(0.25, data.PerGenerationStatsTraits.m.find(dict(_id=record._id)).one().mean_neutrality_slatkin)
+        self.assertEqual(1, data.PerGenerationStatsTraits.m.find().count())
+
+    def test_find_is_lazy(self):
+        for generation in [100, 200, 300]:
+            store_stats(generation, 0)
+        records = data.find_documents(data.PerGenerationStatsTraits, dict(mean_trait_richness=2.0))
+        self.assertFalse(isinstance(records, list))
+
+        # records can be updated while a query over them is being read
+        for record in data.PerGenerationStatsTraits.m.find(dict(replication=0)):
+            data.updateFieldPerGenerationStatsTraits(record._id, "mean_neutrality_slatkin", 0.5)
+        self.assertEqual(3, data.PerGenerationStatsTraits.m.find(dict(mean_neutrality_slatkin=0.5)).count())
+        self.assertEqual(3, len(list(records)))
+
+    def test_unsupported_update_operators(self):
+        store_stats(100, 0)
+        collection = data.PerGenerationStatsTraits.m.collection
+        self.assertRaises(ValueError, collection.update, dict(simulation_time=100), {'$inc': dict(replication=1)})
+        self.assertRaises(ValueError, collection.update, dict(simulation_time=100),
+                          {'$set': dict(replication=2), '$unset': dict(mean_trait_richness=1)})
+        self.assertEqual(0, data.PerGenerationStatsTraits.m.find(dict(simulation_time=100)).one().replication)
+
+    def test_backend_operations(self):
+        self.backend.insert(data.PerGenerationStatsTraits,
+                            [dict(simulation_run_id="run%s" % (i % 2), simulation_time=i, mean_trait_richness=i % 3)
+                             for i in range(0, 10)])
+        records = data.find_documents(data.PerGenerationStatsTraits,
+                                      dict(simulation_run_id="run1", simulation_time={'$gt': 2}, mean_trait_richness={'$ne': 0}),
+                                      sort="simulation_time", limit=2)
+        self.assertEqual([5, 7], [record.simulation_time for record in records])
+
+        self.backend.update(data.PerGenerationStatsTraits, dict(simulation_run_id="run0"), dict(replication=3))
+        self.backend.remove(data.PerGenerationStatsTraits, dict(simulation_time={'$lt': 5}))
+        records = data.find_documents(data.PerGenerationStatsTraits, dict(replication=3), sort="simulation_time")
+        self.assertEqual([6, 8], [record.simulation_time for record in records])
+
+    def test_ensure_indexes(self):
+        data.ensure_indexes()
+        names = [row[0] for row in self.backend._get_connection().execute("SELECT name FROM sqlite_master WHERE type='index'")]
+        self.assertTrue(any(name.endswith("__classification_id_simulation_run_id_simulation_time_replication_sample_size")
+                            for name in names))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+# Copyright (c) 2013.  Mark E. Madsen <mark@madsenlab.org>
+#
+# This work is licensed under the terms of the Creative Commons-GNU General Public License 2.0, as "non-commercial/sharealike".  You may use, modify, and distribute this software for non-commercial purposes, and you must distribute any modifications under the same license.
+#
+# For detailed license terms, see:
+# http://creativecommons.org/licenses/GPL/2.0/
+
+
+import unittest
+import shutil
+import tempfile
+import ctpy.data as data
+import ctpy.data.storage_backend as sb
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+def raw_sample(run, generation, genotypes):
+    return dict(simulation_time=generation, replication=0, dimensionality=2, sample_size=len(genotypes),
+                population_size=100, mutation_rate=0.01, simulation_run_id=run,
+                sample=[dict(id=idx, genotype=genotype) for idx, genotype in enumerate(genotypes)])
+
+
+class MatchQueryTest(unittest.TestCase):
+
+    def test_equality_and_operators(self):
+        doc = dict(simulation_run_id="a", simulation_time=500, replication=2)
+        self.assertTrue(sb.match_query(doc, dict(simulation_run_id="a", simulation_time={'$gt': 100, '$lte': 500})))
+        self.assertFalse(sb.match_query(doc, dict(simulation_time={'$gt': 500})))
+        self.assertTrue(sb.match_query(doc, dict(replication={'$in': [1, 2]})))
+        self.assertFalse(sb.match_query(doc, dict(missing={'$gte': 0})))
+
+
+@unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+class ColumnarBackendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.backend = data.configure_storage_backend("columnar", self.directory)
+        self.backend.insert(data.IndividualSample, [raw_sample("run1", 100, [[1, 2], [3, 4]]),
+                                                    raw_sample("run1", 200, [[5, 6], [7, 8]]),
+                                                    raw_sample("run2", 100, [[9, 9], [9, 9]])])
+
+    def tearDown(self):
+        data.configure_storage_backend("mongodb")
+        shutil.rmtree(self.directory)
+
+    def test_find_roundtrip(self):
+        records = data.find_documents(data.IndividualSample, dict(simulation_run_id="run1"), sort="simulation_time")
+        self.assertEqual([100, 200], [record.simulation_time for record in records])
+        self.assertEqual([[5, 6], [7, 8]], data.get_genotype_matrix(records[1]).tolist())
+        self.assertEqual(1, len(list(data.find_documents(data.IndividualSample, dict(simulation_time={'$gt': 100})))))
+
+    def test_unsorted_find_is_lazy(self):
+        records = data.find_documents(data.IndividualSample)
+        self.assertFalse(isinstance(records, list))
+        self.assertEqual(3, len(list(records)))
+        self.assertEqual(2, len(list(data.find_documents(data.IndividualSample, limit=2))))
+
+    def test_find_in_batches(self):
+        check_batches(self, self.backend)
+
+    def test_update_and_remove(self):
+        self.backend.update(data.IndividualSample, dict(simulation_run_id="run2"), dict(replication=5))
+        self.backend.remove(data.IndividualSample, dict(simulation_run_id="run1", simulation_time=100))
+        records = data.find_documents(data.IndividualSample, sort="simulation_time")
+        self.assertEqual([(100, 5), (200, 0)], [(record.simulation_time, record.replication) for record in records])
+
+
+def check_batches(test, backend):
+    backend.insert(data.IndividualSample, [raw_sample("run3", generation, [[1, 1], [2, 2]]) for generation in [100, 200]])
+    ids = sorted(str(record._id) for record in data.find_documents(data.IndividualSample))
+
+    batches = list(data.find_documents_in_batches(data.IndividualSample, batch_size=2))
+    test.assertEqual([2, 2, 1], [len(batch) for batch in batches])
+    test.assertEqual(ids, [str(record._id) for batch in batches for record in batch])
+
+    batches = list(data.find_documents_in_batches(data.IndividualSample, dict(_id={'$gt': ids[1]}), batch_size=2))
+    test.assertEqual(ids[2:], [str(record._id) for batch in batches for record in batch])
+
+
+class DefaultBatchesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.backend = data.configure_storage_backend("sqlite", self.directory)
+        self.backend.insert(data.IndividualSample, [raw_sample("run1", 100, [[1, 2], [3, 4]]),
+                                                    raw_sample("run1", 200, [[5, 6], [7, 8]]),
+                                                    raw_sample("run2", 100, [[9, 9], [9, 9]])])
+
+    def tearDown(self):
+        data.configure_storage_backend("mongodb")
+        shutil.rmtree(self.directory)
+
+    def test_find_in_batches(self):
+        check_batches(self, self.backend)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+# Copyright (c) 2013.  Mark E. Madsen <mark@madsenlab.org>
+#
+# This work is licensed under the terms of the Creative Commons-GNU General Public License 2.0, as "non-commercial/sharealike".  You may use, modify, and distribute this software for non-commercial purposes, and you must distribute any modifications under the same license.
+#
+# For detailed license terms, see:
+# http://creativecommons.org/licenses/GPL/2.0/
+
+
+import unittest
+import numpy as np
+import ctpy.data as data
+from sample_fixtures import FakeRawSample
+
+
+class SubsampleViewTest(unittest.TestCase):
+
+    def setUp(self):
+        self.record = FakeRawSample([[1, 5, 7, 9],
+                                     [1, 6, 7, 9],
+                                     [2, 5, 8, 9],
+                                     [1, 5, 7, 3]])
+
+    def test_view_slices_raw_matrix(self):
+        raw = data.get_genotype_matrix(self.record)
+        view = data.SubsampleView(self.record, 3, 2, raw)
+        self.assertEqual(3, view.sample_size)
+        self.assertEqual(2, view.dimensionality)
+        self.assertEqual(1200, view.simulation_time)
+        self.assertEqual([[1, 5], [1, 6], [2, 5]], data.get_genotype_matrix(view).tolist())
+        self.assertTrue(np.may_share_memory(raw, view.genotype_matrix()))
+
+    def test_view_sample_matches_fulldataset(self):
+        view = data.SubsampleView(self.record, 2, 3)
+        self.assertEqual([0, 1], [indiv.id for indiv in view.sample])
+        self.assertEqual([[1, 5, 7], [1, 6, 7]], [indiv.genotype for indiv in view.sample])
+
+    def test_iter_subsample_views(self):
+        views = list(data.iter_subsample_views([self.record], [2, 4, 8], [3, 4]))
+        combos = [(view.sample_size, view.dimensionality) for view in views]
+        self.assertEqual([(2, 3), (2, 4), (4, 3), (4, 4)], combos)
+
+    def test_subsample_fields_match_views(self):
+        # combinations larger than the raw sample are skipped by both
+        documents = data.subsample_fields(self.record, [2, 4, 8], [1, 3, 5])
+        views = list(data.iter_subsample_views([self.record], [2, 4, 8], [1, 3, 5]))
+        self.assertEqual(4, len(documents))
+        self.assertEqual(len(views), len(documents))
+        for document, view in zip(documents, views):
+            self.assertEqual((view.sample_size, view.dimensionality), (document["sample_size"], document["dimensionality"]))
+            self.assertEqual([(indiv.id, indiv.genotype) for indiv in view.sample],
+                             [(indiv["id"], indiv["genotype"]) for indiv in document["sample"]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,37 @@
+# Copyright (c) 2013.  Mark E. Madsen <mark@madsenlab.org>
+#
+# This work is licensed under the terms of the Creative Commons-GNU General Public License 2.0, as "non-commercial/sharealike".  You may use, modify, and distribute this software for non-commercial purposes, and you must distribute any modifications under the same license.
+#
+# For detailed license terms, see:
+# http://creativecommons.org/licenses/GPL/2.0/
+
+
+import unittest
+import itertools
+import ctpy.utils as utils
+import ctpy.math as cpm
+
+
+class SweepScheduleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.combinations = list(itertools.product([0.0001, 0.001, 0.01], [500, 5000]))
+
+    def test_longest_first(self):
+        ordered = utils.order_longest_first(self.combinations,
+                                            lambda mut, popsize: cpm.expectedIARunCost(popsize, mut, 10000))
+        self.assertEqual((0.0001, 5000), ordered[0])
+        self.assertEqual((0.01, 500), ordered[-1])
+        costs = [cpm.expectedIARunCost(popsize, mut, 10000) for (mut, popsize) in ordered]
+        self.assertEqual(sorted(costs, reverse=True), costs)
+
+    def test_seeds_are_deterministic_and_distinct(self):
+        seeds = [utils.combination_seed(1, params) for params in self.combinations]
+        self.assertEqual(seeds, [utils.combination_seed(1, params) for params in self.combinations])
+        self.assertEqual(len(seeds), len(set(seeds)))
+        self.assertNotEqual(seeds, [utils.combination_seed(2, params) for params in self.combinations])
+        self.assertTrue(all(0 < seed < 2 ** 31 for seed in seeds))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+# Copyright (c) 2013.  Mark E. Madsen <mark@madsenlab.org>
+#
+# This work is licensed under the terms of the Creative Commons-GNU General Public License 2.0, as "non-commercial/sharealike".  You may use, modify, and distribute this software for non-commercial purposes, and you must distribute any modifications under the same license.
+#
+# For detailed license terms, see:
+# http://creativecommons.org/licenses/GPL/2.0/
+
+
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+import ctpy.data as data
+import ctpy.math as cpm
+import ctpy.utils as utils
+from sample_fixtures import FakeRawSample
+
+
+class TraitStatisticsPerRawSampleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        data.configure_storage_backend("sqlite", self.directory)
+        config_file = os.path.join(self.directory, "config.json")
+        with open(config_file, "w") as f:
+            f.write('{ "SLATKIN_MONTECARLO_REPLICATES" : 200, "SLATKIN_IMPLEMENTATION" : "numpy" }')
+        self.simconfig = utils.CTPyConfiguration(config_file)
+        rng = np.random.RandomState(42)
+        self.record = FakeRawSample(rng.randint(0, 6, size=(20, 4)).tolist())
+
+    def tearDown(self):
+        data.configure_storage_backend("mongodb")
+        shutil.rmtree(self.directory)
+
+    def test_subsamples_match_views(self):
+        sizes = [5, 10, 20, 40]
+        dims = [2, 4]
+        engine = cpm.TraitStatisticsPerRawSample(self.simconfig, self.record, sizes, dims)
+        self.assertEqual(6, engine.process_trait_statistics())
+
+        stored = dict()
+        for r in data.PerGenerationStatsTraits.m.find():
+            stored[(r.sample_size, r.dimensionality)] = r
+        self.assertEqual(6, len(stored))
+
+        for view in data.iter_subsample_views([self.record], sizes, dims):
+            r = stored[(view.sample_size, view.dimensionality)]
+            self.assertEqual((1200, 2, 100, "urn:uuid:test"),
+                             (r.simulation_time, r.replication, r.population_size, r.simulation_run_id))
+
+            (counts, offsets) = cpm.trait_counts_by_locus(data.get_genotype_matrix(view))
+            (entropy, iqv, richness) = cpm.diversity_statistics_batch(counts, offsets)
+            self.assertEqual(richness.tolist(), r.loci_trait_richness)
+            self.assertTrue(np.allclose(entropy, r.loci_evenness_shannon_entropy))
+            self.assertTrue(np.allclose(iqv, r.loci_evenness_iqv))
+            self.assertAlmostEqual(np.mean(entropy), r.mean_evenness_shannon_entropy)
+
+            # the shared cache returns the same result for the same configuration of counts
+            slatkin = cpm.slatkin_exact_test_batch(self.simconfig, np.split(counts, offsets[1:-1]))
+            self.assertEqual([prob for (prob, theta, replicates) in slatkin], r.loci_neutrality_slatkin)
+
+
+if __name__ == "__main__":
+    unittest.main()
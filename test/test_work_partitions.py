@@ -0,0 +1,46 @@
+# Copyright (c) 2013.  Mark E. Madsen <mark@madsenlab.org>
+#
+# This work is licensed under the terms of the Creative Commons-GNU General Public License 2.0, as "non-commercial/sharealike".  You may use, modify, and distribute this software for non-commercial purposes, and you must distribute any modifications under the same license.
+#
+# For detailed license terms, see:
+# http://creativecommons.org/licenses/GPL/2.0/
+
+
+import unittest
+import ctpy.data as data
+
+
+class WorkPartitionsTest(unittest.TestCase):
+
+    def test_one_shard_per_run(self):
+        runs = ["a", "b", "c", "d", "e"]
+        shards = data.partition_by_simulation_run(runs, 10, 4)
+        self.assertEqual([dict(simulation_run_id=r) for r in runs], shards)
+
+    def test_replication_ranges(self):
+        shards = data.partition_by_simulation_run(["a", "b"], 10, 8)
+        self.assertEqual(8, len(shards))
+        # the replication ranges for each run must cover 0..9 exactly once
+        for run in ["a", "b"]:
+            covered = []
+            for shard in shards:
+                if shard["simulation_run_id"] == run:
+                    covered.extend(range(shard["replication"]["$gte"], shard["replication"]["$lt"]))
+            self.assertEqual(range(0, 10), covered)
+
+    def test_more_shards_than_replications(self):
+        shards = data.partition_by_simulation_run(["a"], 3, 8)
+        self.assertEqual(3, len(shards))
+
+    def test_no_runs(self):
+        self.assertEqual([], data.partition_by_simulation_run([], 10, 4))
+
+    def test_partition_key_is_stable(self):
+        shard = dict(simulation_run_id="a", replication={'$gte': 0, '$lt': 5})
+        same = dict(replication={'$lt': 5, '$gte': 0}, simulation_run_id="a")
+        self.assertEqual(data.partition_key("retrofit", shard), data.partition_key("retrofit", same))
+        self.assertNotEqual(data.partition_key("retrofit", shard), data.partition_key("other", shard))
+
+
+if __name__ == "__main__":
+    unittest.main()
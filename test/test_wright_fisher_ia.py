@@ -0,0 +1,81 @@
+# Copyright (c) 2013.  Mark E. Madsen <mark@madsenlab.org>
+#
+# This work is licensed under the terms of the Creative Commons-GNU General Public License 2.0, as "non-commercial/sharealike".  You may use, modify, and distribute this software for non-commercial purposes, and you must distribute any modifications under the same license.
+#
+# For detailed license terms, see:
+# http://creativecommons.org/licenses/GPL/2.0/
+
+
+import unittest
+import numpy as np
+import ctpy.simulation as simulation
+import ctpy.utils as utils
+
+
+class WrightFisherIAEngineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.initial = utils.constructUniformAllelicDistribution(10)
+
+    def test_initial_population(self):
+        engine = simulation.WrightFisherIAEngine(200, 0.01, 4, 3, self.initial, seed=1)
+        self.assertEqual((3, 200, 4), engine.genotypes.shape)
+        self.assertTrue(engine.genotypes.min() >= 0)
+        self.assertTrue(engine.genotypes.max() < 10)
+        self.assertEqual(10, engine.next_allele)
+
+    def test_drift_without_mutation(self):
+        engine = simulation.WrightFisherIAEngine(50, 0.0, 2, 2, self.initial, seed=1)
+        previous = [len(counts) for rep in range(0, 2) for counts in engine.census_counts(rep)]
+        engine.evolve(20)
+        current = [len(counts) for rep in range(0, 2) for counts in engine.census_counts(rep)]
+        self.assertTrue(all(c <= p for (c, p) in zip(current, previous)))
+        self.assertEqual(10, engine.next_allele)
+        self.assertEqual(20, engine.generation)
+
+    def test_mutations_are_new_alleles(self):
+        engine = simulation.WrightFisherIAEngine(100, 1.0, 3, 2, self.initial, seed=1)
+        engine.step()
+        # every locus of every individual mutated, to an allele never seen before
+        self.assertEqual(2 * 100 * 3, len(np.unique(engine.genotypes)))
+        self.assertTrue(engine.genotypes.min() >= 10)
+        self.assertEqual(10 + 2 * 100 * 3, engine.next_allele)
+
+    def test_observers(self):
+        calls = []
+
+        def observer(pop, param):
+            calls.append((pop.dvars().gen, pop.dvars().rep, param, pop.sample(5).shape))
+            return True
+
+        engine = simulation.WrightFisherIAEngine(100, 0.01, 3, 2, self.initial, seed=1)
+        engine.evolve(10, [(observer, "p", 4, 3)])
+        self.assertEqual([(4, 0), (4, 1), (7, 0), (7, 1)], [(c[0], c[1]) for c in calls])
+        self.assertEqual((5, 3), calls[0][3])
+
+    def test_seed_is_reproducible(self):
+        first = simulation.WrightFisherIAEngine(100, 0.01, 3, 2, self.initial, seed=7)
+        second = simulation.WrightFisherIAEngine(100, 0.01, 3, 2, self.initial, seed=7)
+        first.evolve(10)
+        second.evolve(10)
+        self.assertTrue(np.array_equal(first.genotypes, second.genotypes))
+
+    def test_sample_richness_at_stationarity(self):
+        # at stationarity, the expected number of traits in a sample of n is sum(theta / (theta + i)), theta = 2N mu
+        (popsize, mutation, ssize) = (100, 0.01, 20)
+        theta = 2.0 * popsize * mutation
+        expected = sum(theta / (theta + i) for i in range(0, ssize))
+
+        engine = simulation.WrightFisherIAEngine(popsize, mutation, 10, 20, self.initial, seed=1)
+        engine.evolve(1000)
+        richness = []
+        for observation in range(0, 10):
+            engine.evolve(50)
+            for rep in range(0, 20):
+                sample = engine.sample(rep, ssize)
+                richness.extend(len(np.unique(sample[:, locus])) for locus in range(0, 10))
+        self.assertAlmostEqual(1.0, np.mean(richness) / expected, delta=0.05)
+
+
+if __name__ == "__main__":
+    unittest.main()